@@ -0,0 +1,105 @@
+"""Coalescing of Telegram albums (media groups) into single posts.
+
+A channel post with several photos or videos arrives as one message per
+item, all sharing a grouped_id, usually with the caption on only one of
+them. AlbumCoalescer holds those messages until the album has been quiet
+for a short window and hands it to a callback once, so it is stored,
+notified and summarized as one post instead of a row per item.
+"""
+import asyncio
+import logging
+import re
+import time
+
+from metrics import ALBUM_MESSAGES, ALBUMS
+
+logger = logging.getLogger(__name__)
+
+# The media count album_content() puts after the captions
+ALBUM_LABEL_RE = re.compile(r'(?:^|\n)\[Media album, \d+ items\]$')
+
+
+def album_content(messages) -> str:
+    """Post text of an album: its distinct captions in message order, then the number of media items."""
+    captions = list(dict.fromkeys(message.text.strip() for message in messages if message.text and message.text.strip()))
+    label = f"[Media album, {sum(1 for message in messages if message.media)} items]"
+    return "\n\n".join(captions) + f"\n{label}" if captions else label
+
+
+def album_captions(content: str) -> str:
+    """Post text without the album media count: the captions only ('' for a caption-less album)."""
+    return ALBUM_LABEL_RE.sub('', content)
+
+
+class _Album:
+    __slots__ = ('channel', 'messages', 'started', 'timer')
+
+    def __init__(self, channel, started: float):
+        self.channel = channel
+        self.messages = []
+        self.started = started
+        self.timer = None
+
+
+class AlbumCoalescer:
+    """Buffers album messages per (channel, grouped_id) and emits each album once.
+
+    An album is handed to `on_album(channel, messages)` (messages in ID order)
+    `window_seconds` after its last message arrived, and never later than
+    `max_wait_seconds` after its first. Messages without a grouped_id are not
+    buffered: add() returns False and the caller handles them as before.
+    """
+
+    def __init__(self, on_album, window_seconds: float = 1.5, max_wait_seconds: float = 10.0):
+        self.on_album = on_album
+        self.window_seconds = window_seconds
+        self.max_wait_seconds = max_wait_seconds
+        self._pending = {}
+
+    def __len__(self):
+        return len(self._pending)
+
+    def add(self, channel, message) -> bool:
+        """Buffer `message` if it belongs to an album; returns whether it was taken."""
+        grouped_id = getattr(message, 'grouped_id', None)
+        if not grouped_id or self.window_seconds <= 0:
+            return False
+        key = (channel.id, grouped_id)
+        now = time.monotonic()
+        album = self._pending.get(key)
+        if album is None:
+            album = self._pending[key] = _Album(channel, now)
+        album.messages.append(message)
+        if album.timer is not None:
+            album.timer.cancel()
+        delay = min(self.window_seconds, max(0.0, album.started + self.max_wait_seconds - now))
+        album.timer = asyncio.create_task(self._flush_later(key, delay))
+        return True
+
+    async def _flush_later(self, key, delay: float):
+        try:
+            await asyncio.sleep(delay)
+        except asyncio.CancelledError:
+            return
+        await self.flush(key)
+
+    async def flush(self, key):
+        """Emit the album under `key` now (if still pending)."""
+        album = self._pending.pop(key, None)
+        if album is None:
+            return
+        if album.timer is not None and album.timer is not asyncio.current_task():
+            album.timer.cancel()
+        messages = sorted({message.id: message for message in album.messages}.values(), key=lambda m: m.id)
+        if len(messages) > 1:
+            ALBUMS.inc()
+            ALBUM_MESSAGES.inc(len(messages))
+        try:
+            await self.on_album(album.channel, messages)
+        except Exception as e:
+            logger.error(f"Error handling album {key[1]} of {getattr(album.channel, 'title', key[0])}: {e}")
+
+    async def close(self):
+        """Emit every pending album (on shutdown, once no more messages can arrive)."""
+        for key in list(self._pending):
+            await self.flush(key)
@@ -0,0 +1,117 @@
+import asyncio
+import logging
+import time
+from datetime import datetime, timedelta, timezone
+
+import telethon.errors
+
+logger = logging.getLogger(__name__)
+
+
+def channel_reference(channel):
+    """CHANNELS entries are @usernames or numeric IDs; Telethon needs IDs as ints."""
+    if isinstance(channel, int):
+        return channel
+    return int(channel) if channel.lstrip('-').isdigit() else channel
+
+
+class Backfiller:
+    """Fetches channel posts published while the bot was not running.
+
+    A channel with a watermark (the last message ID stored for it) is read
+    upward from it, oldest first, so nothing after the watermark is skipped;
+    more than `max_gap_messages` missed messages are cut off with a warning.
+    A channel without one gets its newest `max_messages` messages, no further
+    back than `max_age_hours`. Channels are processed `concurrency` at a time.
+    A FloodWaitError pauses only the channel that hit it (up to
+    `max_flood_wait` seconds) while the other workers continue. Fetched
+    messages are handed to `save_message` oldest first, i.e. the same path as
+    live posts.
+    """
+
+    def __init__(self, client, save_message, concurrency: int = 8, max_messages: int = 500,
+                 max_age_hours: float = 24.0, max_flood_wait: float = 300.0, max_gap_messages: int = 20000):
+        self.client = client
+        self.save_message = save_message
+        self.concurrency = concurrency
+        self.max_messages = max_messages
+        self.max_age_hours = max_age_hours
+        self.max_flood_wait = max_flood_wait
+        self.max_gap_messages = max_gap_messages
+
+    async def run(self, channels, watermarks: dict) -> dict:
+        """Backfill every channel in `channels`.
+
+        Args:
+            channels: Channel references or resolved peer IDs
+            watermarks: Channel ID -> last stored message ID, read before live ingestion started
+
+        Returns:
+            dict: Report with per-run totals
+        """
+        started = time.perf_counter()
+        semaphore = asyncio.Semaphore(self.concurrency)
+        report = {'channels': len(channels), 'messages': 0, 'failed': [], 'flood_waits': 0}
+
+        async def bounded(channel):
+            async with semaphore:
+                try:
+                    fetched = await self._backfill_channel(channel, watermarks, report)
+                    report['messages'] += fetched
+                except Exception as e:
+                    report['failed'].append(channel)
+                    logger.error(f"Backfill of channel {channel} failed: {e}")
+
+        await asyncio.gather(*(bounded(channel) for channel in channels))
+        report['elapsed_seconds'] = time.perf_counter() - started
+        logger.info(
+            f"Backfilled {report['messages']} posts from {report['channels']} channels in {report['elapsed_seconds']:.1f}s "
+            f"(failed: {len(report['failed'])}, flood waits: {report['flood_waits']})"
+        )
+        return report
+
+    async def _backfill_channel(self, channel, watermarks: dict, report: dict) -> int:
+        entity = None
+        saved = 0
+        while True:
+            try:
+                if entity is None:
+                    entity = await self.client.get_entity(channel_reference(channel))
+                    watermark = start = watermarks.get(str(entity.id))
+                if watermark is None:
+                    messages = await self._fetch_recent(entity)
+                    for message in reversed(messages):
+                        await self.save_message(entity, message)
+                    saved = len(messages)
+                else:
+                    # Oldest first from the watermark; after a FloodWait, resume past the last saved message
+                    async for message in self.client.iter_messages(
+                            entity, min_id=watermark, reverse=True, limit=self.max_gap_messages - saved):
+                        await self.save_message(entity, message)
+                        watermark = message.id
+                        saved += 1
+                    if saved >= self.max_gap_messages:
+                        logger.warning(
+                            f"Backfill of {getattr(entity, 'title', channel)} stopped at {saved} messages "
+                            f"(BACKFILL_MAX_GAP_MESSAGES): posts after message {watermark} up to the live ones are skipped"
+                        )
+                break
+            except telethon.errors.FloodWaitError as e:
+                report['flood_waits'] += 1
+                if e.seconds > self.max_flood_wait:
+                    raise
+                logger.warning(f"FloodWait while backfilling {channel}: retrying in {e.seconds}s")
+                await asyncio.sleep(e.seconds)
+        if saved:
+            logger.info(f"Backfilled {saved} posts from {getattr(entity, 'title', channel)} (after message {start})")
+        return saved
+
+    async def _fetch_recent(self, entity) -> list:
+        """The newest messages of a channel without a watermark, newest first."""
+        since = datetime.now(timezone.utc) - timedelta(hours=self.max_age_hours)
+        messages = []
+        async for message in self.client.iter_messages(entity, limit=self.max_messages):
+            if message.date < since:
+                break
+            messages.append(message)
+        return messages
@@ -0,0 +1,101 @@
+"""Benchmark the hot posts queries with and without the migration-2 indexes.
+
+Usage (from the repository root):
+    python -m benchmarks.bench_post_queries --posts 1000000
+"""
+import argparse
+import os
+import sqlite3
+import statistics
+import tempfile
+import time
+from datetime import timedelta
+
+from benchmarks.synthetic import SyntheticPosts
+from migrations import apply_migrations
+from storage import (
+    SQL_COUNT_UNSENT, SQL_EARLIEST_UNSENT,
+    SQL_SELECT_SINCE, SQL_SELECT_UNSENT, SQL_UNSENT_BY_CHANNEL_SINCE,
+)
+
+# Insert against the schema-v1 columns the database is built with
+SQL_INSERT_POST_V1 = 'INSERT INTO posts (channel_id, channel_title, timestamp, content, post_link, sent) VALUES (?, ?, ?, ?, ?, FALSE)'
+
+
+def build_database(path: str, posts: int, channels: int, unsent: int, days: int, seed: int):
+    """Fill a fresh schema-v1 (index-free) database with synthetic posts."""
+    synthetic = SyntheticPosts(channels=channels, days=days, seed=seed)
+    conn = sqlite3.connect(path)
+    conn.execute('PRAGMA journal_mode = WAL')
+    conn.execute('PRAGMA synchronous = OFF')
+    apply_migrations(conn, target_version=1)
+    conn.execute('BEGIN')
+    conn.executemany(SQL_INSERT_POST_V1, (row[:5] for row in synthetic.rows(posts)))
+    # Only the newest `unsent` posts are still waiting for a digest
+    conn.execute('UPDATE posts SET sent = TRUE WHERE id <= ?', (posts - unsent,))
+    conn.commit()
+    conn.close()
+    return synthetic.end
+
+
+def time_query(conn, sql: str, params: tuple, repeat: int) -> float:
+    """Median wall time in milliseconds of executing `sql` and fetching all rows."""
+    samples = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        conn.execute(sql, params).fetchall()
+        samples.append((time.perf_counter() - started) * 1000)
+    return statistics.median(samples)
+
+
+def run_queries(conn, window_start: str, repeat: int) -> dict:
+    queries = {
+        'get_unsent_posts': (SQL_SELECT_UNSENT, ()),
+        'manual digest window (4h)': (SQL_SELECT_SINCE, (window_start,)),
+        'count_unsent_posts COUNT': (SQL_COUNT_UNSENT, ()),
+        'count_unsent_posts MIN': (SQL_EARLIEST_UNSENT, ()),
+        'status per-channel': (SQL_UNSENT_BY_CHANNEL_SINCE, (window_start,)),
+    }
+    results = {}
+    for name, (sql, params) in queries.items():
+        plan = ' | '.join(row[3] for row in conn.execute(f'EXPLAIN QUERY PLAN {sql}', params))
+        results[name] = (time_query(conn, sql, params, repeat), plan)
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--posts', type=int, default=1_000_000)
+    parser.add_argument('--channels', type=int, default=200)
+    parser.add_argument('--unsent', type=int, default=2_000, help='number of newest posts left unsent')
+    parser.add_argument('--days', type=int, default=365)
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--seed', type=int, default=42)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, 'bench.db')
+        print(f"Building database with {args.posts} posts ({args.unsent} unsent, {args.channels} channels)...")
+        end = build_database(path, args.posts, args.channels, args.unsent, args.days, args.seed)
+        window_start = (end - timedelta(hours=4)).isoformat()
+
+        conn = sqlite3.connect(path)
+        before = run_queries(conn, window_start, args.repeat)
+        started = time.perf_counter()
+        apply_migrations(conn)
+        print(f"Applied index migrations in {time.perf_counter() - started:.2f} s")
+        conn.execute('ANALYZE')
+        after = run_queries(conn, window_start, args.repeat)
+        conn.close()
+
+    print(f"\n{'query':<28} {'no index ms':>12} {'indexed ms':>12} {'speedup':>9}")
+    for name in before:
+        old_ms, _ = before[name]
+        new_ms, plan = after[name]
+        speedup = old_ms / new_ms if new_ms else float('inf')
+        print(f"{name:<28} {old_ms:>12.2f} {new_ms:>12.2f} {speedup:>8.0f}x")
+        print(f"    plan: {plan}")
+
+
+if __name__ == '__main__':
+    main()
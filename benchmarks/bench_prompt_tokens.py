@@ -0,0 +1,100 @@
+"""Measure the prompt tokens saved by ingestion-time compaction (compaction.py).
+
+Usage (from the repository root):
+    python -m benchmarks.bench_prompt_tokens --posts 200 2000 20000
+
+For a digest of N synthetic posts (see benchmarks/synthetic.py) this compares
+the previous prompt entries (raw text plus a "Link:" line per post, batches
+packed by re-estimating every entry) with the compacted entries built from
+the stored prompt text and token count. Tokens are counted with tiktoken for
+--model when it is installed, with the character estimate otherwise; the
+header line says which. The savings are split into dropped Link lines,
+compaction of the text and the per-post cap.
+"""
+import argparse
+import statistics
+import time
+from datetime import datetime
+
+from benchmarks.synthetic import SyntheticPosts
+from compaction import PromptCompactor, compact_text
+from summarizer import Summarizer
+
+
+def legacy_entry(number: int, post) -> str:
+    """Prompt entry as Summarizer.prepare built it before compaction."""
+    _, channel_title, timestamp, content, post_link = post
+    time_str = datetime.fromisoformat(timestamp).strftime('%H:%M')
+    return f"[{number}] [{time_str}] [{channel_title}] {content}\n   Link: {post_link}"
+
+
+def legacy_batches(entries, budget: int, count) -> int:
+    """Number of batches the previous build_batches packed (tokens re-counted per entry, no separators)."""
+    batches, current = 0, 0
+    for text in entries:
+        tokens = count(text)
+        if current and current + tokens > budget:
+            batches += 1
+            current = 0
+        current += tokens
+    return batches + (1 if current else 0)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--posts', type=int, nargs='+', default=[200, 2000, 20000])
+    parser.add_argument('--model', default='gpt-4o-mini')
+    parser.add_argument('--max-tokens', type=int, default=300, help='per-post cap (PROMPT_POST_MAX_TOKENS)')
+    parser.add_argument('--max-length', type=int, default=1500, help='longest synthetic post, characters')
+    parser.add_argument('--batch-tokens', type=int, default=12000)
+    parser.add_argument('--seed', type=int, default=42)
+    args = parser.parse_args()
+
+    compactor = PromptCompactor(args.model, max_tokens=args.max_tokens)
+    summarizer = Summarizer(None, args.model, prompt='', reduce_prompt='', batch_tokens=args.batch_tokens,
+                            compactor=compactor)
+    print(f"tokenizer: {compactor.tokenizer}, per-post cap: {args.max_tokens} tokens, batch budget: {args.batch_tokens}")
+    print(f"\n{'posts':>7} {'before':>10} {'after':>10} {'saved':>7} {'links':>7} {'compact':>8} {'cap':>7} "
+          f"{'batches':>9} {'us/post':>8}")
+    for size in args.posts:
+        synthetic = SyntheticPosts(max_length=args.max_length, seed=args.seed, compactor=compactor)
+        rows = list(synthetic.rows(size))
+        posts = [(i + 1, row[1], row[2], row[3], row[4]) for i, row in enumerate(rows)]
+        prompt_texts = {i + 1: (row[7], row[8]) for i, row in enumerate(rows)}
+
+        legacy = [legacy_entry(number, post) for number, post in enumerate(posts, start=1)]
+        before = sum(compactor.count(text) for text in legacy)
+        links = before - sum(compactor.count(text.rsplit("\n   Link: ", 1)[0]) for text in legacy)
+        compacted = sum(compactor.count(post[3]) - compactor.count(compact_text(post[3])) for post in posts)
+
+        entries, _ = summarizer.prepare(posts, prompt_texts=prompt_texts)
+        batches = summarizer.build_batches(entries)
+        after = sum(tokens for _, _, tokens in entries)
+        cap = before - after - links - compacted  # the per-post cap (plus rounding of the estimate)
+        # Packing uses the stored counts only; check them against the batches as they are sent
+        separator = compactor.count("\n\n")
+        packed = [sum(tokens for _, _, tokens in batch) + separator * (len(batch) - 1) for batch in batches]
+        sent = [compactor.count("\n\n".join(text for _, text, _ in batch)) for batch in batches]
+        assert max(packed) <= summarizer.posts_budget()
+
+        samples = []
+        for post in posts[:2000]:
+            started = time.perf_counter()
+            compactor.compact(post[3])
+            samples.append((time.perf_counter() - started) * 1e6)
+
+        print(
+            f"{size:>7} {before:>10} {after:>10} {(before - after) / before:>6.1%} {links / before:>6.1%} "
+            f"{compacted / before:>7.1%} {cap / before:>6.1%} "
+            f"{legacy_batches(legacy, summarizer.posts_budget(), compactor.count):>4}->{len(batches):<4} "
+            f"{statistics.median(samples):>8.1f}"
+        )
+        drift = [packed_tokens - sent_tokens for packed_tokens, sent_tokens in zip(packed, sent)]
+        if any(drift):
+            # Per-entry rounding of the estimate (or a tokenizer merge across a join)
+            print(f"        packed counts differ from the batches as sent by {min(drift)}..{max(drift)} tokens "
+                  f"(of {max(sent)})")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,72 @@
+"""Benchmark digest rendering: per-reference str.replace loop vs. the single-pass linker.
+
+Usage (from the repository root):
+    python -m benchmarks.bench_rendering --refs 500 2000 5000
+"""
+import argparse
+import random
+import statistics
+import time
+
+from rendering import MESSAGE_LIMIT, link_references, render_digest, split_message
+
+
+def legacy_link_references(summary: str, link_map: dict) -> str:
+    """The previous send_digest implementation: one str.replace over the whole text per reference."""
+    final_summary = summary
+    for num in sorted(link_map.keys(), reverse=True):
+        final_summary = final_summary.replace(f"[{num}]", f"[{num}]({link_map[num]})")
+    return final_summary
+
+
+def make_summary(refs: int, refs_per_topic: int, seed: int):
+    """Digest-shaped Markdown citing every reference once, and its link map."""
+    rng = random.Random(seed)
+    numbers = list(range(1, refs + 1))
+    rng.shuffle(numbers)
+    sections = ["🧠 AI Digest:"]
+    for topic, start in enumerate(range(0, refs, refs_per_topic), start=1):
+        group = numbers[start:start + refs_per_topic]
+        sentence = " ".join(rng.choice(["новости", "рынок", "модель", "обновление", "релиз"]) for _ in range(25))
+        sections.append(f"**📌 Topic {topic}: заголовок темы**  \n{sentence.capitalize()}. " + ", ".join(f"[{n}]" for n in group))
+    link_map = {n: f"https://t.me/channel_{n % 97}/{100000 + n}" for n in range(1, refs + 1)}
+    return "\n\n".join(sections), link_map
+
+
+def time_call(fn, repeat: int) -> float:
+    """Median wall time of fn() in milliseconds."""
+    samples = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        fn()
+        samples.append((time.perf_counter() - started) * 1000)
+    return statistics.median(samples)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--refs', type=int, nargs='+', default=[500, 2000, 5000])
+    parser.add_argument('--refs-per-topic', type=int, default=4)
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--seed', type=int, default=42)
+    args = parser.parse_args()
+
+    print(f"{'refs':>6} {'chars':>8} {'replace ms':>11} {'regex ms':>9} {'speedup':>8} {'split ms':>9} {'messages':>9} {'max len':>8}")
+    for refs in args.refs:
+        summary, link_map = make_summary(refs, args.refs_per_topic, args.seed)
+        legacy_ms = time_call(lambda: legacy_link_references(summary, link_map), args.repeat)
+        linked_ms = time_call(lambda: link_references(summary, link_map), args.repeat)
+        linked = link_references(summary, link_map)
+        split_ms = time_call(lambda: split_message(linked), args.repeat)
+        messages = render_digest(summary, link_map)
+        # Every reference must come out linked exactly once, and no message may exceed the limit
+        assert all(linked.count(f"[{n}]({url})") == 1 for n, url in link_map.items())
+        assert max(map(len, messages)) <= MESSAGE_LIMIT
+        print(
+            f"{refs:>6} {len(summary):>8} {legacy_ms:>11.2f} {linked_ms:>9.2f} {legacy_ms / linked_ms:>7.0f}x "
+            f"{split_ms:>9.2f} {len(messages):>9} {max(map(len, messages)):>8}"
+        )
+
+
+if __name__ == '__main__':
+    main()
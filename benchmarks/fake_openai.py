@@ -0,0 +1,156 @@
+"""Fake OpenAI chat-completions backend for exercising the summarization stages offline.
+
+Two ways to use it:
+
+* In process: ``FakeOpenAIClient()`` has the same ``chat.completions.create``
+  coroutine as ``openai.AsyncClient`` and can be passed straight to Summarizer.
+* Over HTTP: ``python -m benchmarks.fake_openai --port 8008`` serves
+  ``POST /v1/chat/completions``; run the bot or a script with
+  ``OPENAI_BASE_URL=http://127.0.0.1:8008/v1`` to point the real client at it.
+
+The fake "digest" lists every [n] reference found in the request, grouped in
+topics of a few references, so reference consistency through map and reduce
+can be checked. ``latency`` adds a fixed delay per call. Requests with
+``stream=True`` get the same text as chat.completion.chunk deltas of
+``STREAM_CHUNK_CHARS`` characters, ``chunk_latency`` seconds apart.
+"""
+import argparse
+import asyncio
+import json
+import re
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from types import SimpleNamespace
+
+REFERENCE_RE = re.compile(r'\[(\d+)\]')
+STREAM_CHUNK_CHARS = 12
+
+
+def fake_completion(messages, refs_per_topic: int = 3) -> str:
+    """Deterministic digest text covering every reference in the user message."""
+    user_text = next((m['content'] for m in reversed(messages) if m['role'] == 'user'), '')
+    refs = sorted({int(n) for n in REFERENCE_RE.findall(user_text)})
+    lines = ["🧠 AI Digest:", ""]
+    for topic, start in enumerate(range(0, len(refs), refs_per_topic), start=1):
+        group = refs[start:start + refs_per_topic]
+        lines.append(f"**📌 Topic {topic}: fake topic**  ")
+        lines.append("Fake summary sentence. " + ", ".join(f"[{n}]" for n in group))
+        lines.append("")
+    return "\n".join(lines).strip()
+
+
+def _response(content: str, prompt_chars: int):
+    return {
+        'id': 'fake-completion',
+        'object': 'chat.completion',
+        'created': int(time.time()),
+        'model': 'fake',
+        'choices': [{'index': 0, 'finish_reason': 'stop', 'message': {'role': 'assistant', 'content': content}}],
+        'usage': {'prompt_tokens': prompt_chars // 3, 'completion_tokens': len(content) // 3,
+                  'total_tokens': (prompt_chars + len(content)) // 3},
+    }
+
+
+def _chunk(piece: str):
+    return {
+        'id': 'fake-completion',
+        'object': 'chat.completion.chunk',
+        'created': int(time.time()),
+        'model': 'fake',
+        'choices': [{'index': 0, 'finish_reason': None, 'delta': {'content': piece}}],
+    }
+
+
+def _pieces(content: str):
+    return [content[i:i + STREAM_CHUNK_CHARS] for i in range(0, len(content), STREAM_CHUNK_CHARS)]
+
+
+class _Completions:
+    def __init__(self, owner):
+        self._owner = owner
+
+    async def create(self, model, messages, stream: bool = False, **kwargs):
+        self._owner.calls.append({'model': model, 'messages': messages, 'stream': stream, **kwargs})
+        if self._owner.latency:
+            await asyncio.sleep(self._owner.latency)
+        content = fake_completion(messages)
+        if stream:
+            return self._stream(content)
+        prompt_chars = sum(len(m['content']) for m in messages)
+        data = _response(content, prompt_chars)
+        return SimpleNamespace(
+            choices=[SimpleNamespace(message=SimpleNamespace(content=content), finish_reason='stop')],
+            usage=SimpleNamespace(**data['usage']),
+        )
+
+    async def _stream(self, content: str):
+        for piece in _pieces(content):
+            if self._owner.chunk_latency:
+                await asyncio.sleep(self._owner.chunk_latency)
+            yield SimpleNamespace(choices=[SimpleNamespace(delta=SimpleNamespace(content=piece), finish_reason=None)])
+
+
+class FakeOpenAIClient:
+    """In-process stand-in for openai.AsyncClient (chat completions only)."""
+
+    def __init__(self, latency: float = 0.0, chunk_latency: float = 0.0):
+        self.latency = latency
+        self.chunk_latency = chunk_latency
+        self.calls = []
+        self.chat = SimpleNamespace(completions=_Completions(self))
+
+
+class _Handler(BaseHTTPRequestHandler):
+    latency = 0.0
+    chunk_latency = 0.0
+
+    def do_POST(self):
+        if not self.path.rstrip('/').endswith('/chat/completions'):
+            self.send_error(404)
+            return
+        body = json.loads(self.rfile.read(int(self.headers.get('Content-Length', 0))))
+        if self.latency:
+            time.sleep(self.latency)
+        messages = body.get('messages', [])
+        content = fake_completion(messages)
+        if body.get('stream'):
+            self._send_stream(content)
+            return
+        payload = json.dumps(_response(content, sum(len(m['content']) for m in messages))).encode()
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def _send_stream(self, content: str):
+        # Server-sent events, as the OpenAI API streams chat.completion.chunk objects
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/event-stream')
+        self.send_header('Cache-Control', 'no-cache')
+        self.end_headers()
+        for piece in _pieces(content):
+            if self.chunk_latency:
+                time.sleep(self.chunk_latency)
+            self.wfile.write(f"data: {json.dumps(_chunk(piece))}\n\n".encode())
+            self.wfile.flush()
+        self.wfile.write(b"data: [DONE]\n\n")
+        self.close_connection = True
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8008)
+    parser.add_argument('--latency', type=float, default=0.0, help='seconds to wait before answering')
+    parser.add_argument('--chunk-latency', type=float, default=0.0, help='seconds between streamed chunks')
+    args = parser.parse_args()
+    _Handler.latency = args.latency
+    _Handler.chunk_latency = args.chunk_latency
+    server = ThreadingHTTPServer((args.host, args.port), _Handler)
+    print(f"Fake OpenAI endpoint on http://{args.host}:{args.port}/v1")
+    server.serve_forever()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,60 @@
+"""In-process stand-ins for the Telegram clients used by benchmarks.
+
+StubTelegramClient implements the TelegramClient methods the bot calls
+(send/edit/delete messages, entity lookup and history reads) without any
+network, counting what was sent. For OpenAI use fake_openai.FakeOpenAIClient.
+"""
+import asyncio
+import itertools
+from types import SimpleNamespace
+
+from benchmarks.fake_openai import FakeOpenAIClient  # noqa: F401  (re-exported for benchmarks)
+
+
+class StubTelegramClient:
+    def __init__(self, synthetic=None, history: int = 1000, latency: float = 0.0):
+        self.synthetic = synthetic
+        self.history = history
+        self.latency = latency
+        self._messages = None
+        self.sent = 0
+        self.sent_chars = 0
+        self.edits = 0
+        self._ids = itertools.count(1)
+
+    async def _wait(self):
+        if self.latency:
+            await asyncio.sleep(self.latency)
+
+    async def send_message(self, entity, message: str = '', **kwargs):
+        await self._wait()
+        self.sent += 1
+        self.sent_chars += len(message)
+        return SimpleNamespace(id=next(self._ids), chat_id=entity, text=message)
+
+    async def edit_message(self, entity, message, text: str = None, **kwargs):
+        await self._wait()
+        self.edits += 1
+        return SimpleNamespace(id=getattr(message, 'id', message), chat_id=entity, text=text)
+
+    async def delete_messages(self, entity, message_ids, **kwargs):
+        await self._wait()
+        return []
+
+    async def get_entity(self, entity):
+        await self._wait()
+        if self.synthetic is None:
+            raise ValueError(f"No synthetic channels to resolve {entity!r}")
+        index = int(str(entity).lstrip('@').rsplit('_', 1)[-1]) % self.synthetic.channels
+        return self.synthetic.channel(index)
+
+    async def get_messages(self, entity, limit: int = 100, min_id: int = 0, **kwargs):
+        await self._wait()
+        if self._messages is None:
+            self._messages = self.synthetic.messages(self.history)
+        messages = [m for m in self._messages if m.chat_id == entity.id and m.id > (min_id or 0)]
+        return messages[:limit]
+
+    async def iter_messages(self, entity, limit: int = 100, **kwargs):
+        for message in await self.get_messages(entity, limit=limit):
+            yield message
@@ -0,0 +1,282 @@
+"""Micro-benchmark suite for the storage, formatting and summarization hot paths.
+
+Usage (from the repository root):
+    python -m benchmarks.suite --sizes 1000 100000 1000000 --output bench.json
+    python -m benchmarks.suite --sizes 1000 100000 --output new.json --baseline bench.json
+
+For every size N a fresh database is filled with N synthetic posts (see
+benchmarks/synthetic.py) through Storage.save_posts, then each hot path is
+timed `--repeat` times (median, min, max in ms) and, unless --no-memory, run
+once more under tracemalloc for its peak allocation:
+
+    storage.save_posts       insert N posts in ingest-sized batches
+    storage.get_unsent_posts the newest --unsent posts are unsent, the rest sent
+    storage.get_posts_since  the manual /digest window (last 4 hours)
+    storage.search_posts     full-text search for two topic words over the last 7 days (as /search)
+    summarizer.prepare       prompt building from the stored prompt texts: numbering, link map, token batches
+    render_digest            reference linking and message splitting of a digest citing N posts
+    format_digest            the fallback digest of N posts (topic clustering included)
+    summarize_posts.cold     map-reduce over N posts against the stub OpenAI client, digest cache bypassed
+    summarize_posts.cached   the same call answered from the digest cache
+    send_digest              scheduled digest of N posts to --users recipients through the stub bot
+
+The format_digest, summarize_posts and send_digest paths run only up to --max-digest-posts posts
+(dense TF-IDF clustering and the full map-reduce are not meant for a 1M-post
+digest). OpenAI and Telegram are stubbed in-process, delivery rate limits are
+lifted and pre-summarization is off, so timings measure this code only.
+Results (with interpreter, SQLite and git revision) are written as JSON;
+--baseline prints the ratio against an earlier run.
+"""
+import argparse
+import asyncio
+import gc
+import inspect
+import json
+import logging
+import os
+import platform
+import sqlite3
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+from datetime import datetime, timedelta, timezone
+
+from benchmarks.bench_rendering import make_summary
+from benchmarks.stubs import FakeOpenAIClient, StubTelegramClient
+from benchmarks.synthetic import SyntheticPosts
+
+# main.py reads its configuration at import time
+BENCH_ENV = {
+    'TELEGRAM_API_ID': '1', 'TELEGRAM_API_HASH': 'bench', 'TELEGRAM_BOT_TOKEN': '1:bench',
+    'TELEGRAM_CHANNEL_USERNAMES': '@bench', 'OPENAI_API_KEY': 'bench',
+    'PRESUMMARY_ENABLED': 'false', 'DIGEST_WORKERS_ENABLED': 'false',
+    'DELIVERY_GLOBAL_RATE': '1000000', 'DELIVERY_PER_CHAT_INTERVAL': '0',
+}
+CAPPED = {'format_digest', 'summarize_posts.cold', 'summarize_posts.cached', 'send_digest'}
+
+
+async def measure(fn, repeat: int, memory: bool, setup=None) -> dict:
+    """Time fn() (sync or async) `repeat` times, then once under tracemalloc; `setup` runs untimed before each call."""
+    async def call():
+        result = fn()
+        if inspect.isawaitable(result):
+            result = await result
+        return result
+
+    samples = []
+    for _ in range(repeat):
+        if setup is not None:
+            await setup()
+        gc.collect()
+        started = time.perf_counter()
+        await call()
+        samples.append((time.perf_counter() - started) * 1000)
+    result = {
+        'median_ms': round(statistics.median(samples), 3),
+        'min_ms': round(min(samples), 3),
+        'max_ms': round(max(samples), 3),
+        'samples_ms': [round(sample, 3) for sample in samples],
+    }
+    if memory:
+        if setup is not None:
+            await setup()
+        gc.collect()
+        tracemalloc.start()
+        try:
+            await call()
+            result['peak_kib'] = round(tracemalloc.get_traced_memory()[1] / 1024, 1)
+        finally:
+            tracemalloc.stop()
+    return result
+
+
+async def bench_size(main, args, size: int, workdir: str) -> list:
+    from search import match_expression
+    from storage import Storage
+
+    synthetic = SyntheticPosts(channels=args.channels, min_length=args.min_length, max_length=args.max_length,
+                               days=args.days, seed=args.seed)
+    results = []
+
+    def record(path, **values):
+        entry = {'path': path, 'size': size, **values}
+        results.append(entry)
+        timing = f"{values['median_ms']:>11.2f} ms" if 'median_ms' in values else f"{'skipped':>14}"
+        memory = f"{values['peak_kib'] / 1024:>9.1f} MiB" if 'peak_kib' in values else ''
+        print(f"{size:>9} {path:<26} {timing} {memory}", flush=True)
+
+    # storage.save_posts: only the save calls are timed, not generating the rows
+    runs = {'n': 0}
+    db_path = os.path.join(workdir, f'bench-{size}.db')
+
+    async def save_all():
+        runs['n'] += 1
+        path = os.path.join(workdir, f'save-{size}-{runs["n"]}.db')
+        storage = Storage(path)
+        await storage.open()
+        elapsed = 0.0
+        for batch in synthetic.batches(size, main.settings.ingest_batch_size):
+            started = time.perf_counter()
+            await storage.save_posts(batch)
+            elapsed += time.perf_counter() - started
+        await storage.close()
+        os.replace(path, db_path)
+        for suffix in ('-wal', '-shm'):
+            if os.path.exists(path + suffix):
+                os.remove(path + suffix)
+        return elapsed
+
+    save_samples = [await save_all() * 1000 for _ in range(args.repeat)]
+    entry = {
+        'median_ms': round(statistics.median(save_samples), 3), 'min_ms': round(min(save_samples), 3),
+        'max_ms': round(max(save_samples), 3), 'samples_ms': [round(s, 3) for s in save_samples],
+        'rows_per_second': round(size / (statistics.median(save_samples) / 1000)),
+    }
+    if not args.no_memory:
+        tracemalloc.start()
+        await save_all()
+        entry['peak_kib'] = round(tracemalloc.get_traced_memory()[1] / 1024, 1)
+        tracemalloc.stop()
+    record('storage.save_posts', **entry)
+
+    # Leave only the newest --unsent posts unsent, as after regular digests
+    conn = sqlite3.connect(db_path)
+    conn.execute('UPDATE posts SET sent = TRUE WHERE id <= ?', (size - args.unsent,))
+    conn.commit()
+    conn.close()
+
+    storage = main.storage
+    storage.db_path = db_path
+    await storage.open()
+    try:
+        record('storage.get_unsent_posts', **await measure(storage.get_unsent_posts, args.repeat, not args.no_memory))
+        window_start = (synthetic.end - timedelta(hours=4)).isoformat()
+        record('storage.get_posts_since', **await measure(
+            lambda: storage.get_posts_since(window_start), args.repeat, not args.no_memory))
+        match = match_expression('инфляция доходность')
+        search_since = (synthetic.end - timedelta(days=7)).isoformat()
+        record('storage.search_posts', **await measure(
+            lambda: storage.search_posts(match, since=search_since), args.repeat, not args.no_memory))
+
+        posts = await storage.get_posts_since('')
+        prompt_texts = await storage.get_prompt_texts([post[0] for post in posts])
+        record('summarizer.prepare', **await measure(
+            lambda: main.summarizer.build_batches(main.summarizer.prepare(posts, prompt_texts=prompt_texts)[0]),
+            args.repeat, not args.no_memory))
+        summary, link_map = make_summary(size, 4, args.seed)
+        record('render_digest', **await measure(
+            lambda: main.render_digest(summary, link_map), args.repeat, not args.no_memory))
+
+        if size > args.max_digest_posts:
+            for path in sorted(CAPPED):
+                record(path, skipped=f"size above --max-digest-posts {args.max_digest_posts}")
+            return results
+
+        record('format_digest', **await measure(lambda: main.format_digest(posts), args.repeat, not args.no_memory))
+
+        async def fresh_client():
+            # FakeOpenAIClient keeps every request; a new one per run keeps that out of the memory peaks
+            main.summarizer.client = FakeOpenAIClient()
+
+        ttl = main.digest_cache.ttl_seconds
+        main.digest_cache.ttl_seconds = -1  # every lookup misses
+        try:
+            record('summarize_posts.cold', **await measure(
+                lambda: main.summarize_posts(posts), args.repeat, not args.no_memory, setup=fresh_client))
+        finally:
+            main.digest_cache.ttl_seconds = ttl
+        await main.summarize_posts(posts)
+        record('summarize_posts.cached', **await measure(
+            lambda: main.summarize_posts(posts), args.repeat, not args.no_memory))
+
+        bot = StubTelegramClient(synthetic)
+        user_ids = list(range(1, args.users + 1))
+        window = ('', datetime.now(timezone.utc).isoformat())
+        main.digest_cache.ttl_seconds = -1
+        try:
+            entry = await measure(
+                lambda: main.send_digest(bot, recipient_ids=user_ids, window=window), args.repeat, not args.no_memory,
+                setup=fresh_client)
+        finally:
+            main.digest_cache.ttl_seconds = ttl
+        entry['messages_per_run'] = bot.sent // (args.repeat + (0 if args.no_memory else 1))
+        record('send_digest', **entry)
+    finally:
+        await storage.close()
+    return results
+
+
+def git_revision():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True, check=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(results: list, baseline_path: str):
+    with open(baseline_path, encoding='utf-8') as f:
+        baseline = {(r['path'], r['size']): r for r in json.load(f)['results'] if 'median_ms' in r}
+    print(f"\n{'size':>9} {'path':<26} {'baseline ms':>12} {'current ms':>12} {'ratio':>7}")
+    for result in results:
+        old = baseline.get((result['path'], result['size']))
+        if old is None or 'median_ms' not in result:
+            continue
+        ratio = result['median_ms'] / old['median_ms'] if old['median_ms'] else float('inf')
+        print(f"{result['size']:>9} {result['path']:<26} {old['median_ms']:>12.2f} {result['median_ms']:>12.2f} {ratio:>6.2f}x")
+
+
+async def run(args) -> dict:
+    for key, value in BENCH_ENV.items():
+        os.environ.setdefault(key, value)
+    import main  # noqa: E402  (after the environment above)
+    logging.disable(logging.WARNING)  # keep log I/O out of the timings
+
+    report = {
+        'meta': {
+            'started_at': datetime.now(timezone.utc).isoformat(),
+            'git_revision': git_revision(),
+            'python': sys.version.split()[0],
+            'platform': platform.platform(),
+            'sqlite': sqlite3.sqlite_version,
+            'args': vars(args),
+        },
+        'results': [],
+    }
+    print(f"{'size':>9} {'path':<26} {'median':>14} {'peak':>13}")
+    with tempfile.TemporaryDirectory() as workdir:
+        for size in args.sizes:
+            report['results'].extend(await bench_size(main, args, size, workdir))
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--sizes', type=int, nargs='+', default=[1_000, 100_000, 1_000_000])
+    parser.add_argument('--channels', type=int, default=50)
+    parser.add_argument('--min-length', type=int, default=40, help='shortest post, characters')
+    parser.add_argument('--max-length', type=int, default=600, help='longest post, characters')
+    parser.add_argument('--days', type=float, default=30, help='time span the posts are spread over')
+    parser.add_argument('--unsent', type=int, default=2_000, help='number of newest posts left unsent')
+    parser.add_argument('--users', type=int, default=100, help='send_digest recipients')
+    parser.add_argument('--max-digest-posts', type=int, default=100_000)
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--no-memory', action='store_true', help='skip the tracemalloc runs')
+    parser.add_argument('--output', default='bench-results.json')
+    parser.add_argument('--baseline', help='earlier --output file to compare against')
+    args = parser.parse_args()
+
+    report = asyncio.run(run(args))
+    with open(args.output, 'w', encoding='utf-8') as f:
+        json.dump(report, f, indent=2, ensure_ascii=False)
+    print(f"\nWrote {len(report['results'])} results to {args.output}")
+    if args.baseline:
+        compare(report['results'], args.baseline)
+
+
+if __name__ == '__main__':
+    main()
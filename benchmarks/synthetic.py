@@ -0,0 +1,123 @@
+"""Synthetic channel posts for benchmarks.
+
+Posts are reproducible for a given seed: each channel has a few favourite
+topics (so clustering and deduplication have structure to find), lengths are
+drawn between `min_length` and `max_length` characters, some posts carry a
+URL, `decoration_ratio` of them are split into paragraphs and decorated with
+emoji runs and repeated punctuation the way channel posts often are, and
+`duplicate_ratio` of them repeat an earlier post from another channel. Rows
+carry the compacted prompt text and token count ingestion stores (see
+compaction.PromptCompactor). Timestamps are spread evenly over `days` up to `end`, in the same
+UTC ISO format Telethon's message.date produces.
+"""
+import random
+from datetime import datetime, timedelta, timezone
+from types import SimpleNamespace
+
+from compaction import PromptCompactor
+
+TOPICS = [
+    ['нейросеть', 'модель', 'обучение', 'датасет', 'веса', 'инференс'],
+    ['рынок', 'акции', 'ставка', 'инфляция', 'облигации', 'доходность'],
+    ['релиз', 'версия', 'обновление', 'баг', 'патч', 'сборка'],
+    ['школа', 'курс', 'студенты', 'экзамен', 'лекция', 'программа'],
+    ['матч', 'турнир', 'команда', 'гол', 'сезон', 'тренер'],
+    ['мем', 'шутка', 'котик', 'пятница', 'смешно', 'картинка'],
+    ['python', 'sqlite', 'asyncio', 'telegram', 'openai', 'benchmark'],
+    ['выборы', 'закон', 'министр', 'заявление', 'санкции', 'переговоры'],
+]
+FILLER = ['и', 'в', 'на', 'что', 'это', 'новый', 'сегодня', 'очень', 'может', 'также', 'после', 'говорят', 'подробнее']
+EMOJI = ['🔥', '🚀', '❗️', '👉', '💥', '😂', '📈', '✅', '⚡️', '🎉']
+
+
+class SyntheticPosts:
+    def __init__(self, channels: int = 50, min_length: int = 40, max_length: int = 600, days: float = 30.0,
+                 url_ratio: float = 0.3, duplicate_ratio: float = 0.02, decoration_ratio: float = 0.4, seed: int = 42,
+                 end: datetime = datetime(2024, 1, 1, tzinfo=timezone.utc), compactor: PromptCompactor = None):
+        self.channels = channels
+        self.min_length = min_length
+        self.max_length = max_length
+        self.days = days
+        self.url_ratio = url_ratio
+        self.duplicate_ratio = duplicate_ratio
+        self.decoration_ratio = decoration_ratio
+        self.compactor = compactor or PromptCompactor()
+        self.seed = seed
+        self.end = end
+        self.channel_titles = [f"Channel {i}" for i in range(channels)]
+        self.channel_usernames = [f"channel_{i}" for i in range(channels)]
+
+    @property
+    def start(self) -> datetime:
+        return self.end - timedelta(days=self.days)
+
+    def _text(self, rng: random.Random, channel: int) -> str:
+        topics = [TOPICS[(channel + k) % len(TOPICS)] for k in range(2)]
+        topic = topics[0] if rng.random() < 0.7 else topics[1]
+        length = rng.randint(self.min_length, self.max_length)
+        words = []
+        size = 0
+        while size < length:
+            word = rng.choice(topic) if rng.random() < 0.4 else rng.choice(FILLER)
+            words.append(word)
+            size += len(word) + 1
+        if rng.random() < self.url_ratio:
+            words.append(f"https://example.com/{rng.choice(topic)}/{rng.randrange(10**6)}")
+        return " ".join(words).capitalize()
+
+    @staticmethod
+    def _decorate(rng: random.Random, text: str) -> str:
+        words = text.split(' ')
+        for _ in range(rng.randint(1, 3)):
+            at = rng.randrange(len(words) + 1)
+            run = ''.join(rng.choice(EMOJI) for _ in range(rng.randint(2, 5)))
+            words.insert(at, rng.choice([run, run + '\n\n', '!!!', '...', '\n\n———\n\n']))
+        return f"{rng.choice(EMOJI) * 3} " + ' '.join(words)
+
+    def rows(self, count: int):
+        """Storage.save_posts rows: (channel_id, channel_title, timestamp, content, post_link, duplicate_of, message_id,
+        prompt_text, prompt_tokens)."""
+        rng = random.Random(self.seed)
+        # Separate stream, so the base texts stay the same whatever the decoration ratio
+        decoration = random.Random(self.seed + 1)
+        step = (self.end - self.start) / max(count, 1)
+        recent = []
+        for i in range(count):
+            channel = rng.randrange(self.channels)
+            if recent and rng.random() < self.duplicate_ratio:
+                content = rng.choice(recent)
+            else:
+                content = self._text(rng, channel)
+                if decoration.random() < self.decoration_ratio:
+                    content = self._decorate(decoration, content)
+                recent.append(content)
+                if len(recent) > 100:
+                    recent.pop(0)
+            timestamp = (self.start + step * (i + 1)).isoformat()
+            post_link = f"https://t.me/{self.channel_usernames[channel]}/{i + 1}"
+            yield (str(channel), self.channel_titles[channel], timestamp, content, post_link, None, i + 1,
+                   *self.compactor.compact(content))
+
+    def batches(self, count: int, batch_size: int):
+        batch = []
+        for row in self.rows(count):
+            batch.append(row)
+            if len(batch) == batch_size:
+                yield batch
+                batch = []
+        if batch:
+            yield batch
+
+    def channel(self, index: int):
+        """Telethon-like channel entity."""
+        return SimpleNamespace(id=index, title=self.channel_titles[index], username=self.channel_usernames[index])
+
+    def messages(self, count: int):
+        """Telethon-like messages for the first `count` rows, newest first (as get_messages returns them)."""
+        messages = [
+            SimpleNamespace(id=message_id, date=datetime.fromisoformat(timestamp), text=content, media=None,
+                            chat_id=int(channel_id))
+            for channel_id, _, timestamp, content, _, _, message_id, *_ in self.rows(count)
+        ]
+        messages.reverse()
+        return messages
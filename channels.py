@@ -0,0 +1,168 @@
+import asyncio
+import logging
+import os
+from datetime import datetime
+from typing import NamedTuple
+
+import telethon.errors
+from telethon import utils
+
+from backfill import channel_reference
+
+logger = logging.getLogger(__name__)
+
+
+class ChannelInfo(NamedTuple):
+    """Cached metadata of a monitored channel.
+
+    `id`, `title` and `username` mirror the Telethon entity attributes, so a
+    ChannelInfo can be used wherever only those are read (e.g. message_to_post).
+    """
+    ref: str
+    peer_id: int
+    id: int
+    title: str
+    username: str
+
+
+def read_channels_file(path: str) -> list:
+    """Channel references from a file: one per line or comma separated, '#' starts a comment."""
+    refs = []
+    with open(path, encoding='utf-8') as f:
+        for line in f:
+            line = line.split('#', 1)[0]
+            refs.extend(ref.strip() for ref in line.split(',') if ref.strip())
+    return refs
+
+
+class ChannelRegistry:
+    """The set of monitored channels, resolved once and kept in memory.
+
+    Channel references (@usernames or numeric IDs) live in the
+    monitored_channels table, seeded from the configuration on first start.
+    Each reference is resolved to its Telegram IDs and metadata once and the
+    result persisted, so restarts do not resolve again. Membership is a dict
+    lookup by the event's chat_id, with title and username cached for the
+    handler instead of fetching the chat per message.
+
+    reload() re-reads the list from `channels_file` (if configured) or from
+    the table and swaps the in-memory map, so channels can be added or
+    removed while the clients keep running; handlers filter on is_monitored()
+    rather than a fixed chats= list.
+    """
+
+    def __init__(self, storage, client=None, channels_file: str = None, resolve_concurrency: int = 8):
+        self.storage = storage
+        self.client = client
+        self.channels_file = channels_file
+        self.resolve_concurrency = resolve_concurrency
+        self._by_peer_id = {}
+        self._unresolved = []
+        self._file_mtime = None
+        self._lock = asyncio.Lock()
+
+    def __len__(self):
+        return len(self._by_peer_id)
+
+    def __contains__(self, peer_id) -> bool:
+        return peer_id in self._by_peer_id
+
+    def get(self, peer_id):
+        """ChannelInfo for an event chat_id, or None if the chat is not monitored."""
+        return self._by_peer_id.get(peer_id)
+
+    def is_monitored(self, event) -> bool:
+        """events.NewMessage(func=...) filter."""
+        return event.chat_id in self._by_peer_id
+
+    def channels(self) -> list:
+        return list(self._by_peer_id.values())
+
+    @property
+    def unresolved(self) -> list:
+        """References that could not be resolved yet (retried on every reload)."""
+        return list(self._unresolved)
+
+    async def load(self, seed_refs: list = ()):
+        """Seed configured references, then load and resolve the active list."""
+        if seed_refs:
+            await self.storage.seed_channels(list(seed_refs))
+        await self.reload()
+
+    async def reload(self) -> bool:
+        """Re-read the channel list and swap it in. Returns True if the monitored set changed."""
+        async with self._lock:
+            if self.channels_file:
+                try:
+                    self._file_mtime = os.path.getmtime(self.channels_file)
+                    await self.storage.set_active_channels(read_channels_file(self.channels_file))
+                except OSError as e:
+                    logger.error(f"Could not read channels file {self.channels_file}: {e}")
+            rows = await self.storage.get_active_channels()
+            resolved = await self._resolve([row[0] for row in rows if row[1] is None])
+            by_peer_id = {}
+            unresolved = []
+            for ref, peer_id, channel_id, title, username in rows:
+                if peer_id is None:
+                    if ref not in resolved:
+                        unresolved.append(ref)
+                        continue
+                    peer_id, channel_id, title, username = resolved[ref]
+                by_peer_id[peer_id] = ChannelInfo(ref, peer_id, int(channel_id), title, username)
+            changed = by_peer_id.keys() != self._by_peer_id.keys()
+            self._by_peer_id = by_peer_id
+            self._unresolved = unresolved
+        if changed:
+            logger.info(f"Monitoring {len(by_peer_id)} channels" + (f" ({len(unresolved)} unresolved: {unresolved})" if unresolved else ""))
+        return changed
+
+    async def _resolve(self, refs: list) -> dict:
+        """Resolve references with the client and persist them. Returns ref -> (peer_id, channel_id, title, username)."""
+        if not refs or self.client is None:
+            return {}
+        semaphore = asyncio.Semaphore(self.resolve_concurrency)
+        resolved = {}
+
+        async def resolve(ref):
+            async with semaphore:
+                try:
+                    entity = await self.client.get_entity(channel_reference(ref))
+                except telethon.errors.FloodWaitError as e:
+                    logger.warning(f"FloodWait resolving channel {ref}; will retry on next reload ({e.seconds}s)")
+                    return
+                except Exception as e:
+                    logger.error(f"Could not resolve channel {ref}: {e}")
+                    return
+                resolved[ref] = (utils.get_peer_id(entity), str(entity.id), getattr(entity, 'title', ref),
+                                 getattr(entity, 'username', None))
+
+        await asyncio.gather(*(resolve(ref) for ref in refs))
+        if resolved:
+            now = datetime.now().isoformat()
+            await self.storage.save_channel_resolutions(
+                [(*info, now, ref) for ref, info in resolved.items()]
+            )
+            logger.info(f"Resolved {len(resolved)} channels: {', '.join(resolved)}")
+        return resolved
+
+    async def watch(self, interval_seconds: float = 60.0):
+        """Background task: reload when the channels file changes, otherwise from the table every interval.
+
+        Unresolved references are retried on every pass.
+        """
+        while True:
+            try:
+                await asyncio.sleep(interval_seconds)
+                if self.channels_file:
+                    try:
+                        mtime = os.path.getmtime(self.channels_file)
+                    except OSError:
+                        mtime = None
+                    if mtime == self._file_mtime and not self._unresolved:
+                        continue
+                await self.reload()
+            except asyncio.CancelledError:
+                logger.info("Channel registry watcher cancelled.")
+                break
+            except Exception as e:
+                logger.error(f"Error reloading channel registry: {e}", exc_info=True)
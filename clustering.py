@@ -0,0 +1,175 @@
+import logging
+import math
+import re
+import zlib
+from collections import Counter
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+WORD_RE = re.compile(r'[^\W\d_]{3,}', re.UNICODE)
+URL_RE = re.compile(r'https?://\S+|t\.me/\S+')
+STOPWORDS = frozenset('''
+    и в во не что он на я с со как а то все она так его но да ты к у же вы за бы по только ее мне было вот от
+    меня еще нет о из ему теперь когда даже ну вдруг ли если уже или ни быть был него до вас нибудь опять уж
+    вам ведь там потом себя ничего ей может они тут где есть надо ней для мы тебя их чем была сам чтоб без
+    будто чего раз тоже себе под будет ж тогда кто этот того потому этого какой совсем ним здесь этом один
+    почти мой тем чтобы нее сейчас были куда зачем всех никогда можно при наконец два об другой хоть после
+    над больше тот через эти нас про всего них какая много разве три эту моя впрочем хорошо свою этой перед
+    иногда лучше чуть том нельзя такой им более всегда конечно всю между это также которые который которая
+    которых года году очень свой своей своих media message
+    the and for are but not you all any can had her was one our out has have been this that with from they
+    will would there their what about which when make like just into than them some could other then its
+'''.split())
+
+
+def tokenize(text: str) -> list:
+    """Lowercased words of 3+ letters without URLs, digits and stopwords."""
+    text = text.lower()
+    if '://' in text or 't.me/' in text:
+        text = URL_RE.sub(' ', text)
+    return [w for w in WORD_RE.findall(text) if w not in STOPWORDS]
+
+
+def _feature(token: str, n_features: int) -> int:
+    # crc32 rather than hash(): stable across processes, so topics are reproducible
+    return zlib.crc32(token.encode()) % n_features
+
+
+def tfidf_matrix(texts, n_features: int = 1024):
+    """Hashed TF-IDF features, L2-normalized rows.
+
+    Returns:
+        tuple: (matrix of shape (len(texts), n_features) float32,
+                feature index -> most frequent token, for labelling)
+    """
+    doc_index = []
+    feature_index = []
+    weights = []
+    feature_cache = {}
+    token_counts = Counter()
+    for doc, text in enumerate(texts):
+        counts = Counter(tokenize(text))
+        token_counts.update(counts)
+        # Sum hash collisions per document so each (doc, feature) cell is assigned once
+        features = {}
+        for token, count in counts.items():
+            feature = feature_cache.get(token)
+            if feature is None:
+                feature = feature_cache[token] = _feature(token, n_features)
+            features[feature] = features.get(feature, 0.0) + 1.0 + math.log(count)
+        doc_index.extend([doc] * len(features))
+        feature_index.extend(features)
+        weights.extend(features.values())
+
+    matrix = np.zeros((len(texts), n_features), dtype=np.float32)
+    matrix[doc_index, feature_index] = weights
+    document_frequency = np.count_nonzero(matrix, axis=0)
+    idf = np.log((1 + len(texts)) / (1 + document_frequency)).astype(np.float32) + 1.0
+    matrix *= idf
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    matrix /= np.where(norms == 0, 1.0, norms)
+
+    feature_tokens = {}
+    for token, count in token_counts.most_common():
+        feature_tokens.setdefault(feature_cache[token], token)
+    return matrix, feature_tokens
+
+
+def spherical_kmeans(matrix, k: int, iterations: int = 10, tolerance: float = 0.002, seed: int = 0):
+    """k-means on unit vectors with cosine similarity and k-means++ seeding.
+
+    Stops after `iterations` rounds or once fewer than `tolerance` of the
+    points change cluster.
+
+    Returns:
+        tuple: (labels array, centroids array of shape (k, n_features))
+    """
+    n = matrix.shape[0]
+    rng = np.random.default_rng(seed)
+    centroids = np.empty((k, matrix.shape[1]), dtype=np.float32)
+    centroids[0] = matrix[rng.integers(n)]
+    closest = 1.0 - matrix @ centroids[0]
+    for i in range(1, k):
+        distances = np.clip(closest, 0, None) ** 2
+        total = distances.sum()
+        choice = rng.choice(n, p=distances / total) if total > 0 else rng.integers(n)
+        centroids[i] = matrix[choice]
+        closest = np.minimum(closest, 1.0 - matrix @ centroids[i])
+
+    labels = np.full(n, -1)
+    for _ in range(iterations):
+        new_labels = np.argmax(matrix @ centroids.T, axis=1)
+        changed = np.count_nonzero(new_labels != labels)
+        labels = new_labels
+        if changed <= tolerance * n:
+            break
+        # One-hot membership product instead of np.add.at, which is far slower for row sums
+        membership = (labels[:, None] == np.arange(k)).astype(np.float32)
+        sums = membership.T @ matrix
+        norms = np.linalg.norm(sums, axis=1, keepdims=True)
+        empty = norms[:, 0] == 0
+        centroids = np.where(empty[:, None], centroids, sums / np.where(norms == 0, 1.0, norms))
+    return labels, centroids
+
+
+def merge_similar_clusters(labels, centroids, threshold: float):
+    """Agglomerative pass over centroids: merge clusters whose centroids are closer than `threshold`."""
+    k = centroids.shape[0]
+    parent = list(range(k))
+
+    def find(i):
+        while parent[i] != i:
+            parent[i] = parent[parent[i]]
+            i = parent[i]
+        return i
+
+    similarity = centroids @ centroids.T
+    pairs = np.argwhere(np.triu(similarity, 1) >= threshold)
+    for a, b in pairs:
+        parent[find(int(b))] = find(int(a))
+    mapping = np.array([find(i) for i in range(k)])
+    return mapping[labels]
+
+
+def cluster_texts(texts, max_clusters: int = 12, n_features: int = 1024, merge_threshold: float = 0.5,
+                  label_terms: int = 3, seed: int = 0):
+    """Group texts by topic.
+
+    Returns:
+        list: (topic terms, list of text indices) per topic, largest topic first;
+        texts without any usable words end up in a topic with no terms
+    """
+    if not texts:
+        return []
+    matrix, feature_tokens = tfidf_matrix(texts, n_features)
+    has_words = np.linalg.norm(matrix, axis=1) > 0
+    indices = np.flatnonzero(has_words)
+    groups = []
+    if len(indices):
+        vectors = matrix[indices]
+        k = max(1, min(max_clusters, len(indices), round(math.sqrt(len(indices) / 2))))
+        labels, centroids = spherical_kmeans(vectors, k, seed=seed)
+        labels = merge_similar_clusters(labels, centroids, merge_threshold)
+        for label in np.unique(labels):
+            members = indices[labels == label]
+            centroid = matrix[members].sum(axis=0)
+            top = np.argsort(centroid)[::-1][:label_terms]
+            terms = [feature_tokens[f] for f in top if centroid[f] > 0 and f in feature_tokens]
+            groups.append((terms, members.tolist()))
+    leftovers = np.flatnonzero(~has_words).tolist()
+    groups.sort(key=lambda group: (-len(group[1]), group[1][0]))
+    if leftovers:
+        groups.append(([], leftovers))
+    return groups
+
+
+def group_posts(posts, **kwargs):
+    """Group digest posts (id, channel_title, timestamp, content, post_link) by topic.
+
+    Returns:
+        list: (topic terms, posts in original order) per topic, largest topic first
+    """
+    groups = cluster_texts([post[3] for post in posts], **kwargs)
+    return [(terms, [posts[i] for i in sorted(members)]) for terms, members in groups]
@@ -0,0 +1,134 @@
+"""Prompt compaction of post text, done once at ingestion.
+
+Telegram posts carry a lot that costs tokens without helping a summary:
+full URLs (often longer than the sentence around them), runs of repeated
+emoji and punctuation, decorative blank lines and invisible formatting
+characters. PromptCompactor turns a post into the text the summarizer puts
+in the prompt and counts its tokens, so digest generation can pack batches
+from stored counts instead of tokenizing every post again.
+
+Token counts come from tiktoken with the model's encoding when the package
+(and its encoding file) is available, otherwise from the same ~3 chars per
+token estimate the summarizer has always used. Loading the encoding reads
+(on a cold cache, downloads) its BPE file, so the bot calls load() in a
+thread at startup rather than on the first post.
+"""
+import logging
+import math
+import re
+
+try:
+    import tiktoken
+except ImportError:  # Optional: token counts fall back to the character estimate
+    tiktoken = None
+
+logger = logging.getLogger(__name__)
+
+URL_RE = re.compile(r'\b(?:https?://|www\.)([^\s/?#<>()\[\]]+)[^\s<>()\[\]]*', re.IGNORECASE)
+INVISIBLE_RE = re.compile('[\u00ad\u200b-\u200f\u2060\ufeff]')
+EMOJI = '\u2600-\u27bf\U0001f000-\U0001faff'
+# Two or more emoji (with optional spaces and variation selectors between them) -> the first one
+EMOJI_RUN_RE = re.compile(f'([{EMOJI}])[\ufe0f\u200d]?(?:[ ]*[{EMOJI}][\ufe0f\u200d]?)+')
+# The same punctuation or symbol three or more times ("!!!", "-----", "....") -> once, "..." kept as "…"
+REPEAT_RE = re.compile(r'([^\w\s])\1{2,}')
+# Only runs and non-plain spaces, so the common single space is left alone
+SPACES_RE = re.compile('[ \t\u00a0]{2,}|[\t\u00a0]')
+# Line breaks with the blank lines and spaces around them (runs of spaces are already single)
+BLANK_LINES_RE = re.compile(r' ?\n\s*')
+
+
+def estimate_tokens(text: str) -> int:
+    """Cheap upper-bound token estimate (~3 chars per token, conservative for Cyrillic)."""
+    return math.ceil(len(text) / 3) if text else 0
+
+
+def compact_text(text: str) -> str:
+    """Prompt form of a post: URLs reduced to their host, repeated emoji and
+    punctuation collapsed, whitespace and line breaks squeezed."""
+    if not text:
+        return ''
+    # Each pass is skipped when a substring check shows it has nothing to do
+    text = INVISIBLE_RE.sub('', text)
+    if 'http' in text or 'www.' in text:
+        text = URL_RE.sub(lambda m: m.group(1).lower().removeprefix('www.'), text)
+    text = EMOJI_RUN_RE.sub(r'\1', text)
+    text = REPEAT_RE.sub(lambda m: '…' if m.group(1) == '.' else m.group(1), text)
+    if '  ' in text or '\t' in text or '\u00a0' in text:
+        text = SPACES_RE.sub(' ', text)
+    if '\n' in text:
+        text = BLANK_LINES_RE.sub('\n', text)
+    return text.strip()
+
+
+class PromptCompactor:
+    """Compacts post text for prompts and counts tokens for one model.
+
+    Posts longer than `max_tokens` after compaction are cut at a word
+    boundary and end with '…'; 0 disables the cap.
+    """
+
+    def __init__(self, model: str = None, max_tokens: int = 300):
+        self.model = model
+        self.max_tokens = max_tokens
+        self._encoding = None
+        self._encoding_loaded = False
+
+    def load(self):
+        """Load the tiktoken encoding for `model` (blocking); None when unavailable."""
+        if self._encoding_loaded:
+            return self._encoding
+        encoding = None
+        if tiktoken is not None:
+            try:
+                try:
+                    encoding = tiktoken.encoding_for_model(self.model or '')
+                except KeyError:
+                    encoding = tiktoken.get_encoding('o200k_base')
+            except Exception as e:
+                logger.warning(f"tiktoken encoding unavailable, estimating token counts: {e}")
+        if not self._encoding_loaded:  # use_estimate() may have been called meanwhile
+            self._encoding, self._encoding_loaded = encoding, True
+        return self._encoding
+
+    def use_estimate(self):
+        """Count with the character estimate from now on, even if a load() in progress succeeds."""
+        self._encoding_loaded = True
+
+    @property
+    def encoding(self):
+        """The tiktoken encoding for `model`, loaded on first use unless load() ran already."""
+        return self.load()
+
+    @property
+    def tokenizer(self) -> str:
+        return self.encoding.name if self.encoding is not None else 'estimate'
+
+    def count(self, text: str) -> int:
+        """Tokens in `text` for the model (estimated without tiktoken)."""
+        if not text:
+            return 0
+        encoding = self.encoding
+        if encoding is None:
+            return estimate_tokens(text)
+        return len(encoding.encode(text, disallowed_special=()))
+
+    def truncate(self, text: str, max_tokens: int) -> str:
+        """Cut `text` to at most `max_tokens` tokens at a word boundary, ending in '…'."""
+        encoding = self.encoding
+        if encoding is None:
+            cut = text[:max(0, max_tokens * 3 - 1)]
+        else:
+            cut = encoding.decode(encoding.encode(text, disallowed_special=())[:max(0, max_tokens - 1)])
+        space = cut.rfind(' ')
+        if space > len(cut) // 2:
+            cut = cut[:space]
+        return cut.rstrip() + '…'
+
+    def compact(self, text: str):
+        """Returns (prompt text, its token count)."""
+        text = compact_text(text)
+        tokens = self.count(text)
+        if self.max_tokens and tokens > self.max_tokens:
+            text = self.truncate(text, self.max_tokens)
+            tokens = self.count(text)
+        return text, tokens
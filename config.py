@@ -1,5 +1,12 @@
+"""Configuration, read once from the environment (and .env) into an immutable Settings.
+
+Other modules use `config.settings`; the prompt templates are plain constants.
+"""
 import os
 import logging
+from dataclasses import dataclass
+from typing import Optional, Tuple
+
 from dotenv import load_dotenv
 
 # Load environment variables from .env file first, overriding existing ones
@@ -9,32 +16,16 @@ load_dotenv(override=True)
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
 
-# Log loaded environment variables
-logger.info("Environment variables loaded from .env file (override=True)")
-
-# Telegram API credentials
-API_ID = int(os.getenv('TELEGRAM_API_ID'))  # Convert to int as API_ID must be numeric
-API_HASH = os.getenv('TELEGRAM_API_HASH')
-BOT_TOKEN = os.getenv('TELEGRAM_BOT_TOKEN')
-
-# Channel configuration
-CHANNEL_USERNAME = os.getenv('TELEGRAM_CHANNEL_USERNAME')  # Keep for backwards compatibility
-CHANNEL_USERNAMES = os.getenv('TELEGRAM_CHANNEL_USERNAMES', CHANNEL_USERNAME)
-CHANNELS = [channel.strip() for channel in CHANNEL_USERNAMES.split(',') if channel.strip()]
-
-# OpenAI Configuration
-OPENAI_API_KEY = os.getenv('OPENAI_API_KEY')
+TRUE_VALUES = ('1', 'true', 'yes')
 
-# Choose which GPT model to use for summarization
-GPT_MODEL = "gpt-4o-mini"
 # Prompt template for post summarization
 SUMMARY_PROMPT_TEMPLATE = """
 You are an AI assistant generating a smart digest of posts from various Telegram channels. The channels may cover different topic (e.g., AI, education, news, memes), and your task is to help the user quickly understand what's important.
 
 Here's what you need to do:
-1. Group the posts by topic (if the same topic is mentioned across multiple channels -- make that explicit).
+1. Group the posts by topic (if the same topic is mentioned across multiple channels -- make that explicit). Posts may already be pre-grouped under "### Topic group" lines; use these as a starting point, merging or splitting groups where it reads better.
 2. For each topic, write a short summary (1--3 sentences) with the core insight or message.
-3. Avoid repetition -- if multiple posts talk about the same event, just mention that it was discussed in several channels.
+3. Avoid repetition -- if multiple posts talk about the same event, just mention that it was discussed in several channels. A post marked "Also reported by" was published almost identically in those channels too -- cite all of its references.
 4. Add short references like [1], [2], etc., for each post -- these will link back to the original messages.
 5. Write clearly and concisely in Russian, with an emphasis on usefulness.
 
@@ -56,69 +47,208 @@ If there are memes, jokes, or light-hearted content, include them at the end und
 If there's nothing meaningful to say -- don't invent content. It's better to be brief and relevant than verbose and vague.
 """
 
-# Interval in minutes for automatic digest sending
-raw_interval = os.getenv('DIGEST_INTERVAL_MINUTES')
-logger.info(f"Raw DIGEST_INTERVAL_MINUTES from env: {raw_interval}")
-DIGEST_INTERVAL_MINUTES = int(os.getenv('DIGEST_INTERVAL_MINUTES', '60'))
-logger.info(f"Digest interval set to {DIGEST_INTERVAL_MINUTES} minutes")
-
-# Define required environment variables
-required_env_vars = [
-    'TELEGRAM_API_ID',
-    'TELEGRAM_API_HASH',
-    'TELEGRAM_BOT_TOKEN',
-    'TELEGRAM_CHANNEL_USERNAMES',
-    'OPENAI_API_KEY',
-    'DIGEST_TIME'  # Add DIGEST_TIME to required vars
-]
-
-# Load environment variables
-load_dotenv()
-
-# Configuration dictionary
-config = {
-    'TELEGRAM_API_ID': os.getenv('TELEGRAM_API_ID'),
-    'TELEGRAM_API_HASH': os.getenv('TELEGRAM_API_HASH'),
-    'TELEGRAM_BOT_TOKEN': os.getenv('TELEGRAM_BOT_TOKEN'),
-    'TELEGRAM_CHANNEL_USERNAMES': os.getenv('TELEGRAM_CHANNEL_USERNAMES'),
-    'OPENAI_API_KEY': os.getenv('OPENAI_API_KEY'),
-    'DIGEST_TIME': os.getenv('DIGEST_TIME', '20:00'),  # Default to 20:00 if not set
-    'GPT_MODEL': os.getenv('GPT_MODEL', 'gpt-4o-mini'),
-    'SUMMARY_PROMPT_TEMPLATE': SUMMARY_PROMPT_TEMPLATE
-}
-
-# Validate required environment variables
-missing_vars = [var for var in required_env_vars if not config[var]]
-if missing_vars:
-    raise ValueError(f"Missing required environment variables: {', '.join(missing_vars)}")
-
-# Extract variables for easier access in other modules
-API_ID = int(config['TELEGRAM_API_ID'])
-API_HASH = config['TELEGRAM_API_HASH']
-BOT_TOKEN = config['TELEGRAM_BOT_TOKEN']
-CHANNELS_STR = config['TELEGRAM_CHANNEL_USERNAMES']
-OPENAI_API_KEY = config['OPENAI_API_KEY']
-DIGEST_TIME = config['DIGEST_TIME']
-GPT_MODEL = config['GPT_MODEL']
-SUMMARY_PROMPT_TEMPLATE = config['SUMMARY_PROMPT_TEMPLATE']
-
-# Validate DIGEST_TIME format (HH:MM)
-try:
-    hour, minute = map(int, DIGEST_TIME.split(':'))
-    if not (0 <= hour <= 23 and 0 <= minute <= 59):
-        raise ValueError
-except ValueError:
-    raise ValueError("DIGEST_TIME must be in HH:MM format (24-hour), e.g. '20:00'")
-
-# Split the comma-separated string of channel usernames/IDs
-CHANNELS = [ch.strip() for ch in CHANNELS_STR.split(',') if ch.strip()]
-if not CHANNELS:
-    raise ValueError("TELEGRAM_CHANNEL_USERNAMES cannot be empty or contain only whitespace.")
-
-# Validate channel format (basic check for @ or numeric ID)
-for channel in CHANNELS:
-    if not channel.startswith('@') and not channel.replace('-','').isdigit(): # Allow negative IDs
-        logger.warning(f"Channel '{channel}' might have an invalid format. Expected format: @username or numeric ID.")
-
-# Log the loaded channels
-logger.info(f"Loaded channels: {CHANNELS}") 
\ No newline at end of file
+# Prompt for merging partial digests when the posts did not fit into one request
+REDUCE_PROMPT_TEMPLATE = """
+You are an AI assistant merging several partial digests of Telegram channel posts into one final digest. Each partial digest covers a different subset of posts.
+
+Here's what you need to do:
+1. Merge topics that appear in more than one partial digest into a single topic.
+2. Keep each topic summary short (1--3 sentences) and avoid repetition.
+3. Keep the reference markers like [1], [12] exactly as they appear in the partial digests -- never renumber, drop or invent them. When merging topics, combine their references.
+4. Write clearly and concisely in Russian, with an emphasis on usefulness.
+
+Output format:
+🧠 AI Digest:
+
+**📌 Topic 1: [Title or key fact]**  
+Short explanation of the insight. [1], [3]
+
+**📌 Topic 2: ...**  
+...
+
+Keep memes, jokes and light-hearted content at the end under a separate section:  
+🎭 **Fun & Informal**
+"""
+
+@dataclass(frozen=True)
+class Settings:
+    # Telegram API credentials
+    api_id: int
+    api_hash: str
+    bot_token: str
+    # Monitored channels (@username or numeric ID)
+    channels: Tuple[str, ...]
+
+    # OpenAI configuration
+    openai_api_key: str
+    openai_base_url: Optional[str] = None  # Optional, e.g. a local OpenAI-compatible endpoint
+    # Which GPT model to use for summarization
+    gpt_model: str = 'gpt-4o-mini'
+
+    # Automatic digests: users without their own /schedule get the default schedule,
+    # 'daily' (digest_time in digest_timezone) or 'interval' (every digest_interval_minutes).
+    # Dispatch is spread over digest_jitter_seconds so users due at the same minute don't fire at once.
+    digest_time: str = '20:00'
+    digest_interval_minutes: int = 60
+    digest_schedule_mode: str = 'daily'
+    digest_timezone: str = 'Europe/Lisbon'
+    digest_jitter_seconds: float = 120.0
+
+    # Ingestion queue: posts are buffered in memory and written in batches
+    ingest_queue_maxsize: int = 10000
+    ingest_batch_size: int = 200
+    ingest_flush_interval_seconds: float = 1.0
+    # Messages of a media album (same grouped_id) are merged into one post once none arrived for this long
+    album_window_seconds: float = 1.5
+
+    # Outbound delivery: Telegram allows ~30 msg/s per bot and ~1 msg/s per chat
+    delivery_concurrency: int = 20
+    delivery_global_rate: float = 25.0
+    delivery_per_chat_interval: float = 1.0
+    delivery_max_retries: int = 3
+    delivery_max_flood_wait: float = 600.0
+
+    # New-post notifications are coalesced: one message per window (or per N posts)
+    notify_window_seconds: float = 60.0
+    notify_max_posts: int = 20
+
+    # Summarization: posts are split into token-budgeted batches summarized in parallel
+    summary_batch_tokens: int = 12000
+    summary_max_concurrency: int = 4
+    summary_max_tokens: int = 3000
+    # Posts are compacted for the prompt at ingestion; longer ones are cut to this many tokens (0 = no cap)
+    prompt_post_max_tokens: int = 300
+    # The tokenizer loads at startup (downloading its file on a cold cache); after this, counts are estimated
+    tokenizer_load_timeout_seconds: float = 30.0
+
+    # /digest streams the digest into the chat, editing the message at most this often
+    digest_stream_edit_interval: float = 1.5
+
+    # Generated digests are cached by the exact set of posts, model and prompts
+    digest_cache_ttl_seconds: float = 86400.0
+    digest_cache_max_entries: int = 500
+
+    # Background pre-summarization of incoming posts into micro-summaries
+    presummary_enabled: bool = True
+    presummary_batch_posts: int = 50
+    presummary_interval_minutes: int = 60
+
+    # Near-duplicate detection at ingestion (MinHash LSH over a sliding window)
+    dedup_enabled: bool = True
+    dedup_min_similarity: float = 0.5
+    dedup_window_hours: float = 24.0
+    dedup_max_entries: int = 30000
+
+    # Local topic clustering of digest posts (TF-IDF + spherical k-means, numpy)
+    clustering_enabled: bool = True
+    clustering_max_topics: int = 12
+    clustering_merge_similarity: float = 0.5
+
+    # Retention: sent posts older than retention_days move to a compressed archive table
+    retention_enabled: bool = True
+    retention_days: float = 7.0
+    retention_chunk_size: int = 500
+    retention_interval_minutes: int = 60
+    retention_vacuum_pages: int = 1000
+    # Convert a database created before incremental auto-vacuum with one full VACUUM at startup
+    # (blocks writes while it runs; new databases need no conversion)
+    retention_convert_database: bool = False
+
+    # Startup backfill of posts missed while offline (per-channel last-seen message IDs)
+    backfill_enabled: bool = True
+    backfill_concurrency: int = 8
+    backfill_max_messages: int = 500
+    backfill_max_age_hours: float = 24.0
+    # Channels with a stored message ID are read from it without the max_messages cap, up to this many
+    backfill_max_gap_messages: int = 20000
+
+    # Optional file listing monitored channels; when set it replaces the list at runtime (reloaded on change or SIGHUP)
+    channels_file: Optional[str] = None
+    channels_reload_seconds: float = 60.0
+
+    # Out-of-process digest generation: with digest_workers_enabled the bot only queues digest jobs
+    # in the database and delivers the results; `python worker.py` runs them in digest_worker_processes processes
+    digest_workers_enabled: bool = False
+    digest_worker_processes: int = 2
+    digest_worker_concurrency: int = 2
+    job_lease_seconds: float = 60.0
+    job_heartbeat_seconds: float = 15.0
+    job_max_attempts: int = 3
+    job_timeout_seconds: float = 900.0
+
+    # Prometheus-format metrics served by the bot process on http://metrics_host:metrics_port/metrics
+    metrics_enabled: bool = True
+    metrics_host: str = '127.0.0.1'
+    metrics_port: int = 9108
+
+    @classmethod
+    def from_env(cls, env=None):
+        """Parse and validate the settings from `env` (os.environ by default).
+
+        Variables are named like the fields in upper case, except the Telegram
+        credentials (TELEGRAM_API_ID, TELEGRAM_API_HASH, TELEGRAM_BOT_TOKEN) and
+        the channel list (TELEGRAM_CHANNEL_USERNAMES, or the older single
+        TELEGRAM_CHANNEL_USERNAME). Unset variables take the field defaults.
+        """
+        env = os.environ if env is None else env
+        channels_str = env.get('TELEGRAM_CHANNEL_USERNAMES') or env.get('TELEGRAM_CHANNEL_USERNAME')
+
+        # Validate required environment variables
+        required = {
+            'TELEGRAM_API_ID': env.get('TELEGRAM_API_ID'),
+            'TELEGRAM_API_HASH': env.get('TELEGRAM_API_HASH'),
+            'TELEGRAM_BOT_TOKEN': env.get('TELEGRAM_BOT_TOKEN'),
+            'TELEGRAM_CHANNEL_USERNAMES': channels_str,
+            'OPENAI_API_KEY': env.get('OPENAI_API_KEY'),
+        }
+        missing_vars = [var for var, value in required.items() if not value]
+        if missing_vars:
+            raise ValueError(f"Missing required environment variables: {', '.join(missing_vars)}")
+
+        # Split the comma-separated string of channel usernames/IDs
+        channels = tuple(ch.strip() for ch in channels_str.split(',') if ch.strip())
+        if not channels:
+            raise ValueError("TELEGRAM_CHANNEL_USERNAMES cannot be empty or contain only whitespace.")
+        # Validate channel format (basic check for @ or numeric ID)
+        for channel in channels:
+            if not channel.startswith('@') and not channel.replace('-', '').isdigit():  # Allow negative IDs
+                logger.warning(f"Channel '{channel}' might have an invalid format. Expected format: @username or numeric ID.")
+
+        values = {}
+        for field in cls.__dataclass_fields__.values():
+            raw = env.get(field.name.upper())
+            if field.name in ('api_id', 'api_hash', 'bot_token', 'channels', 'openai_api_key') or raw is None:
+                continue
+            if field.type is bool:
+                values[field.name] = raw.lower() in TRUE_VALUES
+            elif field.type is int:
+                values[field.name] = int(raw)
+            elif field.type is float:
+                values[field.name] = float(raw)
+            else:
+                values[field.name] = raw
+        if 'digest_schedule_mode' in values:
+            values['digest_schedule_mode'] = values['digest_schedule_mode'].lower()
+        settings = cls(
+            api_id=int(required['TELEGRAM_API_ID']),  # API_ID must be numeric
+            api_hash=required['TELEGRAM_API_HASH'],
+            bot_token=required['TELEGRAM_BOT_TOKEN'],
+            channels=channels,
+            openai_api_key=required['OPENAI_API_KEY'],
+            **values,
+        )
+
+        # Validate digest_time format (HH:MM)
+        try:
+            hour, minute = map(int, settings.digest_time.split(':'))
+            if not (0 <= hour <= 23 and 0 <= minute <= 59):
+                raise ValueError
+        except ValueError:
+            raise ValueError("DIGEST_TIME must be in HH:MM format (24-hour), e.g. '20:00'")
+        if settings.digest_schedule_mode not in ('daily', 'interval'):
+            raise ValueError("DIGEST_SCHEDULE_MODE must be 'daily' or 'interval'")
+        return settings
+
+
+settings = Settings.from_env()
+logger.info(f"Loaded channels: {list(settings.channels)}, digest interval {settings.digest_interval_minutes} minutes")
@@ -0,0 +1,155 @@
+import hashlib
+import logging
+import re
+from array import array
+from collections import deque
+
+logger = logging.getLogger(__name__)
+
+WORD_RE = re.compile(r'\w+', re.UNICODE)
+URL_RE = re.compile(r'https?://\S+|t\.me/\S+')
+
+
+def shingles(text: str) -> set:
+    """Word unigrams and bigrams of a post, lowercased and without URLs."""
+    words = WORD_RE.findall(URL_RE.sub(' ', text.lower()))
+    return set(words) | {f"{a} {b}" for a, b in zip(words, words[1:])}
+
+
+class MinHasher:
+    """MinHash signatures of `num_perm` 32-bit values approximating Jaccard similarity.
+
+    Instead of `num_perm` separate hash functions, each feature is hashed once
+    with SHAKE-128 into `num_perm` independent 32-bit words; the signature is
+    the element-wise minimum over all features, computed with C-level
+    zip/min rather than a Python loop per permutation.
+    """
+
+    def __init__(self, num_perm: int = 16):
+        self.num_perm = num_perm
+        self._digest_size = num_perm * 4
+
+    def signature(self, features: set) -> array:
+        rows = [array('I', hashlib.shake_128(f.encode()).digest(self._digest_size)) for f in features]
+        return array('I', map(min, zip(*rows)))
+
+
+def estimated_similarity(a: array, b: array) -> float:
+    return sum(1 for x, y in zip(a, b) if x == y) / len(a)
+
+
+class DuplicateIndex:
+    """In-memory MinHash LSH index of recent posts for near-duplicate detection.
+
+    Each signature is split into `bands` bands; posts sharing any band are
+    candidates and are confirmed when their estimated Jaccard similarity is at
+    least `min_similarity`. With 16 permutations in 8 bands of 2, pairs at
+    0.5 similarity collide in some band ~90% of the time (~97% at 0.6) while
+    unrelated posts almost never do. Buckets map an integer band key to a single entry ID (or
+    a list on collision) to keep per-post overhead small. Entries older than
+    `window_seconds` or beyond `max_entries` are evicted oldest first, so
+    memory stays bounded regardless of daily volume (roughly 1 KB per
+    indexed post).
+    """
+
+    def __init__(self, min_similarity: float = 0.5, window_seconds: float = 24 * 3600, max_entries: int = 30000,
+                 num_perm: int = 16, bands: int = 8, min_words: int = 5):
+        if num_perm % bands:
+            raise ValueError("num_perm must be divisible by bands")
+        self.min_similarity = min_similarity
+        self.window_seconds = window_seconds
+        self.max_entries = max_entries
+        self.bands = bands
+        self.min_words = min_words
+        self._rows = num_perm // bands
+        self._hasher = MinHasher(num_perm)
+        self._buckets = {}  # band key -> entry_id, or list of entry_ids on collision
+        self._data = {}  # entry_id -> (signature, canonical_link)
+        self._entries = deque()  # (entry_id, timestamp), oldest first
+        self._next_id = 0
+        self.duplicates_found = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+    def _band_keys(self, signature: array):
+        rows = self._rows
+        bands = self.bands
+        return [
+            int.from_bytes(signature[band * rows:(band + 1) * rows].tobytes(), 'little') * bands + band
+            for band in range(bands)
+        ]
+
+    def _evict(self, now: float):
+        entries = self._entries
+        while entries and (len(entries) > self.max_entries or entries[0][1] < now - self.window_seconds):
+            entry_id, _ = entries.popleft()
+            signature, _ = self._data.pop(entry_id)
+            for key in self._band_keys(signature):
+                bucket = self._buckets.get(key)
+                if bucket == entry_id:
+                    del self._buckets[key]
+                elif isinstance(bucket, list):
+                    bucket.remove(entry_id)
+                    if len(bucket) == 1:
+                        self._buckets[key] = bucket[0]
+
+    def signature(self, content: str):
+        """MinHash signature of a post, or None if it is too short to compare reliably."""
+        features = shingles(content)
+        if len(features) < self.min_words:
+            return None
+        return self._hasher.signature(features)
+
+    def find(self, signature: array):
+        """Return the canonical link of the most similar indexed post, or None."""
+        candidates = set()
+        for key in self._band_keys(signature):
+            bucket = self._buckets.get(key)
+            if bucket is None:
+                continue
+            if isinstance(bucket, list):
+                candidates.update(bucket)
+            else:
+                candidates.add(bucket)
+        best = None
+        best_similarity = self.min_similarity
+        for entry_id in candidates:
+            other, canonical_link = self._data[entry_id]
+            similarity = estimated_similarity(signature, other)
+            if similarity >= best_similarity:
+                best, best_similarity = canonical_link, similarity
+        return best
+
+    def add(self, signature: array, link: str, timestamp: float):
+        """Index a canonical post."""
+        entry_id = self._next_id
+        self._next_id += 1
+        self._entries.append((entry_id, timestamp))
+        self._data[entry_id] = (signature, link)
+        for key in self._band_keys(signature):
+            bucket = self._buckets.get(key)
+            if bucket is None:
+                self._buckets[key] = entry_id
+            elif isinstance(bucket, list):
+                bucket.append(entry_id)
+            else:
+                self._buckets[key] = [bucket, entry_id]
+        self._evict(timestamp)
+
+    def check(self, content: str, post_link: str, timestamp: float):
+        """Look up a new post and index it if it is not a duplicate.
+
+        Returns:
+            str: Link of the canonical post this one duplicates, or None
+        """
+        signature = self.signature(content)
+        if signature is None:
+            return None
+        self._evict(timestamp)
+        canonical_link = self.find(signature)
+        if canonical_link is not None:
+            self.duplicates_found += 1
+            return canonical_link
+        self.add(signature, post_link, timestamp)
+        return None
@@ -0,0 +1,164 @@
+import asyncio
+import logging
+import time
+
+import telethon.errors
+
+from metrics import SEND_SECONDS, SENDS
+
+logger = logging.getLogger(__name__)
+
+# Errors that will not go away by retrying (blocked bot, deleted account,
+# unknown peer, message too long, ...)
+PERMANENT_ERRORS = (telethon.errors.BadRequestError, telethon.errors.ForbiddenError)
+
+
+class TokenBucket:
+    """Async token bucket: `rate` tokens per second, bursts up to `capacity`."""
+
+    def __init__(self, rate: float, capacity: float = None):
+        self.rate = rate
+        self.capacity = capacity if capacity is not None else rate
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._paused_until = 0.0
+        self._lock = asyncio.Lock()
+
+    def pause(self, seconds: float):
+        """Stop handing out tokens for `seconds` (used on FloodWait)."""
+        self._paused_until = max(self._paused_until, time.monotonic() + seconds)
+
+    async def acquire(self):
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                if now < self._paused_until:
+                    await asyncio.sleep(self._paused_until - now)
+                    continue
+                self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                await asyncio.sleep((1 - self._tokens) / self.rate)
+
+
+class Deliverer:
+    """Outbound message engine shared by every fan-out in the bot.
+
+    Telegram allows a bot roughly 30 messages per second overall and about one
+    message per second to the same chat. Sends are spread over a bounded pool
+    of workers; each send first waits for its chat's slot, then for a token
+    from the global bucket. A FloodWaitError pauses the global bucket for the
+    requested time and reschedules the recipient instead of dropping it.
+    Other transient errors are retried with backoff; permanent ones (blocked
+    bot, deleted account) fail that recipient only.
+    """
+
+    def __init__(self, concurrency: int = 20, global_rate: float = 25.0, per_chat_interval: float = 1.0,
+                 max_retries: int = 3, max_flood_wait: float = 600.0):
+        self.concurrency = concurrency
+        self.per_chat_interval = per_chat_interval
+        self.max_retries = max_retries
+        self.max_flood_wait = max_flood_wait
+        self.bucket = TokenBucket(global_rate)
+        self._chat_next_slot = {}
+
+    async def _wait_for_chat(self, chat_id):
+        now = time.monotonic()
+        slot = max(now, self._chat_next_slot.get(chat_id, 0.0))
+        self._chat_next_slot[chat_id] = slot + self.per_chat_interval
+        if len(self._chat_next_slot) > 10000:
+            self._chat_next_slot = {k: v for k, v in self._chat_next_slot.items() if v > now}
+        if slot > now:
+            await asyncio.sleep(slot - now)
+
+    async def send(self, client, chat_id, text: str, stats: dict = None, **kwargs) -> bool:
+        """Send one message with rate limiting, FloodWait handling and retries.
+
+        Returns:
+            bool: True if the message was delivered
+        """
+        attempt = 0
+        while True:
+            await self._wait_for_chat(chat_id)
+            await self.bucket.acquire()
+            started = time.perf_counter()
+            try:
+                await client.send_message(chat_id, text, **kwargs)
+                SEND_SECONDS.labels('send').observe(time.perf_counter() - started)
+                SENDS.labels('send', 'ok').inc()
+                return True
+            except telethon.errors.FloodWaitError as e:
+                SENDS.labels('send', 'flood_wait').inc()
+                if stats is not None:
+                    stats['flood_waits'] += 1
+                if e.seconds > self.max_flood_wait:
+                    logger.error(f"FloodWait of {e.seconds}s for chat {chat_id} exceeds limit, giving up")
+                    return False
+                logger.warning(f"FloodWait: pausing outbound sends for {e.seconds}s (chat {chat_id} rescheduled)")
+                self.bucket.pause(e.seconds)
+                self._chat_next_slot[chat_id] = time.monotonic() + e.seconds
+            except PERMANENT_ERRORS as e:
+                SENDS.labels('send', 'permanent_error').inc()
+                logger.error(f"Failed to send message to {chat_id}: {e}")
+                return False
+            except Exception as e:
+                SENDS.labels('send', 'error').inc()
+                attempt += 1
+                if attempt > self.max_retries:
+                    logger.error(f"Failed to send message to {chat_id} after {self.max_retries} retries: {e}")
+                    return False
+                if stats is not None:
+                    stats['retries'] += 1
+                backoff = 2 ** (attempt - 1)
+                logger.warning(f"Error sending message to {chat_id} (attempt {attempt}/{self.max_retries}), retrying in {backoff}s: {e}")
+                await asyncio.sleep(backoff)
+
+    async def send_many(self, client, chat_ids, text: str, label: str = 'message', **kwargs) -> dict:
+        """Fan out the same text to many chats with bounded concurrency.
+
+        Returns:
+            dict: Delivery report with sent/failed counts and timings
+        """
+        started = time.perf_counter()
+        queue = asyncio.Queue()
+        for chat_id in chat_ids:
+            queue.put_nowait(chat_id)
+        stats = {
+            'label': label,
+            'recipients': queue.qsize(),
+            'sent': 0,
+            'failed': [],
+            'retries': 0,
+            'flood_waits': 0,
+            'max_send_seconds': 0.0,
+        }
+
+        async def worker():
+            while True:
+                try:
+                    chat_id = queue.get_nowait()
+                except asyncio.QueueEmpty:
+                    return
+                send_started = time.perf_counter()
+                if await self.send(client, chat_id, text, stats=stats, **kwargs):
+                    stats['sent'] += 1
+                else:
+                    stats['failed'].append(chat_id)
+                stats['max_send_seconds'] = max(stats['max_send_seconds'], time.perf_counter() - send_started)
+
+        workers = [asyncio.create_task(worker()) for _ in range(min(self.concurrency, stats['recipients']))]
+        try:
+            await asyncio.gather(*workers)
+        except asyncio.CancelledError:
+            for task in workers:
+                task.cancel()
+            raise
+        stats['elapsed_seconds'] = time.perf_counter() - started
+        logger.info(
+            f"Delivered {label} to {stats['sent']}/{stats['recipients']} chats in {stats['elapsed_seconds']:.2f}s "
+            f"(failed: {len(stats['failed'])}, retries: {stats['retries']}, flood waits: {stats['flood_waits']}, "
+            f"slowest send: {stats['max_send_seconds']:.2f}s)"
+        )
+        return stats
@@ -0,0 +1,69 @@
+import hashlib
+import json
+import logging
+import time
+
+logger = logging.getLogger(__name__)
+
+
+def digest_cache_key(posts, model: str, *prompts: str) -> str:
+    """Content address of a digest: hash of the post set, the model and the prompt templates.
+
+    Every post contributes its ID, a hash of its content and its link, so an
+    edited post or a different post window yields a different key.
+    """
+    h = hashlib.sha256()
+    h.update(model.encode())
+    for prompt in prompts:
+        h.update(b'\0')
+        h.update(hashlib.sha256(prompt.encode()).digest())
+    h.update(b'\0')
+    for post in posts:
+        post_id, channel_title, timestamp, content, post_link = post
+        content_hash = hashlib.sha1(content.encode()).hexdigest()
+        h.update(f"{post_id}:{content_hash}:{post_link}\n".encode())
+    return h.hexdigest()
+
+
+class DigestCache:
+    """Persistent cache of generated digests (summary + link_map), keyed by digest_cache_key.
+
+    Entries expire `ttl_seconds` after creation; beyond `max_entries` the least
+    recently used entries are evicted.
+    """
+
+    def __init__(self, storage, ttl_seconds: float = 86400.0, max_entries: int = 500):
+        self.storage = storage
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+
+    async def get(self, key: str):
+        """Return (summary, link_map) for `key`, or None on a miss."""
+        now = time.time()
+        row = await self.storage.get_cached_digest(key, now - self.ttl_seconds, now)
+        if row is None:
+            self.misses += 1
+            logger.info(f"Digest cache miss for {key[:12]}")
+            return None
+        self.hits += 1
+        summary, link_map_json = row
+        link_map = {int(num): link for num, link in json.loads(link_map_json).items()}
+        logger.info(f"Digest cache hit for {key[:12]}")
+        return summary, link_map
+
+    async def put(self, key: str, summary: str, link_map: dict):
+        now = time.time()
+        await self.storage.put_cached_digest(
+            key, summary, json.dumps(link_map), now,
+            expired_before=now - self.ttl_seconds, max_entries=self.max_entries,
+        )
+
+    def stats(self) -> dict:
+        total = self.hits + self.misses
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': self.hits / total if total else 0.0,
+        }
@@ -0,0 +1,149 @@
+import asyncio
+import logging
+import time
+
+logger = logging.getLogger(__name__)
+
+_STOP = object()
+
+
+class IngestQueue:
+    """Bounded write-behind queue for incoming channel posts.
+
+    Handlers enqueue posts and return immediately; a single background writer
+    drains the queue and inserts posts in batches with one transaction per
+    batch. A batch is flushed when it reaches `batch_size` rows or when
+    `flush_interval` seconds have passed since its first row arrived. When the
+    queue is full, `put` waits, which pushes back on the event handlers instead
+    of growing memory without limit.
+    """
+
+    def __init__(self, storage, maxsize: int = 10000, batch_size: int = 200,
+                 flush_interval: float = 1.0, max_retries: int = 3, stats_interval: float = 300.0):
+        self.storage = storage
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.max_retries = max_retries
+        self.stats_interval = stats_interval
+        self._queue = asyncio.Queue(maxsize=maxsize)
+        self._writer_task = None
+        self._closing = False
+        self._last_stats_log = time.monotonic()
+        # Counters for sizing the queue
+        self.batches_written = 0
+        self.rows_written = 0
+        self.rows_dropped = 0
+        self.max_depth = 0
+        self.last_batch_size = 0
+        self.last_batch_seconds = 0.0
+        self.max_batch_seconds = 0.0
+        self.total_batch_seconds = 0.0
+
+    def start(self):
+        """Start the background writer task."""
+        if self._writer_task is None:
+            self._writer_task = asyncio.create_task(self._run())
+            logger.info(f"Ingest queue started (maxsize={self._queue.maxsize}, batch_size={self.batch_size}, flush_interval={self.flush_interval}s)")
+
+    async def put(self, row: tuple):
+        """Enqueue one post row (the tuple Storage.save_posts inserts)."""
+        if self._closing:
+            raise RuntimeError("Ingest queue is closed")
+        await self._queue.put(row)
+        depth = self._queue.qsize()
+        if depth > self.max_depth:
+            self.max_depth = depth
+
+    async def put_many(self, rows: list):
+        """Enqueue several post rows in order."""
+        for row in rows:
+            await self.put(row)
+
+    @property
+    def depth(self) -> int:
+        return self._queue.qsize()
+
+    def stats(self) -> dict:
+        """Snapshot of queue depth and batch latency counters."""
+        avg = self.total_batch_seconds / self.batches_written if self.batches_written else 0.0
+        return {
+            'depth': self.depth,
+            'max_depth': self.max_depth,
+            'maxsize': self._queue.maxsize,
+            'batches_written': self.batches_written,
+            'rows_written': self.rows_written,
+            'rows_dropped': self.rows_dropped,
+            'last_batch_size': self.last_batch_size,
+            'last_batch_ms': self.last_batch_seconds * 1000,
+            'avg_batch_ms': avg * 1000,
+            'max_batch_ms': self.max_batch_seconds * 1000,
+        }
+
+    async def close(self):
+        """Stop accepting posts and flush everything that is still queued."""
+        if self._closing:
+            if self._writer_task is not None:
+                await asyncio.shield(self._writer_task)
+            return
+        self._closing = True
+        if self._writer_task is None:
+            return
+        logger.info(f"Flushing ingest queue ({self.depth} posts pending)...")
+        await self._queue.put(_STOP)
+        await asyncio.shield(self._writer_task)
+        logger.info(f"Ingest queue flushed and stopped. Stats: {self.stats()}")
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        stop = False
+        while not stop:
+            item = await self._queue.get()
+            if item is _STOP:
+                break
+            batch = [item]
+            deadline = loop.time() + self.flush_interval
+            while len(batch) < self.batch_size:
+                # Take whatever is already queued without waiting first
+                try:
+                    item = self._queue.get_nowait()
+                except asyncio.QueueEmpty:
+                    timeout = deadline - loop.time()
+                    if timeout <= 0:
+                        break
+                    try:
+                        item = await asyncio.wait_for(self._queue.get(), timeout)
+                    except asyncio.TimeoutError:
+                        break
+                if item is _STOP:
+                    stop = True
+                    break
+                batch.append(item)
+            await self._flush(batch)
+
+    async def _flush(self, batch: list):
+        for attempt in range(1, self.max_retries + 1):
+            started = time.perf_counter()
+            try:
+                await self.storage.save_posts(batch)
+            except Exception as e:
+                logger.error(f"Failed to write batch of {len(batch)} posts (attempt {attempt}/{self.max_retries}): {e}")
+                await asyncio.sleep(0.5 * attempt)
+                continue
+            elapsed = time.perf_counter() - started
+            self.batches_written += 1
+            self.rows_written += len(batch)
+            self.last_batch_size = len(batch)
+            self.last_batch_seconds = elapsed
+            self.total_batch_seconds += elapsed
+            self.max_batch_seconds = max(self.max_batch_seconds, elapsed)
+            logger.debug(f"Wrote batch of {len(batch)} posts in {elapsed * 1000:.1f} ms (queue depth {self.depth})")
+            self._maybe_log_stats()
+            return
+        self.rows_dropped += len(batch)
+        logger.error(f"Dropping batch of {len(batch)} posts after {self.max_retries} failed attempts")
+
+    def _maybe_log_stats(self):
+        now = time.monotonic()
+        if now - self._last_stats_log >= self.stats_interval:
+            self._last_stats_log = now
+            logger.info(f"Ingest queue stats: {self.stats()}")
@@ -0,0 +1,153 @@
+import asyncio
+import json
+import logging
+import os
+import socket
+import time
+
+logger = logging.getLogger(__name__)
+
+
+class JobFailed(Exception):
+    """A job ran out of attempts (or timed out waiting for a worker)."""
+
+
+class JobQueue:
+    """Submits jobs to the digest_jobs table and waits for their results.
+
+    Used by the bot process: work is run by JobWorker instances in other
+    processes (see worker.py) that share the same database. Payloads and
+    results are JSON. Jobs with the same dedupe_key share one queued or
+    running job.
+    """
+
+    def __init__(self, storage, max_attempts: int = 3, poll_seconds: float = 0.5):
+        self.storage = storage
+        self.max_attempts = max_attempts
+        self.poll_seconds = poll_seconds
+
+    async def submit(self, kind: str, payload: dict, dedupe_key: str = None) -> int:
+        job_id = await self.storage.enqueue_job(kind, json.dumps(payload), dedupe_key, self.max_attempts)
+        logger.info(f"Queued {kind} job {job_id}")
+        return job_id
+
+    async def wait(self, job_id: int, timeout: float = None):
+        """Poll until the job is done and return its result.
+
+        Raises:
+            JobFailed: The job failed on its last attempt, or `timeout` seconds passed
+        """
+        deadline = time.monotonic() + timeout if timeout else None
+        while True:
+            row = await self.storage.get_job(job_id)
+            if row is None:
+                raise JobFailed(f"Job {job_id} does not exist")
+            status, result, error = row
+            if status == 'done':
+                return json.loads(result)
+            if status == 'failed':
+                raise JobFailed(f"Job {job_id} failed: {error}")
+            if deadline is not None and time.monotonic() >= deadline:
+                raise JobFailed(f"Job {job_id} not finished after {timeout:.0f}s (status: {status})")
+            await asyncio.sleep(self.poll_seconds)
+
+    async def run(self, kind: str, payload: dict, dedupe_key: str = None, timeout: float = None):
+        """Submit a job and wait for its result."""
+        return await self.wait(await self.submit(kind, payload, dedupe_key), timeout)
+
+
+class JobWorker:
+    """Runs jobs from the digest_jobs table.
+
+    Up to `concurrency` jobs run at a time, each under a lease of
+    `lease_seconds` that a heartbeat extends every `heartbeat_seconds`. If the
+    process dies, the lease runs out and another worker reclaims the job. A
+    job that raises is retried after an exponential backoff until it has used
+    `max_attempts` (set at submit time); a worker that loses a lease stops
+    treating the job as its own and drops the result.
+
+    Args:
+        handlers: kind -> async function(payload) returning a JSON-serializable result
+    """
+
+    def __init__(self, storage, handlers: dict, worker_id: str = None, concurrency: int = 2,
+                 lease_seconds: float = 60.0, heartbeat_seconds: float = 15.0, poll_seconds: float = 1.0,
+                 retry_backoff_seconds: float = 10.0, keep_finished_seconds: float = 86400.0):
+        self.storage = storage
+        self.handlers = handlers
+        self.worker_id = worker_id or f"{socket.gethostname()}:{os.getpid()}"
+        self.concurrency = concurrency
+        self.lease_seconds = lease_seconds
+        self.heartbeat_seconds = heartbeat_seconds
+        self.poll_seconds = poll_seconds
+        self.retry_backoff_seconds = retry_backoff_seconds
+        self.keep_finished_seconds = keep_finished_seconds
+        self._running = set()
+        self.completed = 0
+        self.failed = 0
+
+    async def run(self):
+        """Claim and run jobs until cancelled."""
+        logger.info(f"Worker {self.worker_id} started (concurrency {self.concurrency}, lease {self.lease_seconds:.0f}s)")
+        last_cleanup = 0.0
+        try:
+            while True:
+                try:
+                    free = self.concurrency - len(self._running)
+                    jobs = await self.storage.claim_jobs(self.worker_id, free, self.lease_seconds) if free > 0 else []
+                    for job in jobs:
+                        task = asyncio.create_task(self._execute(*job))
+                        self._running.add(task)
+                        task.add_done_callback(self._running.discard)
+                    if time.time() - last_cleanup > 3600:
+                        last_cleanup = time.time()
+                        deleted = await self.storage.delete_finished_jobs(last_cleanup - self.keep_finished_seconds)
+                        if deleted:
+                            logger.info(f"Deleted {deleted} finished jobs")
+                    if not jobs:
+                        await asyncio.sleep(self.poll_seconds)
+                except asyncio.CancelledError:
+                    raise
+                except Exception as e:
+                    logger.error(f"Error in worker {self.worker_id}: {e}", exc_info=True)
+                    await asyncio.sleep(5)
+        except asyncio.CancelledError:
+            logger.info(f"Worker {self.worker_id} cancelled with {len(self._running)} jobs running; their leases will expire.")
+            for task in list(self._running):
+                task.cancel()
+            raise
+
+    async def _heartbeat(self, job_id: int, lost: asyncio.Event):
+        while True:
+            await asyncio.sleep(self.heartbeat_seconds)
+            if not await self.storage.extend_job_lease(job_id, self.worker_id, time.time() + self.lease_seconds):
+                logger.warning(f"Worker {self.worker_id} lost the lease on job {job_id}")
+                lost.set()
+                return
+
+    async def _execute(self, job_id: int, kind: str, payload: str, attempts: int, max_attempts: int):
+        started = time.perf_counter()
+        lost = asyncio.Event()
+        heartbeat = asyncio.create_task(self._heartbeat(job_id, lost))
+        try:
+            handler = self.handlers.get(kind)
+            if handler is None:
+                raise ValueError(f"No handler for job kind {kind!r}")
+            logger.info(f"Running {kind} job {job_id} (attempt {attempts}/{max_attempts})")
+            result = await handler(json.loads(payload))
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            self.failed += 1
+            retry_at = time.time() + self.retry_backoff_seconds * 2 ** (attempts - 1)
+            logger.error(f"{kind} job {job_id} failed (attempt {attempts}/{max_attempts}): {e}", exc_info=True)
+            if not lost.is_set():
+                await self.storage.fail_job(job_id, self.worker_id, f"{type(e).__name__}: {e}", retry_at)
+            return
+        finally:
+            heartbeat.cancel()
+        if lost.is_set() or not await self.storage.complete_job(job_id, self.worker_id, json.dumps(result)):
+            logger.warning(f"Dropping result of {kind} job {job_id}: lease lost to another worker")
+            return
+        self.completed += 1
+        logger.info(f"Finished {kind} job {job_id} in {time.perf_counter() - started:.1f}s")
@@ -1,71 +1,184 @@
+import time
+# Startup phases are measured from here (see StartupTimer)
+IMPORT_STARTED = time.perf_counter()
+
 import logging
 from telethon import TelegramClient, events
 import datetime
 import asyncio
-import openai
-import sqlite3
 from pathlib import Path
 import signal
 import sys
-from datetime import datetime, timedelta
-import os
+from datetime import datetime, timedelta, timezone
 import re
-import pytz
 import telethon.errors
 from functools import partial
 
-# Import configuration
-from config import (
-    API_ID, API_HASH, BOT_TOKEN, CHANNELS,
-    OPENAI_API_KEY, GPT_MODEL, SUMMARY_PROMPT_TEMPLATE,
-    DIGEST_TIME,
+from backfill import Backfiller
+from channels import ChannelRegistry
+from clustering import group_posts
+from albums import AlbumCoalescer, album_captions, album_content
+from compaction import PromptCompactor
+from dedup import DuplicateIndex
+from delivery import Deliverer
+from digest_cache import DigestCache, digest_cache_key
+from ingest import IngestQueue
+from jobs import JobQueue
+from metrics import (
+    REGISTRY, Gauge, MetricsServer, StartupTimer, timed,
+    HANDLER_SECONDS, HANDLER_ERRORS, POSTS_RECEIVED, SUMMARIZE_SECONDS, FANOUT_SECONDS, FANOUT_RECIPIENTS,
 )
+from notifications import NotificationAggregator
+from presummary import PreSummarizer
+from rendering import render_digest, split_message
+from retention import Retention
+from scheduler import DigestScheduler, Schedule, UnknownTimeZoneError, get_timezone
+from search import match_expression, parse_search_args, query_terms, snippet
+from singleflight import SingleFlight
+from streaming import StreamingMessage
+from subscriptions import group_by_channel_set, numbered_channels, parse_channel_args
+from storage import Storage
+from summarizer import LazyClient, Summarizer
+
+# Import configuration
+from config import settings, SUMMARY_PROMPT_TEMPLATE, REDUCE_PROMPT_TEMPLATE
 
 # Configure logging
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
 
-# Debug: Print all environment variables
-logger.info(f"Environment variables after import: {dict(os.environ)}")
 
-# Initialize OpenAI client
-openai_client = openai.AsyncClient(api_key=OPENAI_API_KEY)
+def create_openai_client():
+    import openai  # the SDK and its dependencies take about a second to import
+    return openai.AsyncClient(api_key=settings.openai_api_key, base_url=settings.openai_base_url)
+
+
+# OpenAI client, built on first use (main() warms it up in the background once the bot is running)
+openai_client = LazyClient(create_openai_client)
+# Posts are compacted and token-counted once at ingestion (see save_post)
+prompt_compactor = PromptCompactor(settings.gpt_model, max_tokens=settings.prompt_post_max_tokens)
+summarizer = Summarizer(
+    openai_client,
+    model=settings.gpt_model,
+    prompt=SUMMARY_PROMPT_TEMPLATE,
+    reduce_prompt=REDUCE_PROMPT_TEMPLATE,
+    batch_tokens=settings.summary_batch_tokens,
+    max_concurrency=settings.summary_max_concurrency,
+    max_tokens=settings.summary_max_tokens,
+    grouper=partial(group_posts, max_clusters=settings.clustering_max_topics, merge_threshold=settings.clustering_merge_similarity)
+    if settings.clustering_enabled else None,
+    compactor=prompt_compactor,
+)
 
 # Database setup
 DB_PATH = 'digest.db'  # Use a single database file
+storage = Storage(DB_PATH)
+# Recent post fingerprints for near-duplicate detection at ingestion
+duplicate_index = DuplicateIndex(
+    min_similarity=settings.dedup_min_similarity,
+    window_seconds=settings.dedup_window_hours * 3600,
+    max_entries=settings.dedup_max_entries,
+)
+ingest_queue = IngestQueue(
+    storage,
+    maxsize=settings.ingest_queue_maxsize,
+    batch_size=settings.ingest_batch_size,
+    flush_interval=settings.ingest_flush_interval_seconds,
+)
 
-def init_database():
-    """Initialize SQLite database and create necessary tables if they don't exist."""
-    conn = sqlite3.connect(DB_PATH)
-    cursor = conn.cursor()
-    
-    # Create users table
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS users (
-            user_id INTEGER PRIMARY KEY,
-            username TEXT,
-            first_seen TEXT
-        )
-    ''')
-    
-    # Create posts table with channel information and post link
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS posts (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            channel_id TEXT NOT NULL,
-            channel_title TEXT NOT NULL,
-            timestamp TEXT NOT NULL,
-            content TEXT NOT NULL,
-            post_link TEXT,
-            sent BOOLEAN DEFAULT FALSE
-        )
-    ''')
-    
-    conn.commit()
-    conn.close()
-    logger.info("Database initialized successfully (posts table updated with post_link)")
+digest_cache = DigestCache(storage, ttl_seconds=settings.digest_cache_ttl_seconds, max_entries=settings.digest_cache_max_entries)
+# Concurrent requests for the same post set share one generation
+digest_flights = SingleFlight()
+# Posts are summarized in the background; digests are assembled from these pieces
+presummarizer = PreSummarizer(
+    storage, summarizer,
+    batch_posts=settings.presummary_batch_posts,
+    interval_seconds=settings.presummary_interval_minutes * 60,
+)
+
+# Digest generation queued for worker processes (worker.py) when DIGEST_WORKERS_ENABLED
+job_queue = JobQueue(storage, max_attempts=settings.job_max_attempts)
+
+# Monitored channels, resolved once and reloadable at runtime (the user client is attached in main)
+channel_registry = ChannelRegistry(storage, channels_file=settings.channels_file)
+
+# Sent posts past the retention age move to the compressed archive table
+retention = Retention(
+    storage,
+    max_age_days=settings.retention_days,
+    chunk_size=settings.retention_chunk_size,
+    interval_seconds=settings.retention_interval_minutes * 60,
+    vacuum_pages=settings.retention_vacuum_pages,
+    convert_database=settings.retention_convert_database,
+)
+
+# Automatic digests: a heap of per-user fire times; dispatch is bound to the bot in main()
+MIN_DIGEST_INTERVAL_MINUTES = 15
+digest_scheduler = DigestScheduler(
+    None,
+    # DIGEST_TIMEZONE is checked in main(): loading it here would import pytz at startup
+    Schedule.interval(settings.digest_interval_minutes) if settings.digest_schedule_mode == 'interval'
+    else Schedule.daily(settings.digest_time, settings.digest_timezone, check_tz=False),
+    jitter_seconds=settings.digest_jitter_seconds,
+)
+
+# Outbound messages: one shared rate limiter for every send the bot makes
+deliverer = Deliverer(
+    concurrency=settings.delivery_concurrency,
+    global_rate=settings.delivery_global_rate,
+    per_chat_interval=settings.delivery_per_chat_interval,
+    max_retries=settings.delivery_max_retries,
+    max_flood_wait=settings.delivery_max_flood_wait,
+)
+
+# Component state read on every /metrics scrape (see metrics.MetricsServer)
+Gauge('ingest_queue_depth', 'Posts waiting in the ingest queue', lambda: ingest_queue.depth)
+Gauge('ingest_rows_written_total', 'Posts written by the ingest queue', lambda: ingest_queue.rows_written, kind='counter')
+Gauge('ingest_rows_dropped_total', 'Posts the ingest queue failed to write', lambda: ingest_queue.rows_dropped, kind='counter')
+Gauge('digest_cache_lookups_total', 'Digest cache lookups by result',
+      lambda: {('hit',): digest_cache.hits, ('miss',): digest_cache.misses}, labelnames=['result'], kind='counter')
+Gauge('monitored_channels', 'Channels in the channel registry', lambda: len(channel_registry))
+Gauge('scheduled_users', 'Users with an automatic digest in the scheduler', lambda: len(digest_scheduler))
+metrics_server = MetricsServer(REGISTRY, host=settings.metrics_host, port=settings.metrics_port)
+startup = StartupTimer(IMPORT_STARTED)
+
+async def init_database():
+    """Open the shared storage (WAL, dedicated I/O threads) and apply pending schema migrations."""
+    await storage.open()
+    logger.info("Database initialized successfully")
+
+async def load_tokenizer():
+    """Load the prompt tokenizer in a thread (bot and digest workers, at startup).
+
+    Off the event loop: nothing should wait for the BPE file to be read or
+    downloaded. Past TOKENIZER_LOAD_TIMEOUT_SECONDS, counts are estimated.
+    """
+    try:
+        await asyncio.wait_for(asyncio.to_thread(prompt_compactor.load), settings.tokenizer_load_timeout_seconds)
+    except asyncio.TimeoutError:
+        prompt_compactor.use_estimate()
+        logger.warning(f"Tokenizer not loaded within {settings.tokenizer_load_timeout_seconds}s, estimating token counts")
+    logger.info(f"Prompt token counts: {prompt_compactor.tokenizer}")
+
+async def warm_openai_client():
+    """Build the OpenAI client (importing the SDK) in a worker thread, off the event loop."""
+    try:
+        await asyncio.get_running_loop().run_in_executor(None, openai_client.get)
+    except Exception as e:
+        logger.error(f"Could not create the OpenAI client: {e}")
 
-def register_user(user_id: int, username: str = None):
+async def warm_duplicate_index():
+    """Load recent canonical posts into the dedup index so duplicates are caught across restarts."""
+    since = datetime.now() - timedelta(seconds=duplicate_index.window_seconds)
+    rows = await storage.get_canonical_posts_since(since.isoformat())
+    for content, post_link, timestamp in rows:
+        try:
+            duplicate_index.check(content, post_link, datetime.fromisoformat(timestamp).timestamp())
+        except ValueError:
+            continue
+    logger.info(f"Dedup index warmed with {len(duplicate_index)} recent posts")
+
+async def register_user(user_id: int, username: str = None):
     """Register a new user in the database if not exists.
     
     Args:
@@ -75,128 +188,98 @@ def register_user(user_id: int, username: str = None):
     Returns:
         bool: True if new user was registered, False if already exists
     """
-    conn = sqlite3.connect(DB_PATH)
-    cursor = conn.cursor()
-    
-    # Check if user exists
-    cursor.execute('SELECT user_id FROM users WHERE user_id = ?', (user_id,))
-    if cursor.fetchone() is not None:
-        conn.close()
-        return False
-    
-    # Register new user
     now = datetime.now().isoformat()
-    cursor.execute(
-        'INSERT INTO users (user_id, username, first_seen) VALUES (?, ?, ?)',
-        (user_id, username, now)
-    )
-    
-    conn.commit()
-    conn.close()
-    logger.info(f"New user registered: {user_id} ({username})")
-    return True
-
-def init_posts_database():
-    """Initialize SQLite database for posts and create table if it doesn't exist."""
-    conn = sqlite3.connect(DB_PATH)
-    cursor = conn.cursor()
-    
-    # Create posts table with sent flag
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS posts (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            timestamp TEXT NOT NULL,
-            content TEXT NOT NULL,
-            sent BOOLEAN DEFAULT FALSE
-        )
-    ''')
-    
-    conn.commit()
-    conn.close()
-    logger.info("Posts database initialized successfully")
-
-async def save_post(channel_id: str, channel_title: str, timestamp: str, content: str, post_link: str):
-    """Save a post to the database, including its link."""
-    conn = sqlite3.connect(DB_PATH)
-    cursor = conn.cursor()
-    cursor.execute(
-        'INSERT INTO posts (channel_id, channel_title, timestamp, content, post_link, sent) VALUES (?, ?, ?, ?, ?, FALSE)',
-        (channel_id, channel_title, timestamp, content, post_link)
-    )
-    conn.commit()
-    conn.close()
-    logger.info(f"Saved post from {channel_title} with link: {post_link}")
+    is_new_user = await storage.register_user(user_id, username, now)
+    if is_new_user:
+        logger.info(f"New user registered: {user_id} ({username})")
+    return is_new_user
+
+async def get_user_ids():
+    """Get IDs of all registered users."""
+    return await storage.get_user_ids()
+
+async def get_notification_user_ids():
+    """Get IDs of registered users who have not muted new-post notifications."""
+    return await storage.get_notification_user_ids(datetime.now().isoformat())
 
-def get_unsent_posts():
-    """Get all unsent posts from the database, including their links."""
+async def save_post(channel_id: str, channel_title: str, timestamp: str, content: str, post_link: str,
+                    message_id: int = None):
+    """Queue a post for saving, including its link. The ingest queue writes it in the next batch.
+
+    Near-duplicates of a recent post are linked to it through duplicate_of. The
+    compacted prompt text and its token count are stored with the post, so
+    digests don't compact or tokenize it again. Albums are compared by their
+    captions only; a caption-less album is never a duplicate.
+    """
+    duplicate_of = None
+    dedup_content = album_captions(content)
+    if settings.dedup_enabled and dedup_content:
+        try:
+            duplicate_of = duplicate_index.check(dedup_content, post_link, datetime.fromisoformat(timestamp).timestamp())
+        except Exception as e:
+            logger.error(f"Error checking post {post_link} for duplicates: {e}")
+        if duplicate_of:
+            logger.info(f"Post {post_link} is a near-duplicate of {duplicate_of}")
     try:
-        conn = sqlite3.connect(DB_PATH)
-        cursor = conn.cursor()
-        cursor.execute('''
-            SELECT id, channel_title, timestamp, content, post_link
-            FROM posts
-            WHERE sent = FALSE
-            ORDER BY timestamp ASC
-        ''')
-        posts = cursor.fetchall()
-        conn.close()
-        
-        logger.info(f"Found {len(posts)} unsent posts (with links)")
-        
-        # Log the first few posts for debugging
-        if posts:
-            for i, post in enumerate(posts[:3]):
-                if len(post) >= 5: # Check length before accessing index
-                    logger.debug(f"Post {i+1}: ID={post[0]}, Channel={post[1]}, Time={post[2]}, Link={post[4]}") # Логируем ссылку
-                else:
-                    logger.debug(f"Post {i+1} has unexpected format: {post}")
-        
-        return posts
+        prompt_text, prompt_tokens = prompt_compactor.compact(content)
     except Exception as e:
-        logger.error(f"Error getting unsent posts: {e}")
-        return []
+        logger.error(f"Error compacting post {post_link}: {e}")
+        prompt_text, prompt_tokens = None, None
+    await ingest_queue.put(
+        (channel_id, channel_title, timestamp, content, post_link, duplicate_of, message_id, prompt_text, prompt_tokens)
+    )
+    logger.info(f"Queued post from {channel_title} with link: {post_link} (queue depth: {ingest_queue.depth})")
 
-def mark_posts_as_sent(post_ids: list):
+async def mark_posts_as_sent(post_ids: list):
     """Mark specified post IDs as sent in the database."""
     if not post_ids:
         return
     
     try:
-        conn = sqlite3.connect(DB_PATH)
-        cursor = conn.cursor()
-        
-        # Use parameterized query to avoid SQL injection
-        placeholders = ', '.join('?' * len(post_ids))
-        cursor.execute(
-            f'UPDATE posts SET sent = TRUE WHERE id IN ({placeholders})',
-            post_ids
-        )
-        
-        conn.commit()
-        conn.close()
+        await storage.mark_posts_as_sent(post_ids)
         logger.info(f"Marked {len(post_ids)} posts as sent")
     except Exception as e:
         logger.error(f"Error marking posts as sent: {e}")
 
-def get_recent_posts_for_manual_digest(hours=4):
-    """Get posts from the last N hours for manual digest, including links."""
+async def mark_unsubscribed_posts_sent(until: str):
+    """Mark unsent posts from channels no user's digest covers as sent, up to `until`.
+
+    Only delivered posts are marked sent after a digest, so without this
+    posts from channels nobody subscribes to would stay unsent forever:
+    never archived by retention and pre-summarized again on every pass.
+    """
+    try:
+        groups = await get_digest_groups(await get_user_ids())
+        if None in groups:
+            return  # someone gets every channel
+        subscribed = set().union(*groups)
+        marked, chunk_size = 0, 1000
+        while True:
+            chunk = await storage.mark_unsubscribed_posts_sent(subscribed, until, limit=chunk_size)
+            marked += chunk
+            if chunk < chunk_size:
+                break
+        if marked:
+            logger.info(f"Marked {marked} posts from channels without subscribers as sent")
+    except Exception as e:
+        logger.error(f"Error marking posts from channels without subscribers as sent: {e}")
+
+async def get_recent_posts_for_manual_digest(hours=4, channel_ids: list = None):
+    """Get posts from the last N hours for manual digest, including links.
+
+    Args:
+        channel_ids: Only posts from these channels (bare IDs); None means every channel
+    """
     try:
         # Calculate timestamp for N hours ago
         now = datetime.now()
         hours_ago = now - timedelta(hours=hours)
         timestamp_threshold = hours_ago.isoformat()
         
-        conn = sqlite3.connect(DB_PATH)
-        cursor = conn.cursor()
-        cursor.execute('''
-            SELECT id, channel_title, timestamp, content, post_link
-            FROM posts
-            WHERE timestamp > ?
-            ORDER BY timestamp ASC
-        ''', (timestamp_threshold,))
-        
-        posts = cursor.fetchall()
-        conn.close()
+        if channel_ids is None:
+            posts = await storage.get_posts_since(timestamp_threshold)
+        else:
+            posts = await storage.get_posts_since_for_channels(timestamp_threshold, channel_ids)
         
         # Validate and clean posts data
         valid_posts = []
@@ -228,53 +311,54 @@ def get_recent_posts_for_manual_digest(hours=4):
         logger.error(f"Error getting recent posts for manual digest: {e}")
         return []
 
-def count_unsent_posts():
+async def count_unsent_posts():
     """Get count of unsent posts from the database."""
-    conn = sqlite3.connect(DB_PATH)
-    cursor = conn.cursor()
-    cursor.execute('SELECT COUNT(*) FROM posts WHERE sent = FALSE')
-    count = cursor.fetchone()[0]
-    
-    # Get the earliest unsent post timestamp
-    cursor.execute('SELECT MIN(timestamp) FROM posts WHERE sent = FALSE')
-    earliest_timestamp = cursor.fetchone()[0]
-    
-    conn.close()
-    return count, earliest_timestamp
+    return await storage.count_unsent_posts()
 
 async def format_digest(posts):
-    """Format posts into a readable digest, including post links."""
+    """Format posts into a readable digest, including post links.
+
+    Posts are grouped into topics across channels by local TF-IDF clustering
+    (see clustering.group_posts); with clustering disabled there is one topic per channel.
+    """
     if not posts:
         return "Нет постов для включения в дайджест."
 
-    # Group posts by channel
-    channels = {}
+    valid_posts = []
     for post in posts:
         if len(post) != 5:
             logger.warning(f"Skipping post in format_digest due to invalid format (expected 5): {post}")
             continue
-        post_id, channel_title, timestamp, content, post_link = post
-        if channel_title not in channels:
-            channels[channel_title] = []
-        channels[channel_title].append((timestamp, content, post_link))
+        valid_posts.append(post)
+
+    topics = []
+    if settings.clustering_enabled and valid_posts:
+        try:
+            groups = await asyncio.to_thread(
+                group_posts, valid_posts,
+                max_clusters=settings.clustering_max_topics, merge_threshold=settings.clustering_merge_similarity,
+            )
+            for terms, topic_posts in groups:
+                topic_name = ", ".join(terms) if terms else "Разное"
+                topics.append((topic_name, topic_posts))
+        except Exception as e:
+            logger.error(f"Topic clustering failed, grouping by channel: {e}")
+            topics = []
+    if not topics:
+        channels = {}
+        for post in valid_posts:
+            channels.setdefault(post[1], []).append(post)
+        topics = [(f"Новые посты из {channel_title}", channel_posts) for channel_title, channel_posts in channels.items()]
 
     # Format digest
     digest = "🧠 Дайджест:\n\n"
 
-    # Group posts by topic (you can implement more sophisticated grouping later)
-    topics = {}
-    topic_counter = 1
-
-    for channel_title, channel_posts in channels.items():
-        topic_name = f"Новые посты из {channel_title}"
-        topics[topic_name] = channel_posts
-
-    for topic_name, topic_posts in topics.items():
+    for topic_counter, (topic_name, topic_posts) in enumerate(topics, start=1):
         # Add topic header
         digest += f"📌 Тема {topic_counter}: {topic_name}\n"
-        
+
         # Add posts under this topic
-        for timestamp, content, post_link in topic_posts:
+        for post_id, channel_title, timestamp, content, post_link in topic_posts:
             try:
                 dt = datetime.fromisoformat(timestamp)
                 time_str = dt.strftime("%H:%M")
@@ -284,12 +368,11 @@ async def format_digest(posts):
             # Format post content with clickable link
             preview = content[:200] + "..." if len(content) > 200 else content
             if post_link:
-                digest += f"• [{time_str}]({post_link}): {preview}\n"
+                digest += f"• [{time_str}]({post_link}) {channel_title}: {preview}\n"
             else:
-                digest += f"• {time_str}: {preview}\n"
-        
+                digest += f"• {time_str} {channel_title}: {preview}\n"
+
         digest += "\n"
-        topic_counter += 1
 
     # Add entertainment section
     digest += "🎭 Интересное\n"
@@ -307,167 +390,337 @@ def format_entertainment_content(posts):
     # Add your logic to format entertainment content
     return "Развлекательного контента в постах не найдено."
 
-async def summarize_posts(posts):
-    """Generate a summary of posts using OpenAI, returning summary text and a link map."""
-    if not posts:
-        logger.info("[summarize_posts] No posts received, returning None, None.")
-        return None, None # Return None for both summary and link map
-        
+async def generate_digest(posts, cache_key, on_text=None):
+    """Return the cached digest for cache_key, or generate and cache it.
+
+    `on_text(text_so_far, link_map)` receives the final generation call as it streams.
+    """
     try:
-        # Format posts for the prompt and create link map
-        formatted_posts = []
-        link_map = {} # Dictionary to store {index: link}
-        for i, post in enumerate(posts):
-            try:
-                if len(post) != 5:
-                    logger.warning(f"Skipping post in summarize_posts due to invalid format (expected 5): {post}")
-                    continue
+        cached = await digest_cache.get(cache_key)
+        if cached is not None:
+            return cached
+    except Exception as e:
+        logger.error(f"[summarize_posts] Digest cache lookup failed: {e}")
+    post_ids = [post[0] for post in posts]
+    duplicate_of = await storage.get_duplicate_of(post_ids)
+    prompt_texts = await storage.get_prompt_texts(post_ids)
+    if settings.presummary_enabled:
+        summary, link_map = await presummarizer.summarize(
+            posts, duplicate_of=duplicate_of, on_text=on_text, prompt_texts=prompt_texts)
+    else:
+        summary, link_map = await summarizer.summarize(
+            posts, duplicate_of=duplicate_of, on_text=on_text, prompt_texts=prompt_texts)
+    if summary:
+        try:
+            await digest_cache.put(cache_key, summary, link_map)
+        except Exception as e:
+            logger.error(f"[summarize_posts] Failed to store digest in cache: {e}")
+    return summary, link_map
 
-                post_id, channel_title, timestamp, content, post_link = post
-                
-                # Validate timestamp
-                try:
-                    time_str = datetime.fromisoformat(timestamp).strftime('%H:%M')
-                except ValueError:
-                    logger.warning(f"Skipping post with invalid timestamp: {timestamp}")
-                    continue
+async def generate_digest_in_worker(posts, cache_key):
+    """Return the cached digest for cache_key, or queue its generation for the digest workers and wait."""
+    try:
+        cached = await digest_cache.get(cache_key)
+        if cached is not None:
+            return cached
+    except Exception as e:
+        logger.error(f"[summarize_posts] Digest cache lookup failed: {e}")
+    result = await job_queue.run(
+        'digest', {'post_ids': [post[0] for post in posts], 'cache_key': cache_key},
+        dedupe_key=cache_key, timeout=settings.job_timeout_seconds,
+    )
+    return result['summary'], {int(number): link for number, link in result['link_map'].items()}
 
-                # Add post number, time, channel, content, and link to the formatted list
-                formatted_posts.append(f"[{i+1}] [{time_str}] [{channel_title}] {content}\n   Link: {post_link}")
-                link_map[i+1] = post_link # Store the link with its number
-            except Exception as e:
-                logger.error(f"Error formatting post for summary: {e}")
-                continue
-                
-        if not formatted_posts:
-            logger.warning("[summarize_posts] No valid posts to format for prompt, returning None, None.")
-            return None, None
-            
-        # Join all valid posts
-        posts_text = "\n\n".join(formatted_posts)
-        
-        # Call OpenAI API
-        logger.info(f"[summarize_posts] Calling OpenAI API with {len(formatted_posts)} formatted posts.")
-        response = await openai_client.chat.completions.create(
-            model=GPT_MODEL,
-            messages=[
-                {"role": "system", "content": SUMMARY_PROMPT_TEMPLATE},
-                {"role": "user", "content": posts_text}
-            ],
-            temperature=0.7,
-            max_tokens=3000
-        )
-        
-        summary = response.choices[0].message.content.strip()
-        
-        # --- LOGGING BEFORE RETURN ---
-        logger.info(f"[summarize_posts] OpenAI response received. Summary length: {len(summary) if summary else 0}")
-        logger.info(f"[summarize_posts] Summary snippet: {summary[:200] if summary else 'N/A'} ...")
-        logger.info(f"[summarize_posts] Link map generated: {link_map}")
-        # --- END LOGGING ---
-        
-        if summary.endswith('...') or summary.endswith('…'):
-            logger.warning("Summary appears to be truncated. Consider increasing max_tokens.")
-        
+async def summarize_posts(posts, on_text=None):
+    """Generate a summary of posts using OpenAI, returning summary text and a link map.
+
+    Large backlogs are summarized in token-budgeted batches and merged (see Summarizer).
+    Results are cached by the exact post set, model and prompts, so an unchanged
+    window is answered from the digest cache without calling OpenAI. Concurrent
+    calls for the same post set wait on a single generation.
+
+    With `on_text`, the generation is streamed: `on_text(text_so_far, link_map)`
+    is called as the final digest grows. Cache hits and callers coalesced onto
+    another caller's generation only get the returned result.
+
+    With DIGEST_WORKERS_ENABLED the generation runs in a worker process
+    (worker.py) and is not streamed.
+    """
+    started = time.perf_counter()
+    result = 'error'
+    try:
+        if not posts:
+            result = 'empty'
+            return await summarizer.summarize(posts)
+        cache_key = digest_cache_key(posts, settings.gpt_model, SUMMARY_PROMPT_TEMPLATE, REDUCE_PROMPT_TEMPLATE)
+        if settings.digest_workers_enabled:
+            summary, link_map = await digest_flights.do(cache_key, partial(generate_digest_in_worker, posts, cache_key))
+        else:
+            summary, link_map = await digest_flights.do(cache_key, partial(generate_digest, posts, cache_key, on_text))
+        if summary:
+            result = 'ok'
         return summary, link_map # Return summary text and link map
-        
     except Exception as e:
         logger.error(f"[summarize_posts] Error during generation: {e}")
         return None, None # Return None for both on error
+    finally:
+        SUMMARIZE_SECONDS.labels(result).observe(time.perf_counter() - started)
+
+async def get_digest_groups(user_ids: list) -> dict:
+    """Group recipients by the channels their digest covers.
+
+    Returns:
+        dict: channel IDs (sorted list, or None for every channel) -> user IDs.
+        Users on the default "all channels" set share the None group, which
+        also covers posts from channels that are no longer monitored.
+    """
+    monitored = {str(channel.id) for channel in channel_registry.channels()}
+    subscriptions = await storage.get_subscriptions()
+    groups = {}
+    for channel_set, users in group_by_channel_set(user_ids, subscriptions, monitored).items():
+        groups[None if channel_set == monitored else tuple(sorted(channel_set))] = users
+    if not monitored:
+        # Registry not loaded (e.g. channels unresolved): everyone gets every post
+        groups = {None: list(user_ids)} if user_ids else {}
+    return groups
+
+async def get_user_channel_ids(user_id: int):
+    """Channel IDs the user's digest covers, or None for every channel."""
+    groups = await get_digest_groups([user_id])
+    return list(next(iter(groups))) if groups and next(iter(groups)) is not None else None
+
+async def get_window_posts(window_start: str, window_end: str, channel_ids: list = None):
+    """Posts published in (window_start, window_end] for a scheduled digest.
+
+    Args:
+        channel_ids: Only posts from these channels (bare IDs); None means every channel
+    """
+    try:
+        posts = await storage.get_posts_in_window(window_start, window_end, channel_ids)
+        logger.info(f"Found {len(posts)} posts between {window_start} and {window_end}")
+        return posts
+    except Exception as e:
+        logger.error(f"Error getting posts for digest window: {e}")
+        return []
+
+async def search_posts(query: str, channel_ids: list = None, since: datetime = None, limit: int = 10):
+    """Stored posts containing every word of `query`, most relevant first (full-text index, see search.py).
+
+    Args:
+        channel_ids: Only posts from these channels (bare IDs); None means every channel,
+            with near-duplicates left out in favour of their canonical post
+        since: Only posts published at or after this time
 
-async def send_digest(manual=False, target_user_id=None):
+    Returns:
+        list: Tuples of (id, channel_title, timestamp, content, post_link)
+    """
+    match = match_expression(query, channel_ids)
+    if not match:
+        return []
+    return await storage.search_posts(
+        match, since=since.isoformat() if since else None, limit=limit, canonical_only=channel_ids is None,
+    )
+
+# Sent instead of a digest to users whose subscribed channels are all no longer monitored
+UNMONITORED_SUBSCRIPTIONS_TEXT = ("📭 Каналы из твоей подписки больше не отслеживаются, поэтому дайджест пуст.\n"
+                                  "Выбери каналы в /channels или верни все: /subscribe all")
+
+async def send_digest(bot, manual=False, target_user_id=None, recipient_ids=None, window=None):
     """Generate, format with links, and send digest.
+
+    Recipients are grouped by identical channel subscriptions and each
+    distinct digest is generated once (see get_digest_groups), so the number
+    of OpenAI calls follows the number of distinct subscription sets, not the
+    number of users.
+
+    After an automatic digest, a post is marked sent only if every group whose
+    digest included it got that digest generated and delivered (to at least
+    one member). Otherwise it stays unsent, so retention does not archive it
+    before the failed group's next digest. Members whose own send failed are
+    not done: their window is not advanced, and their next digest covers it again.
+    Users whose subscribed channels are all no longer monitored get a notice
+    instead of a digest.
     
     Args:
-        manual (bool): If True, get recent posts instead of unsent.
+        bot: Bot client used to deliver the digest.
+        manual (bool): If True, get recent posts instead of the window's.
         target_user_id (int, optional): If provided and manual=True, send only to this user.
+        recipient_ids (list, optional): Recipients of an automatic digest (default: all registered users).
+        window (tuple): (start, end) ISO timestamps, required for automatic digests,
+            which cover the posts published in that window.
+
+    Returns:
+        The digest text for manual requests; for automatic digests the IDs of the
+        recipients whose digest is done (delivered, or nothing to send).
     """
     try:
-        posts = get_recent_posts_for_manual_digest() if manual else get_unsent_posts()
-        if not posts:
-            if not manual:
-                logger.info("No new unsent posts for automatic digest.")
-                return None
-            return "Нет постов для дайджеста за последние 4 часа."
-
-        summary, link_map = await summarize_posts(posts)
-        if not summary:
-            logger.error("[send_digest] Failed to generate summary.")
-            return "Произошла ошибка при генерации дайджеста."
-
-        # Create the message with Markdown links
-        final_summary = summary
-        if link_map:
-            logger.info(f"[send_digest] Starting link replacement using string.replace(). Link map size: {len(link_map)}")
-            replacements_made = 0
-            for num in sorted(link_map.keys(), reverse=True):
-                link = link_map[num]
-                placeholder = f"[{num}]"
-                markdown_link = f"[{num}]({link})"
-                summary_before_replace = final_summary
-                final_summary = final_summary.replace(placeholder, markdown_link)
-                if summary_before_replace != final_summary:
-                    replacements_made += 1
-                    logger.debug(f"  Replaced '{placeholder}' -> '{markdown_link}'")
-            logger.info(f"[send_digest] Finished link replacement. Replacements made: {replacements_made}")
-        else:
-            logger.debug("[send_digest] Link map is empty or None. Skipping replacement.")
-
         # Determine recipients
-        recipient_ids = []
         if manual and target_user_id:
             recipient_ids = [target_user_id]
             logger.info(f"[send_digest] Manual digest requested. Sending only to user {target_user_id}")
         elif not manual:
-            conn = sqlite3.connect(DB_PATH)
-            cursor = conn.cursor()
-            cursor.execute('SELECT user_id FROM users')
-            recipient_ids = [row[0] for row in cursor.fetchall()]
-            conn.close()
-            logger.info(f"[send_digest] Automatic digest. Sending to {len(recipient_ids)} registered users.")
+            if recipient_ids is None:
+                recipient_ids = await get_user_ids()
+            logger.info(f"[send_digest] Automatic digest. Sending to {len(recipient_ids)} users.")
         else: # Manual digest without target_user_id (should not happen from /digest command)
              logger.warning("[send_digest] Manual digest called without target_user_id. Sending to all users.")
-             conn = sqlite3.connect(DB_PATH)
-             cursor = conn.cursor()
-             cursor.execute('SELECT user_id FROM users')
-             recipient_ids = [row[0] for row in cursor.fetchall()]
-             conn.close()
+             recipient_ids = await get_user_ids()
 
-        # Send to recipients
-        sent_to_count = 0
         if not recipient_ids:
             logger.warning("No recipients found for digest.")
-        else:
-            for user_id in recipient_ids:
-                try:
-                    await bot.send_message(user_id, final_summary, parse_mode='markdown', link_preview=False)
-                    sent_to_count += 1
-                except Exception as e:
-                    logger.error(f"Failed to send digest to user {user_id}: {e}")
-        logger.info(f"Sent {'manual' if manual else 'automatic'} digest to {sent_to_count} users.")
-        
-        # Mark posts as sent ONLY for automatic digest if sent successfully
-        if not manual and sent_to_count > 0:
-            post_ids = [post[0] for post in posts if len(post) > 0 and isinstance(post[0], int)]
-            if post_ids:
-                mark_posts_as_sent(post_ids)
-                logger.info(f"Marked {len(post_ids)} posts as sent after automatic digest")
+            return [] if not manual else "Нет получателей для дайджеста."
+
+        mode = 'manual' if manual else 'automatic'
+        groups = await get_digest_groups(recipient_ids)
+        logger.info(f"[send_digest] {len(recipient_ids)} recipients in {len(groups)} distinct subscription sets")
+        # Subscribed only to channels that are no longer monitored: no digest group, so say why nothing comes
+        grouped_user_ids = {user_id for users in groups.values() for user_id in users}
+        orphaned_user_ids = [user_id for user_id in recipient_ids if user_id not in grouped_user_ids]
+        if orphaned_user_ids and manual:
+            return UNMONITORED_SUBSCRIPTIONS_TEXT
+
+        delivered_post_ids = set()
+        undelivered_post_ids = set()
+        done_user_ids = set()
+        sent_to_count = 0
+        manual_text = None
+        fanout_seconds = 0.0
+        if orphaned_user_ids:
+            report = await deliverer.send_many(bot, orphaned_user_ids, UNMONITORED_SUBSCRIPTIONS_TEXT,
+                                               label=f"{mode} digest notice (no monitored subscriptions)")
+            done_user_ids.update(user_id for user_id in orphaned_user_ids if user_id not in report['failed'])
+        for channel_ids, users in groups.items():
+            channel_ids = list(channel_ids) if channel_ids is not None else None
+            if manual:
+                posts = await get_recent_posts_for_manual_digest(channel_ids=channel_ids)
             else:
-                logger.warning("No post IDs found to mark as sent for automatic digest")
-        elif not manual and sent_to_count == 0:
-             logger.warning("Automatic digest was not sent to any users, posts will NOT be marked as sent.")
+                posts = await get_window_posts(*window, channel_ids)
+            if not posts:
+                if manual:
+                    manual_text = "Нет постов для дайджеста за последние 4 часа."
+                done_user_ids.update(users)
+                continue
+            post_ids = {post[0] for post in posts if len(post) > 0 and isinstance(post[0], int)}
+
+            summary, link_map = await summarize_posts(posts)
+            if not summary:
+                logger.error(f"[send_digest] Failed to generate summary for {len(users)} users")
+                if manual:
+                    manual_text = "Произошла ошибка при генерации дайджеста."
+                undelivered_post_ids.update(post_ids)
+                continue
+
+            # Link references and split into Telegram-sized messages
+            parts = render_digest(summary, link_map)
+            logger.info(f"[send_digest] Rendered digest with {len(link_map or {})} references into {len(parts)} message(s)")
+            if manual:
+                manual_text = "\n\n".join(parts)
+
+            # Send part by part so every chat receives the parts in order
+            fanout_started = time.perf_counter()
+            failed = set()
+            for number, part in enumerate(parts, start=1):
+                report = await deliverer.send_many(
+                    bot, [chat_id for chat_id in users if chat_id not in failed], part,
+                    label=f"{mode} digest part {number}/{len(parts)}",
+                    parse_mode='markdown', link_preview=False,
+                )
+                failed.update(report['failed'])
+            fanout_seconds += time.perf_counter() - fanout_started
+            group_sent = len(users) - len(failed)
+            FANOUT_RECIPIENTS.labels(mode, 'sent').inc(group_sent)
+            FANOUT_RECIPIENTS.labels(mode, 'failed').inc(len(failed))
+            sent_to_count += group_sent
+            done_user_ids.update(user_id for user_id in users if user_id not in failed)
+            (delivered_post_ids if group_sent > 0 else undelivered_post_ids).update(post_ids)
+        FANOUT_SECONDS.labels(mode).observe(fanout_seconds)
+        logger.info(f"Sent {mode} digest to {sent_to_count} users.")
+        
+        # Mark posts as sent ONLY for automatic digest, once every digest containing them was delivered
+        sent_post_ids = delivered_post_ids - undelivered_post_ids
+        if not manual and sent_post_ids:
+            await mark_posts_as_sent(sorted(sent_post_ids))
+            logger.info(f"Marked {len(sent_post_ids)} posts as sent after automatic digest")
+            if undelivered_post_ids:
+                logger.warning(f"{len(undelivered_post_ids)} posts were in digests that failed and stay unsent.")
+        elif not manual and sent_to_count == 0 and undelivered_post_ids:
+            logger.warning("Automatic digest was not sent to any users, posts will NOT be marked as sent.")
         
         # Return the generated summary only if it was a manual request 
         # (even if sending failed, the text was still generated)
         if manual:
-            return final_summary
-        else: # Automatic digest doesn't need to return the text
-            return None
+            return manual_text or "Нет постов для дайджеста за последние 4 часа."
+        else:
+            return sorted(done_user_ids)
 
     except Exception as e:
         logger.error(f"Error in send_digest: {e}", exc_info=True)
-        # Return an error message for manual requests, None for automatic
-        return "Произошла ошибка при отправке дайджеста." if manual else None
+        # Return an error message for manual requests, nobody done for automatic
+        return "Произошла ошибка при отправке дайджеста." if manual else []
+
+async def send_scheduled_digests(bot, due: list) -> list:
+    """DigestScheduler dispatch: send every due user the digest of their window.
+
+    Users due together are grouped by window and then by channel set, so each
+    distinct digest is generated once per batch. Windows end at the nominal
+    fire time, so users on the same schedule that jitter spreads over several
+    batches ask for the same posts and get the digest from the cache (or join
+    its generation while it is still in flight).
+
+    Args:
+        due: (user_id, window_start, window_end) tuples with aware UTC datetimes
+
+    Returns:
+        list: IDs of users whose window is done
+    """
+    by_window = {}
+    for user_id, window_start, window_end in due:
+        by_window.setdefault((window_start, window_end), []).append(user_id)
+    done = []
+    for (window_start, window_end), user_ids in by_window.items():
+        window = (window_start.isoformat(), window_end.isoformat())
+        logger.info(f"Scheduled digest for {len(user_ids)} users, window {window[0]} - {window[1]}")
+        window_done = await send_digest(bot, manual=False, recipient_ids=user_ids, window=window)
+        if window_done:
+            await storage.set_last_digest_window_end(window_done, window[1])
+        done.extend(window_done)
+    if by_window:
+        await mark_unsubscribed_posts_sent(max(window_end for _, window_end in by_window).isoformat())
+    return done
+
+async def load_digest_schedules():
+    """Queue every registered user in the digest scheduler with their stored schedule.
+
+    Users without a stored window end (none delivered since scheduled windows
+    were introduced) start from just before the oldest unsent post, so posts
+    older than one schedule period are still delivered once.
+    """
+    _, earliest_unsent = await storage.count_unsent_posts()
+    first_window_start = None
+    if earliest_unsent:
+        first_window_start = datetime.fromisoformat(earliest_unsent) - timedelta(microseconds=1)
+        if first_window_start.tzinfo is None:
+            first_window_start = first_window_start.replace(tzinfo=timezone.utc)
+    for user_id, spec, last_window_end in await storage.get_digest_schedules():
+        schedule = None
+        if spec:
+            try:
+                schedule = Schedule.parse(spec)
+            except ValueError as e:  # UnknownTimeZoneError included
+                logger.error(f"Invalid digest schedule {spec!r} for user {user_id}, using the default: {e}")
+        try:
+            last_end = datetime.fromisoformat(last_window_end) if last_window_end else None
+        except ValueError:
+            last_end = None
+        digest_scheduler.set(user_id, schedule, last_window_end=last_end or first_window_start)
+    logger.info(f"Digest scheduler loaded {len(digest_scheduler)} users")
+
+def describe_schedule(schedule) -> str:
+    if schedule.kind == 'daily':
+        return f"ежедневно в {schedule.time} ({schedule.tz})"
+    if schedule.kind == 'interval':
+        return f"каждые {schedule.interval_minutes} мин."
+    return "выключен"
 
 # --- Handler Definitions (NO DECORATORS) --- 
 
@@ -482,10 +735,12 @@ async def start_handler(event):
         username = sender.username
         logger.info(f"Received /start command from user_id={user_id}, username={username}")
         logger.info(f"Attempting to register user {user_id}...")
-        is_new_user = register_user(user_id, username)
+        is_new_user = await register_user(user_id, username)
         logger.info(f"register_user returned: {is_new_user} for user_id={user_id}")
+        if is_new_user:
+            digest_scheduler.set(user_id)
         welcome_msg = '👋 Привет! Ты зарегистрирован. ' if is_new_user else '👋 Привет! Ты уже был зарегистрирован. '
-        welcome_msg += '''Я буду сохранять сообщения и отправлять их дайджестом.\n\nДоступные команды:\n/digest - получить дайджест за последние 4 часа\n/status - узнать количество постов для следующего дайджеста'''
+        welcome_msg += '''Я буду сохранять сообщения и отправлять их дайджестом.\n\nДоступные команды:\n/digest - получить дайджест за последние 4 часа\n/status - узнать количество постов для следующего дайджеста\n/mute [часы] - отключить уведомления о новых постах (навсегда или на N часов)\n/unmute - включить уведомления о новых постах\n/channels - список каналов и твои подписки\n/subscribe, /unsubscribe - выбрать каналы для дайджеста\n/schedule - время автоматического дайджеста\n/search <запрос> [@канал] [7d] - поиск по сохранённым постам'''
         await event.respond(welcome_msg)
         logger.info(f"Sent welcome message to user_id={user_id}")
     except Exception as e:
@@ -496,53 +751,45 @@ async def start_handler(event):
              logger.error(f"Failed to send error message to user_id={user_id}: {resp_err}")
 
 async def digest_handler(event):
-    """Handle /digest command - trigger manual digest generation and send result ONLY to the requester."""
+    """Handle /digest command - generate a digest of recent posts for the requester only.
+
+    The status message is edited progressively while the digest streams in
+    (see StreamingMessage), so the first lines show up within seconds instead
+    of after the whole generation.
+    """
     sender_id = None
     status_message = None
+    stream = None
     try:
         sender_id = event.sender_id
         logger.info(f"Processing /digest command from user {sender_id}")
         status_message = await event.respond("⏳ Генерирую дайджест за последние 4 часа...")
-        result_message = await send_digest(manual=True, target_user_id=sender_id)
-        if result_message and not (result_message.startswith("Нет постов") or result_message.startswith("Произошла ошибка")):
-            logger.info(f"Digest sent successfully to user {sender_id} by send_digest.")
-            try:
-                await status_message.delete()
-                logger.info(f"Deleted status message for user {sender_id}.")
-            except Exception as del_err:
-                logger.error(f"Could not delete status message for user {sender_id}: {del_err}")
-        elif result_message:
-            logger.info(f"Handling status/error message for user {sender_id}: {result_message}")
-            try:
-                await status_message.edit(result_message)
-                logger.info(f"Edited status message for user {sender_id}.")
-            except telethon.errors.rpcerrorlist.MessageIdInvalidError:
-                logger.warning(f"Failed to edit status message for user {sender_id} (MessageIdInvalidError). Sending new message.")
-                try:
-                    await status_message.delete()
-                except Exception as del_err:
-                     logger.error(f"Could not delete status message after edit failed for user {sender_id}: {del_err}")
-                await event.respond(result_message)
-            except Exception as edit_err:
-                logger.error(f"Failed to edit status message for user {sender_id}: {edit_err}. Sending new message.")
-                try:
-                    await status_message.delete()
-                except Exception as del_err:
-                     logger.error(f"Could not delete status message after edit failed for user {sender_id}: {del_err}")
-                await event.respond(result_message)
-        else:
-            logger.error(f"send_digest(manual=True) returned None unexpectedly for user {sender_id}")
-            error_text = "Произошла внутренняя ошибка при обработке дайджеста."
-            try:
-                await status_message.edit(error_text)
-            except Exception:
-                 logger.warning(f"Failed to edit status message for unexpected None result for user {sender_id}. Sending new message.")
-                 try:
-                    await status_message.delete()
-                 except Exception: pass
-                 await event.respond(error_text)
+        posts = await get_recent_posts_for_manual_digest(channel_ids=await get_user_channel_ids(sender_id))
+        if not posts:
+            await status_message.edit("Нет постов для дайджеста за последние 4 часа.")
+            return
+
+        stream = StreamingMessage(
+            event.client, sender_id, status_message,
+            edit_interval=settings.digest_stream_edit_interval, parse_mode='markdown', link_preview=False,
+        )
+        stream.start()
+        started = time.perf_counter()
+        summary, link_map = await summarize_posts(posts, on_text=stream.update)
+        if not summary:
+            logger.error(f"[digest_handler] Failed to generate summary for user {sender_id}")
+            await stream.cancel()
+            await status_message.edit("Произошла ошибка при генерации дайджеста.")
+            return
+        messages = await stream.finish(summary, link_map)
+        logger.info(
+            f"Digest streamed to user {sender_id} in {len(messages)} message(s) with {stream.edits} edits/sends "
+            f"in {time.perf_counter() - started:.1f}s"
+        )
     except Exception as e:
         logger.error(f"Error in digest_handler for user {sender_id}: {e}", exc_info=True)
+        if stream:
+            await stream.cancel()
         try:
             error_text = "Произошла ошибка при обработке команды /digest."
             if status_message:
@@ -561,25 +808,20 @@ async def status_handler(event):
         now = datetime.now()
         hours_ago = now - timedelta(hours=4)
         timestamp_threshold = hours_ago.isoformat()
-        conn = sqlite3.connect(DB_PATH)
-        cursor = conn.cursor()
-        cursor.execute('''SELECT channel_title, COUNT(*) as post_count FROM posts WHERE timestamp > ? AND sent = FALSE GROUP BY channel_title''', (timestamp_threshold,))
-        stats = cursor.fetchall()
-        cursor.execute('''SELECT timestamp FROM posts WHERE sent = FALSE ORDER BY timestamp ASC LIMIT 1''')
-        earliest_post = cursor.fetchone()
-        cursor.execute('SELECT COUNT(*) FROM posts WHERE sent = FALSE')
-        total_unsent_count = cursor.fetchone()[0]
-        cursor.execute('SELECT COUNT(*) FROM users')
-        registered_user_count = cursor.fetchone()[0]
-        conn.close()
+        db_stats = await storage.get_status_stats(timestamp_threshold)
+        stats = db_stats['by_channel']
+        earliest_post = db_stats['earliest_unsent']
+        total_unsent_count = db_stats['total_unsent']
+        registered_user_count = db_stats['registered_users']
         response = f"📊 Статус:\n"
         response += f"— Зарегистрировано пользователей: {registered_user_count}\n"
+        response += f"— Отслеживается каналов: {len(channel_registry)}\n"
         response += f"— Всего неотправленных постов: {total_unsent_count}\n"
         if not earliest_post:
             response += "— Самый ранний пост: Нет неотправленных постов\n"
         else:
             try:
-                earliest_dt = datetime.fromisoformat(earliest_post[0])
+                earliest_dt = datetime.fromisoformat(earliest_post)
                 earliest_time = earliest_dt.strftime("%Y-%m-%d %H:%M")
                 response += f"— Самый ранний пост: {earliest_time}\n"
             except ValueError:
@@ -590,9 +832,19 @@ async def status_handler(event):
                 response += f"  - {title}: {count} постов\n"
         else:
              response += "\nНет неотправленных постов за последние 4 часа.\n"
+        cache_stats = digest_cache.stats()
+        response += f"\nКэш дайджестов: {cache_stats['hits']} попаданий, {cache_stats['misses']} промахов\n"
+        if settings.digest_workers_enabled:
+            jobs = await storage.get_job_counts()
+            response += f"Задачи воркеров: {jobs.get('queued', 0)} в очереди, {jobs.get('running', 0)} выполняются, {jobs.get('failed', 0)} с ошибкой\n"
         try:
-            next_run_dt_tz = await get_next_run_time()
-            response += f"\nСледующий автодайджест: {next_run_dt_tz.strftime('%Y-%m-%d %H:%M:%S %Z%z')}"
+            schedule = digest_scheduler.schedule_for(event.sender_id)
+            next_run = digest_scheduler.next_fire_for(event.sender_id)
+            if next_run is None:
+                response += "\nАвтодайджест выключен (/schedule)."
+            else:
+                next_run = next_run.astimezone(get_timezone(schedule.tz or settings.digest_timezone))
+                response += f"\nСледующий автодайджест: {next_run.strftime('%Y-%m-%d %H:%M %Z%z')} ({describe_schedule(schedule)})"
         except Exception as e:
             logger.error(f"Error getting next run time for status: {e}")
             response += "\nНе удалось определить время следующего автодайджеста."
@@ -601,148 +853,376 @@ async def status_handler(event):
         logger.error(f"Error in status_handler: {e}")
         await event.respond("Произошла ошибка при получении статуса.")
 
-async def channel_handler(event, bot):
-    """Handle new messages from monitored channels."""
+async def mute_handler(event):
+    """Handle /mute [hours] - stop new-post notifications for the sender, forever or for N hours."""
+    sender_id = event.sender_id
     try:
-        channel = await event.get_chat()
-        channel_id = str(channel.id)
-        channel_title = channel.title
-        channel_username = channel.username
-        if not any(channel_id in ch or (channel_username and channel_username in ch) for ch in CHANNELS):
-            logger.debug(f"Ignoring message from non-monitored channel: {channel_title} ({channel_username or channel_id})")
-            return
-        if event.message.text:
-            content = event.message.text
-        elif event.message.media:
-            content = "[Media message]"
-            if hasattr(event.message.media, 'caption') and event.message.media.caption:
-                content += f": {event.message.media.caption}"
+        parts = event.raw_text.split()
+        if len(parts) > 1:
+            try:
+                hours = float(parts[1])
+                if hours <= 0:
+                    raise ValueError
+            except ValueError:
+                await event.respond("Использование: /mute [часы], например /mute 3")
+                return
+            muted_until = datetime.now() + timedelta(hours=hours)
+            reply = f"🔕 Уведомления о новых постах отключены до {muted_until.strftime('%Y-%m-%d %H:%M')}."
         else:
-            logger.debug(f"Skipping message without content from {channel_title}")
+            muted_until = datetime.max
+            reply = "🔕 Уведомления о новых постах отключены. Включить снова: /unmute"
+        if not await storage.set_notifications_muted_until(sender_id, muted_until.isoformat()):
+            await event.respond("Сначала зарегистрируйся командой /start.")
+            return
+        logger.info(f"User {sender_id} muted notifications until {muted_until.isoformat()}")
+        await event.respond(reply)
+    except Exception as e:
+        logger.error(f"Error in mute_handler for user {sender_id}: {e}", exc_info=True)
+        await event.respond("Произошла ошибка при обработке команды /mute.")
+
+async def unmute_handler(event):
+    """Handle /unmute - resume new-post notifications for the sender."""
+    sender_id = event.sender_id
+    try:
+        if not await storage.set_notifications_muted_until(sender_id, None):
+            await event.respond("Сначала зарегистрируйся командой /start.")
             return
-        message_id = event.message.id
-        post_link = f"https://t.me/{channel_username}/{message_id}" if channel_username else f"https://t.me/c/{channel_id}/{message_id}"
-        timestamp = event.message.date.isoformat()
-        await save_post(channel_id, channel_title, timestamp, content, post_link)
-        time_str = event.message.date.strftime("%H:%M")
-        notification = f"📥 Новый пост из [{channel_title}]({post_link})\n⏰ Время: {time_str}\n📝 Текст: {content[:100]}{'...' if len(content) > 100 else ''}"
-        conn = sqlite3.connect(DB_PATH)
-        cursor = conn.cursor()
-        cursor.execute('SELECT user_id FROM users')
-        users = cursor.fetchall()
-        conn.close()
-        for user_id_tuple in users:
+        logger.info(f"User {sender_id} unmuted notifications")
+        await event.respond("🔔 Уведомления о новых постах включены.")
+    except Exception as e:
+        logger.error(f"Error in unmute_handler for user {sender_id}: {e}", exc_info=True)
+        await event.respond("Произошла ошибка при обработке команды /unmute.")
+
+async def schedule_handler(event):
+    """Handle /schedule [HH:MM [Timezone] | every <minutes> | off | default]."""
+    sender_id = event.sender_id
+    usage = ("Использование:\n/schedule 08:30 Europe/Moscow — ежедневно в указанное время\n"
+             "/schedule every 120 — каждые N минут\n/schedule off — выключить\n/schedule default — по умолчанию")
+    try:
+        arg = event.raw_text.partition(' ')[2].strip()
+        if not arg:
+            await event.respond(f"⏰ Автодайджест: {describe_schedule(digest_scheduler.schedule_for(sender_id))}\n\n{usage}")
+            return
+        schedule = None
+        if arg.lower() != 'default':
             try:
-                await bot.send_message(user_id_tuple[0], notification, parse_mode='markdown') 
-            except Exception as e:
-                logger.error(f"Failed to notify user {user_id_tuple[0]}: {e}")
+                schedule = Schedule.parse(arg, default_tz=settings.digest_timezone)
+            except UnknownTimeZoneError:
+                await event.respond("Неизвестный часовой пояс. Пример: Europe/Moscow, Asia/Almaty, UTC.")
+                return
+            except ValueError:
+                await event.respond(usage)
+                return
+            if schedule.kind == 'interval' and schedule.interval_minutes < MIN_DIGEST_INTERVAL_MINUTES:
+                await event.respond(f"Интервал должен быть не меньше {MIN_DIGEST_INTERVAL_MINUTES} минут.")
+                return
+        if not await storage.set_digest_schedule(sender_id, str(schedule) if schedule else None):
+            await event.respond("Сначала зарегистрируйся командой /start.")
+            return
+        digest_scheduler.set(sender_id, schedule)
+        logger.info(f"User {sender_id} set digest schedule to {schedule or 'default'}")
+        await event.respond(f"✅ Автодайджест: {describe_schedule(digest_scheduler.schedule_for(sender_id))}")
     except Exception as e:
-        logger.error(f"Error in channel_handler: {e}")
+        logger.error(f"Error in schedule_handler for user {sender_id}: {e}", exc_info=True)
+        await event.respond("Произошла ошибка при обработке команды /schedule.")
 
-async def get_next_run_time():
-    """Calculate the next run time based on DIGEST_TIME (Europe/Lisbon)."""
+async def search_handler(event):
+    """Handle /search <query> [@channel] [7d|24h|YYYY-MM-DD] - ranked matches from stored posts."""
+    sender_id = event.sender_id
+    usage = ("Использование: /search <запрос> [@канал] [период]\n"
+             "Например: /search ставка ЦБ @channel 7d — период: 24h, 7d или дата 2024-05-01")
+    if settings.retention_enabled:
+        usage += f"\nПоиск идёт по постам за последние {settings.retention_days:g} дн.; более старые уходят в архив."
     try:
-        tz = pytz.timezone('Europe/Lisbon')
-        now_tz = datetime.now(tz)
-        
-        # Parse configured time
-        hour, minute = map(int, DIGEST_TIME.split(':'))
-        target_time = datetime.min.replace(hour=hour, minute=minute)
-        
-        # Calculate next run time
-        next_run_dt_tz = tz.localize(datetime.combine(now_tz.date(), target_time.time()))
-        
-        # If the target time has already passed today, schedule for tomorrow
-        if now_tz >= next_run_dt_tz:
-            next_run_dt_tz += timedelta(days=1)
-        
-        logger.info(f"Current time (Europe/Lisbon): {now_tz.strftime('%Y-%m-%d %H:%M:%S %Z%z')}")
-        logger.info(f"Next digest run time (Europe/Lisbon): {next_run_dt_tz.strftime('%Y-%m-%d %H:%M:%S %Z%z')}")
-        
-        return next_run_dt_tz
+        tz = get_timezone(digest_scheduler.schedule_for(sender_id).tz or settings.digest_timezone)
+        query, channel_arg, since = parse_search_args(event.raw_text.split()[1:], tz=tz)
+        if not query_terms(query):
+            await event.respond(usage)
+            return
+        # Sent posts past the retention age are archived and no longer indexed: search only what is left
+        archived_note = ""
+        if settings.retention_enabled:
+            cutoff = retention.cutoff()
+            if since is not None and since < cutoff:
+                archived_note = (f"ℹ️ Посты старше {settings.retention_days:g} дн. перенесены в архив "
+                                 f"и в поиск не входят: показаны результаты с {cutoff.astimezone(tz).strftime('%Y-%m-%d')}.")
+            since = max(since or cutoff, cutoff)
+        channel_ids = None
+        if channel_arg:
+            matched, unknown = parse_channel_args([channel_arg], channel_registry.channels())
+            if unknown:
+                await event.respond(f"Не найден канал: {channel_arg}. Список: /channels")
+                return
+            channel_ids = sorted(matched)
+        started = time.perf_counter()
+        posts = await search_posts(query, channel_ids=channel_ids, since=since)
+        logger.info(f"/search from user {sender_id}: {len(posts)} results in {time.perf_counter() - started:.3f}s")
+        if not posts:
+            await event.respond("\n\n".join(filter(None, ["Ничего не найдено.", archived_note])))
+            return
+        terms = query_terms(query)
+        lines = [f"🔎 Найдено по запросу «{query}»:"]
+        for number, (_, channel_title, timestamp, content, post_link) in enumerate(posts, start=1):
+            try:
+                when = datetime.fromisoformat(timestamp).strftime('%Y-%m-%d %H:%M')
+            except ValueError:
+                when = timestamp
+            source = f"[{channel_title}]({post_link})" if post_link else channel_title
+            lines.append(f"\n{number}. {source} · {when}\n{snippet(content, terms)}")
+        if archived_note:
+            lines.append(f"\n{archived_note}")
+        for chunk in split_message("\n".join(lines)):
+            await event.respond(chunk, link_preview=False)
     except Exception as e:
-        logger.error(f"Error calculating next run time: {e}")
-        raise
+        logger.error(f"Error in search_handler for user {sender_id}: {e}", exc_info=True)
+        await event.respond("Произошла ошибка при поиске.")
 
-async def automatic_digest_task():
-    """Background task that sends digest daily at 00:00 Europe/Lisbon."""
-    logger.info("Starting automatic digest task (scheduled for 00:00 Europe/Lisbon)")
-    
-    while True:
-        try:
-            # Calculate the next run time
-            next_run_time_tz = await get_next_run_time()
-            now_utc = datetime.now(pytz.utc) # Use timezone-aware datetime
-            
-            # Convert next run time to UTC for comparison and sleep calculation
-            next_run_time_utc = next_run_time_tz.astimezone(pytz.utc)
-            
-            wait_seconds = (next_run_time_utc - now_utc).total_seconds()
-            
-            if wait_seconds > 0:
-                logger.info(f"Waiting for {wait_seconds:.2f} seconds until next scheduled digest ({next_run_time_tz.strftime('%Y-%m-%d %H:%M:%S %Z%z')})...")
-                await asyncio.sleep(wait_seconds)
-            else:
-                # If calculated time is in the past (e.g., due to startup delay), run immediately and schedule for next day
-                logger.warning(f"Calculated next run time {next_run_time_tz.strftime('%Y-%m-%d %H:%M:%S %Z%z')} is in the past. Running now and rescheduling.")
-                # Optional: add a small delay to prevent rapid looping if there's an issue
-                await asyncio.sleep(5)
-                
-            logger.info("Running automatic digest job...")
-            
-            # Call send_digest (handles getting posts, summarizing, sending, marking as sent)
-            await send_digest(manual=False)
+async def channels_handler(event):
+    """Handle /channels - list monitored channels and mark the sender's subscriptions."""
+    sender_id = event.sender_id
+    try:
+        channels = numbered_channels(channel_registry.channels())
+        if not channels:
+            await event.respond("Список каналов пока пуст.")
+            return
+        subscribed = await storage.get_user_subscriptions(sender_id)
+        lines = ["📚 Каналы" + (" (ты подписан на все):" if not subscribed else ":")]
+        for number, channel in enumerate(channels, start=1):
+            mark = "✅" if not subscribed or str(channel.id) in subscribed else "▫️"
+            name = f"{channel.title} (@{channel.username})" if channel.username else channel.title
+            lines.append(f"{number}. {mark} {name}")
+        lines.append("\n/subscribe 1 3 или /subscribe @канал — только выбранные каналы\n/unsubscribe 2 — убрать канал\n/subscribe all — снова все каналы")
+        await event.respond("\n".join(lines), link_preview=False)
+    except Exception as e:
+        logger.error(f"Error in channels_handler for user {sender_id}: {e}", exc_info=True)
+        await event.respond("Произошла ошибка при обработке команды /channels.")
 
-        except asyncio.CancelledError:
-            logger.info("Automatic digest task cancelled.")
-            break
-        except Exception as e:
-            logger.error(f"Error in automatic digest task: {e}", exc_info=True)
-            # Wait a bit before retrying in case of error to avoid tight loop
-            logger.info("Waiting 60 seconds before retrying digest task after error.")
-            await asyncio.sleep(60)
+async def subscription_handler(event, subscribe: bool):
+    """Handle /subscribe and /unsubscribe <numbers|@usernames|all>."""
+    sender_id = event.sender_id
+    command = "/subscribe" if subscribe else "/unsubscribe"
+    try:
+        args = event.raw_text.split()[1:]
+        if not args:
+            await event.respond(f"Использование: {command} <номера из /channels или @каналы>, например {command} 1 3")
+            return
+        channels = channel_registry.channels()
+        matched, unknown = parse_channel_args(args, channels)
+        if unknown:
+            await event.respond(f"Не найдены каналы: {', '.join(unknown)}. Список: /channels")
+            return
+        monitored = {str(channel.id) for channel in channels}
+        explicit = await storage.get_user_subscriptions(sender_id) & monitored
+        if subscribe:
+            # The first /subscribe narrows "all channels" down to the chosen ones
+            chosen = explicit | matched
+        else:
+            chosen = (explicit or monitored) - matched
+        if not chosen:
+            await event.respond("Должен остаться хотя бы один канал. Отключить уведомления о новых постах: /mute")
+            return
+        await storage.set_user_subscriptions(sender_id, [] if chosen >= monitored else sorted(chosen))
+        logger.info(f"User {sender_id} now subscribed to {len(chosen)}/{len(monitored)} channels")
+        if chosen >= monitored:
+            await event.respond("✅ Ты подписан на все каналы.")
+        else:
+            await event.respond(f"✅ Подписки обновлены: {len(chosen)} из {len(monitored)} каналов. Список: /channels")
+    except Exception as e:
+        logger.error(f"Error in subscription_handler ({command}) for user {sender_id}: {e}", exc_info=True)
+        await event.respond(f"Произошла ошибка при обработке команды {command}.")
+
+def message_to_post(channel, message):
+    """Turn a channel message into post fields, or None if it has no content.
+
+    Returns:
+        tuple: (channel_id, channel_title, timestamp, content, post_link, message_id)
+    """
+    channel_id = str(channel.id)
+    if message.text:
+        content = message.text
+    elif message.media:
+        content = "[Media message]"
+        if hasattr(message.media, 'caption') and message.media.caption:
+            content += f": {message.media.caption}"
+    else:
+        return None
+    post_link = f"https://t.me/{channel.username}/{message.id}" if channel.username else f"https://t.me/c/{channel_id}/{message.id}"
+    return channel_id, channel.title, message.date.isoformat(), content, post_link, message.id
+
+def album_to_post(channel, messages):
+    """Turn the messages of an album (in ID order) into one post.
+
+    The post links to the first message but stores the last message's ID, so
+    the channel watermark moves past the whole album and a re-fetched album
+    hits the (channel_id, message_id) unique index instead of being stored again.
+    """
+    if len(messages) == 1:
+        return message_to_post(channel, messages[0])
+    channel_id, channel_title, timestamp, _, post_link, _ = message_to_post(channel, messages[0])
+    return channel_id, channel_title, timestamp, album_content(messages), post_link, messages[-1].id
+
+async def save_backfilled_message(channel, message):
+    """Store a message fetched by the startup backfill (no new-post notification)."""
+    if backfill_albums.add(channel, message):
+        return
+    post = message_to_post(channel, message)
+    if post:
+        await save_post(*post)
+
+async def save_backfilled_album(channel, messages):
+    await save_post(*album_to_post(channel, messages))
+
+# Albums arrive as one message per media item; each is stored as one post
+backfill_albums = AlbumCoalescer(save_backfilled_album, window_seconds=settings.album_window_seconds)
+
+async def publish_post(channel, post, date, notifier):
+    """Store a new channel post and queue its new-post notification."""
+    POSTS_RECEIVED.inc()
+    await save_post(*post)
+    _, _, _, content, post_link, _ = post
+    await notifier.add(channel.title, post_link, date, content)
+
+async def album_handler(channel, messages, notifier):
+    """Handle a new album from a monitored channel, coalesced by AlbumCoalescer."""
+    await publish_post(channel, album_to_post(channel, messages), messages[0].date, notifier)
+
+async def channel_handler(event, notifier, albums):
+    """Handle new messages from monitored channels (filtered by channel_registry.is_monitored)."""
+    try:
+        channel = channel_registry.get(event.chat_id)
+        if channel is None:
+            logger.debug(f"Ignoring message from non-monitored chat {event.chat_id}")
+            return
+        if albums.add(channel, event.message):
+            return  # published with the rest of its album
+        post = message_to_post(channel, event.message)
+        if post is None:
+            logger.debug(f"Skipping message without content from {channel.title}")
+            return
+        await publish_post(channel, post, event.message.date, notifier)
+    except Exception as e:
+        logger.error(f"Error in channel_handler: {e}")
 
 async def main():
     """Start the bot and user client"""
-    # Initialize databases
-    init_database() # users.db
-    init_posts_database() # posts.db
-    
-    # Debug: Print all environment variables
-    logger.info(f"Environment variables in main: {dict(os.environ)}")
-    
+    startup.add('imports', time.perf_counter() - startup.started)
+    # Raises UnknownTimeZoneError before anything is opened
+    get_timezone(settings.digest_timezone)
+
+    with startup.phase('database'):
+        await init_database() # opens shared storage and runs migrations
+        ingest_queue.start()
+        # Read before the user client connects: live posts advance the watermarks from then on
+        watermarks = await storage.get_channel_watermarks()
+
     # --- INITIALIZE CLIENTS INSIDE MAIN --- 
-    bot = TelegramClient('bot_session', API_ID, API_HASH)
-    user_client = TelegramClient('user_session', API_ID, API_HASH)
-    
+    bot = TelegramClient('bot_session', settings.api_id, settings.api_hash)
+    user_client = TelegramClient('user_session', settings.api_id, settings.api_hash)
+
+    async def start_client(name, client, **kwargs):
+        with startup.phase(name):
+            await client.start(**kwargs)
+        logger.info(f"{name} started.")
+
+    async def warm_dedup():
+        if settings.dedup_enabled:
+            with startup.phase('dedup_index'):
+                await warm_duplicate_index()
+
+    async def load_tokenizer_phase():
+        with startup.phase('tokenizer'):
+            await load_tokenizer()
+
     # --- Start clients --- 
-    try:
-        logger.info("Starting bot client...")
-        await bot.start(bot_token=BOT_TOKEN)
-        logger.info("Bot client started.")
-        
-        logger.info("Starting user client...")
-        await user_client.start()
-        logger.info("User client started.")
-        
-    except Exception as e:
-        logger.error(f"Error starting Telegram clients: {e}", exc_info=True)
+    # Both clients connect at once, while the dedup index warms up from the database and the tokenizer loads
+    logger.info("Starting bot and user clients...")
+    with startup.phase('clients'):
+        results = await asyncio.gather(
+            start_client('bot_client', bot, bot_token=settings.bot_token),
+            start_client('user_client', user_client),
+            warm_dedup(),
+            load_tokenizer_phase(),
+            return_exceptions=True,
+        )
+    errors = [result for result in results if isinstance(result, BaseException)]
+    if errors:
+        for error in errors:
+            logger.error(f"Error starting Telegram clients: {error}", exc_info=error)
+        for client in (bot, user_client):
+            if client.is_connected():
+                await client.disconnect()
+        await ingest_queue.close()
+        await storage.close()
         return # Exit if clients fail to start
 
     logger.info("All clients started successfully")
 
+    # Queue every user's next automatic digest
+    with startup.phase('schedules'):
+        digest_scheduler.dispatch = partial(send_scheduled_digests, bot)
+        await load_digest_schedules()
+
+    # Resolve monitored channels (only new references hit the API)
+    with startup.phase('channels'):
+        channel_registry.client = user_client
+        await channel_registry.load(settings.channels)
+
     # --- REGISTER HANDLERS MANUALLY --- 
-    bot.add_event_handler(start_handler, events.NewMessage(pattern='/start'))
-    bot.add_event_handler(digest_handler, events.NewMessage(pattern='/digest'))
-    bot.add_event_handler(status_handler, events.NewMessage(pattern='/status'))
+    commands = {
+        'start': start_handler,
+        'digest': digest_handler,
+        'status': status_handler,
+        'mute': mute_handler,
+        'unmute': unmute_handler,
+        'schedule': schedule_handler,
+        'channels': channels_handler,
+        'search': search_handler,
+        'subscribe': partial(subscription_handler, subscribe=True),
+        'unsubscribe': partial(subscription_handler, subscribe=False),
+    }
+    for command, handler in commands.items():
+        bot.add_event_handler(
+            timed(HANDLER_SECONDS, HANDLER_ERRORS, command)(handler), events.NewMessage(pattern=f'/{command}')
+        )
+    notifier = NotificationAggregator(
+        bot, deliverer, get_notification_user_ids,
+        window_seconds=settings.notify_window_seconds, max_posts=settings.notify_max_posts,
+    )
+    albums = AlbumCoalescer(partial(album_handler, notifier=notifier), window_seconds=settings.album_window_seconds)
     user_client.add_event_handler(
-        partial(channel_handler, bot=bot), 
-        events.NewMessage(chats=CHANNELS)
+        timed(HANDLER_SECONDS, HANDLER_ERRORS, 'channel')(partial(channel_handler, notifier=notifier, albums=albums)),
+        events.NewMessage(func=channel_registry.is_monitored)
     )
     logger.info("Event handlers registered successfully.")
+
+    # Catch up on posts published while the bot was offline
+    if settings.backfill_enabled:
+        backfiller = Backfiller(
+            user_client, save_backfilled_message,
+            concurrency=settings.backfill_concurrency,
+            max_messages=settings.backfill_max_messages,
+            max_age_hours=settings.backfill_max_age_hours,
+            max_gap_messages=settings.backfill_max_gap_messages,
+        )
+        asyncio.create_task(backfiller.run([channel.peer_id for channel in channel_registry.channels()], watermarks))
+    asyncio.create_task(channel_registry.watch(settings.channels_reload_seconds))
     
-    # Start the automatic digest task
-    auto_digest_task = asyncio.create_task(automatic_digest_task())
+    # Start the automatic digest scheduler
+    auto_digest_task = asyncio.create_task(digest_scheduler.run())
+    if settings.presummary_enabled and not settings.digest_workers_enabled:
+        # With digest workers, the first worker process pre-summarizes instead
+        asyncio.create_task(presummarizer.run())
+    if settings.retention_enabled:
+        asyncio.create_task(retention.run())
+    if settings.metrics_enabled:
+        with startup.phase('metrics'):
+            try:
+                await metrics_server.start()
+            except OSError as e:
+                logger.error(f"Could not start the metrics endpoint on {settings.metrics_host}:{settings.metrics_port}: {e}")
+    startup.log()
+    # The bot is up: import the OpenAI SDK in the background so the first digest does not wait for it
+    asyncio.create_task(warm_openai_client())
     
     # --- Setup signal handlers (as before) ---
     loop = asyncio.get_running_loop()
@@ -760,13 +1240,25 @@ async def main():
             except Exception as e_cancel:
                  logger.error(f"Error during digest task cancellation: {e_cancel}")
 
-        # Disconnect clients
+        # Disconnect clients: stop ingestion first, send pending notifications, then stop the bot
         logger.info("Disconnecting clients...")
-        if bot.is_connected():
-            await bot.disconnect()
         if user_client.is_connected():
             await user_client.disconnect()
+        try:
+            await albums.close()
+            await backfill_albums.close()
+            await notifier.close()
+        except Exception as e_notify:
+            logger.error(f"Error flushing pending notifications: {e_notify}")
+        if bot.is_connected():
+            await bot.disconnect()
         logger.info("Clients disconnected.")
+
+        # No new posts can arrive now: flush everything still buffered
+        try:
+            await ingest_queue.close()
+        except Exception as e_flush:
+            logger.error(f"Error flushing ingest queue: {e_flush}")
         
         # Cancel remaining tasks (should ideally be fewer now)
         tasks = [t for t in asyncio.all_tasks() if t is not asyncio.current_task()]
@@ -787,6 +1279,11 @@ async def main():
             logger.info(f"Registered signal handler for {s.name}")
         except NotImplementedError:
              logger.warning(f"Signal handling for {s.name} not supported on this platform (e.g., Windows). Relying on KeyboardInterrupt.")
+    # SIGHUP reloads the monitored channel list without restarting the clients
+    try:
+        loop.add_signal_handler(signal.SIGHUP, lambda: asyncio.create_task(channel_registry.reload()))
+    except (NotImplementedError, AttributeError):
+        logger.warning("SIGHUP not supported on this platform; channel list reloads on its interval only.")
 
     try:
         logger.info("Running clients until disconnected...")
@@ -803,13 +1300,14 @@ async def main():
          if user_client.is_connected():
              logger.warning("User client still connected in finally block, attempting disconnect.")
              await user_client.disconnect()
+         await metrics_server.close()
+         await backfill_albums.close()
+         await ingest_queue.close()
+         await storage.close()
          logger.info("Bot stopped gracefully")
 
 if __name__ == '__main__':
     try:
-        # Debug: Print all environment variables
-        logger.info(f"Environment variables before main: {dict(os.environ)}")
-        
         # Run the main coroutine using asyncio.run
         asyncio.run(main()) # This handles loop creation and closing
 
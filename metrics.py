@@ -0,0 +1,332 @@
+"""In-process metrics in the Prometheus text format.
+
+Counters and histograms are plain Python objects updated on the event loop
+thread: an increment is a dict lookup and an addition, a histogram
+observation adds a bisect over the bucket bounds. Nothing is locked,
+formatted or sent until /metrics is scraped, so instrumenting the ingestion
+path costs a few hundred nanoseconds per post.
+
+All metrics register in the module-level REGISTRY. MetricsServer serves it
+on a local HTTP port from the bot process (METRICS_ENABLED); digest worker
+processes (worker.py) keep their own registries and do not serve them.
+"""
+import asyncio
+import functools
+import logging
+import math
+import time
+from bisect import bisect_left
+
+logger = logging.getLogger(__name__)
+
+PREFIX = 'tgdigest_'
+# Seconds: from a fast SQLite read up to a large map-reduce digest
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0, 300.0)
+
+
+def _format_value(value) -> str:
+    if value == math.inf:
+        return '+Inf'
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return repr(value)
+
+
+def _escape(value) -> str:
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def _label_text(names, values, extra: str = '') -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+class Registry:
+    def __init__(self):
+        self._metrics = {}
+
+    def register(self, metric):
+        if metric.name in self._metrics:
+            raise ValueError(f"Metric {metric.name} is already registered")
+        self._metrics[metric.name] = metric
+        return metric
+
+    def render(self) -> str:
+        """All metrics in the Prometheus text exposition format (version 0.0.4)."""
+        lines = []
+        for metric in self._metrics.values():
+            try:
+                samples = list(metric.samples())
+            except Exception as e:
+                logger.error(f"Error collecting metric {metric.name}: {e}")
+                continue
+            lines.append(f"# HELP {metric.name} {metric.documentation}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            lines.extend(f"{name}{labels} {_format_value(value)}" for name, labels, value in samples)
+        return '\n'.join(lines) + '\n'
+
+
+REGISTRY = Registry()
+
+
+class _Metric:
+    kind = 'untyped'
+
+    def __init__(self, name: str, documentation: str, labelnames=(), registry=REGISTRY):
+        self.name = PREFIX + name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._children = {}
+        if registry is not None:
+            registry.register(self)
+
+    def labels(self, *values):
+        """The child for these label values (in `labelnames` order); keep it around on hot paths."""
+        child = self._children.get(values)
+        if child is None:
+            if len(values) != len(self.labelnames):
+                raise ValueError(f"{self.name} takes labels {self.labelnames}, got {values}")
+            child = self._children[values] = self._new_child()
+        return child
+
+    def _new_child(self):
+        raise NotImplementedError
+
+
+class _CounterChild:
+    __slots__ = ('value',)
+
+    def __init__(self):
+        self.value = 0.0
+
+    def inc(self, amount: float = 1.0):
+        self.value += amount
+
+
+class Counter(_Metric):
+    kind = 'counter'
+
+    def __init__(self, name: str, documentation: str, labelnames=(), registry=REGISTRY):
+        super().__init__(name + '_total', documentation, labelnames, registry)
+
+    def _new_child(self):
+        return _CounterChild()
+
+    def inc(self, amount: float = 1.0):
+        self.labels().inc(amount)
+
+    def samples(self):
+        for values, child in self._children.items():
+            yield self.name, _label_text(self.labelnames, values), child.value
+
+
+class _HistogramChild:
+    __slots__ = ('bounds', 'counts', 'sum')
+
+    def __init__(self, bounds):
+        self.bounds = bounds
+        self.counts = [0] * (len(bounds) + 1)
+        self.sum = 0.0
+
+    def observe(self, value: float):
+        self.counts[bisect_left(self.bounds, value)] += 1
+        self.sum += value
+
+    def time(self):
+        """Context manager observing the duration of its block in seconds."""
+        return _Timer(self)
+
+
+class _Timer:
+    __slots__ = ('child', 'started')
+
+    def __init__(self, child):
+        self.child = child
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.child.observe(time.perf_counter() - self.started)
+        return False
+
+
+class Histogram(_Metric):
+    kind = 'histogram'
+
+    def __init__(self, name: str, documentation: str, labelnames=(), buckets=DEFAULT_BUCKETS, registry=REGISTRY):
+        self.buckets = tuple(sorted(buckets))
+        super().__init__(name, documentation, labelnames, registry)
+
+    def _new_child(self):
+        return _HistogramChild(self.buckets)
+
+    def observe(self, value: float):
+        self.labels().observe(value)
+
+    def time(self):
+        return self.labels().time()
+
+    def samples(self):
+        for values, child in self._children.items():
+            cumulative = 0
+            for bound, count in zip(self.buckets + (math.inf,), child.counts):
+                cumulative += count
+                le = f'le="{_format_value(float(bound))}"'
+                yield self.name + '_bucket', _label_text(self.labelnames, values, le), cumulative
+            labels = _label_text(self.labelnames, values)
+            yield self.name + '_sum', labels, child.sum
+            yield self.name + '_count', labels, cumulative
+
+
+class Gauge(_Metric):
+    """A value read when scraped: `function()` returns a number, or with
+    `labelnames` a dict of label-value tuples to numbers."""
+    kind = 'gauge'
+
+    def __init__(self, name: str, documentation: str, function, labelnames=(), kind: str = 'gauge',
+                 registry=REGISTRY):
+        self.function = function
+        self.kind = kind
+        super().__init__(name, documentation, labelnames, registry)
+
+    def samples(self):
+        value = self.function()
+        if not self.labelnames:
+            yield self.name, '', value
+            return
+        for values, number in value.items():
+            yield self.name, _label_text(self.labelnames, values), number
+
+
+class StartupTimer:
+    """Durations of the named startup phases, logged as one line by log() and
+    served as the startup_phase_seconds gauge.
+
+    Phases may overlap (the clients connect while the duplicate index warms
+    up), so they need not add up to the total, which runs from `started`.
+    """
+
+    def __init__(self, started: float = None, registry=REGISTRY):
+        self.started = time.perf_counter() if started is None else started
+        self.phases = {}
+        Gauge('startup_phase_seconds', 'Duration of each startup phase of the bot process',
+              lambda: {(name,): seconds for name, seconds in self.phases.items()}, ['phase'], registry=registry)
+
+    def add(self, name: str, seconds: float):
+        self.phases[name] = seconds
+
+    def phase(self, name: str):
+        """Context manager recording the duration of its block as phase `name`."""
+        return _PhaseTimer(self, name)
+
+    def log(self):
+        total = time.perf_counter() - self.started
+        phases = ', '.join(f"{name} {seconds:.2f}s" for name, seconds in self.phases.items())
+        logger.info(f"Startup took {total:.2f}s ({phases})")
+
+
+class _PhaseTimer:
+    __slots__ = ('timer', 'name', 'started')
+
+    def __init__(self, timer: StartupTimer, name: str):
+        self.timer = timer
+        self.name = name
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.timer.add(self.name, time.perf_counter() - self.started)
+        return False
+
+
+def timed(histogram: Histogram, errors: Counter = None, *labels):
+    """Decorator for coroutine functions: observe each call's duration in `histogram`
+    (and count calls that raise in `errors`) under the given label values."""
+    def decorator(fn):
+        child = histogram.labels(*labels)
+        error_child = errors.labels(*labels) if errors is not None else None
+
+        @functools.wraps(fn)
+        async def wrapper(*args, **kwargs):
+            started = time.perf_counter()
+            try:
+                return await fn(*args, **kwargs)
+            except Exception:
+                if error_child is not None:
+                    error_child.inc()
+                raise
+            finally:
+                child.observe(time.perf_counter() - started)
+        return wrapper
+    return decorator
+
+
+# --- metrics shared by the modules ---
+
+HANDLER_SECONDS = Histogram('handler_seconds', 'Telegram event handler duration', ['handler'])
+HANDLER_ERRORS = Counter('handler_errors', 'Telegram event handlers that raised', ['handler'])
+POSTS_RECEIVED = Counter('posts_received', 'Channel posts received by channel_handler')
+ALBUMS = Counter('albums', 'Media albums merged into one post each at ingestion')
+ALBUM_MESSAGES = Counter('album_messages', 'Messages merged into album posts at ingestion')
+DB_SECONDS = Histogram('db_seconds', 'Storage call duration, including the wait for the I/O thread', ['op', 'conn'])
+DB_ERRORS = Counter('db_errors', 'Storage calls that raised', ['op', 'conn'])
+OPENAI_SECONDS = Histogram('openai_request_seconds', 'OpenAI chat completion duration', ['model', 'stream'])
+OPENAI_ERRORS = Counter('openai_errors', 'OpenAI chat completions that raised', ['model', 'stream'])
+OPENAI_TOKENS = Counter('openai_tokens', 'OpenAI tokens used (estimated when a stream reports no usage)',
+                        ['model', 'kind'])
+SUMMARIZE_SECONDS = Histogram('summarize_posts_seconds', 'summarize_posts duration (cache hits included)', ['result'])
+SENDS = Counter('telegram_sends', 'Outbound Telegram messages and edits by result', ['op', 'result'])
+SEND_SECONDS = Histogram('telegram_send_seconds', 'Outbound Telegram API call duration', ['op'])
+FANOUT_SECONDS = Histogram('digest_fanout_seconds', 'send_digest delivery to every recipient, generation excluded',
+                           ['mode'])
+FANOUT_RECIPIENTS = Counter('digest_recipients', 'Digest recipients by delivery result', ['mode', 'result'])
+
+
+class MetricsServer:
+    """Minimal HTTP server answering GET /metrics with `registry.render()`.
+
+    Bind it to localhost (the default) or a private interface: the endpoint
+    has no authentication.
+    """
+
+    def __init__(self, registry: Registry = REGISTRY, host: str = '127.0.0.1', port: int = 9108):
+        self.registry = registry
+        self.host = host
+        self.port = port
+        self._server = None
+
+    async def start(self):
+        self._server = await asyncio.start_server(self._handle, self.host, self.port)
+        logger.info(f"Serving metrics on http://{self.host}:{self.port}/metrics")
+
+    async def close(self):
+        if self._server is not None:
+            self._server.close()
+            await self._server.wait_closed()
+            self._server = None
+
+    async def _handle(self, reader, writer):
+        try:
+            request_line = await asyncio.wait_for(reader.readline(), timeout=5)
+            while (await asyncio.wait_for(reader.readline(), timeout=5)) not in (b'\r\n', b'\n', b''):
+                pass  # headers are not needed
+            parts = request_line.decode('latin-1').split()
+            if len(parts) >= 2 and parts[0] in ('GET', 'HEAD') and parts[1].split('?')[0] == '/metrics':
+                status, body = '200 OK', self.registry.render().encode()
+                content_type = 'text/plain; version=0.0.4; charset=utf-8'
+            else:
+                status, body, content_type = '404 Not Found', b'Not found\n', 'text/plain; charset=utf-8'
+            head = (f"HTTP/1.1 {status}\r\nContent-Type: {content_type}\r\n"
+                    f"Content-Length: {len(body)}\r\nConnection: close\r\n\r\n").encode()
+            writer.write(head if parts and parts[0] == 'HEAD' else head + body)
+            await writer.drain()
+        except (asyncio.TimeoutError, ConnectionError) as e:
+            logger.debug(f"Metrics request aborted: {e}")
+        finally:
+            writer.close()
@@ -0,0 +1,342 @@
+import logging
+
+logger = logging.getLogger(__name__)
+
+# The schema version is stored in SQLite's built-in PRAGMA user_version.
+# Each migration runs once, in order, inside its own transaction; to change
+# the schema append a new function to MIGRATIONS, never edit an applied one.
+
+
+def init_new_database(conn):
+    """Settings a database file only takes before anything is written to it.
+
+    Must run before the journal mode is switched to WAL. New databases get
+    auto_vacuum=INCREMENTAL, so retention can return freed pages in small
+    steps; existing ones keep their mode (see Storage.enable_incremental_vacuum).
+    """
+    if conn.execute('SELECT COUNT(*) FROM sqlite_master').fetchone()[0] == 0:
+        conn.execute('PRAGMA auto_vacuum = INCREMENTAL')
+
+
+def _columns(conn, table: str) -> set:
+    return {row[1] for row in conn.execute(f'PRAGMA table_info({table})')}
+
+
+def _migrate_1_canonical_schema(conn):
+    """Create the canonical users/posts schema.
+
+    Older databases may contain the legacy `posts` table created by the removed
+    init_posts_database() (no channel or link columns); those columns are added
+    in place so existing rows are kept.
+    """
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS users (
+            user_id INTEGER PRIMARY KEY,
+            username TEXT,
+            first_seen TEXT
+        )
+    ''')
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS posts (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            channel_id TEXT NOT NULL,
+            channel_title TEXT NOT NULL,
+            timestamp TEXT NOT NULL,
+            content TEXT NOT NULL,
+            post_link TEXT,
+            sent BOOLEAN DEFAULT FALSE
+        )
+    ''')
+    columns = _columns(conn, 'posts')
+    if 'channel_id' not in columns:
+        conn.execute("ALTER TABLE posts ADD COLUMN channel_id TEXT NOT NULL DEFAULT ''")
+    if 'channel_title' not in columns:
+        conn.execute("ALTER TABLE posts ADD COLUMN channel_title TEXT NOT NULL DEFAULT ''")
+    if 'post_link' not in columns:
+        conn.execute('ALTER TABLE posts ADD COLUMN post_link TEXT')
+
+
+def _migrate_2_post_indexes(conn):
+    """Indexes for the hot posts queries.
+
+    idx_posts_unsent is a partial index over unsent rows only, so it stays
+    small while sent posts accumulate. It serves get_unsent_posts (ordered by
+    timestamp), count_unsent_posts (COUNT/MIN are answered from the index
+    alone) and the /status per-channel breakdown (channel_title is included,
+    making it covering). idx_posts_timestamp serves the manual digest's
+    `timestamp > ?` window.
+    """
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_posts_unsent ON posts (timestamp, channel_title) WHERE sent = FALSE')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_posts_timestamp ON posts (timestamp)')
+
+
+def _migrate_3_notification_mute(conn):
+    """Per-user mute for new-post notifications (NULL means notifications are on)."""
+    if 'notify_muted_until' not in _columns(conn, 'users'):
+        conn.execute('ALTER TABLE users ADD COLUMN notify_muted_until TEXT')
+
+
+def _migrate_4_digest_cache(conn):
+    """Content-addressed cache of generated digests."""
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS digest_cache (
+            cache_key TEXT PRIMARY KEY,
+            summary TEXT NOT NULL,
+            link_map TEXT NOT NULL,
+            created_at REAL NOT NULL,
+            last_used_at REAL NOT NULL
+        )
+    ''')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_digest_cache_last_used ON digest_cache (last_used_at)')
+
+
+def _migrate_5_micro_summaries(conn):
+    """Background micro-summaries and the link from each post to the one covering it.
+
+    presummary_id is NULL for posts still waiting to be pre-summarized and 0
+    for posts that never will be (already sent before this migration).
+    """
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS micro_summaries (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            period_start TEXT NOT NULL,
+            period_end TEXT NOT NULL,
+            post_count INTEGER NOT NULL,
+            summary TEXT NOT NULL,
+            link_map TEXT NOT NULL,
+            created_at TEXT NOT NULL
+        )
+    ''')
+    if 'presummary_id' not in _columns(conn, 'posts'):
+        conn.execute('ALTER TABLE posts ADD COLUMN presummary_id INTEGER')
+    conn.execute('UPDATE posts SET presummary_id = 0 WHERE sent = TRUE AND presummary_id IS NULL')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_posts_presummary_pending ON posts (id) WHERE presummary_id IS NULL AND sent = FALSE')
+
+
+def _migrate_6_duplicate_links(conn):
+    """Link near-duplicate posts to their canonical post (by post_link)."""
+    if 'duplicate_of' not in _columns(conn, 'posts'):
+        conn.execute('ALTER TABLE posts ADD COLUMN duplicate_of TEXT')
+
+
+def _migrate_7_posts_archive(conn):
+    """Archive for sent posts moved out of the hot posts table by retention.
+
+    Rows keep their original post ID; content is stored compressed, with the
+    codec used recorded per row so the codec can change without rewriting
+    old rows.
+    """
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS posts_archive (
+            id INTEGER PRIMARY KEY,
+            channel_id TEXT NOT NULL,
+            channel_title TEXT NOT NULL,
+            timestamp TEXT NOT NULL,
+            post_link TEXT,
+            duplicate_of TEXT,
+            codec TEXT NOT NULL,
+            content BLOB NOT NULL,
+            archived_at TEXT NOT NULL
+        )
+    ''')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_posts_archive_timestamp ON posts_archive (timestamp)')
+
+
+def _migrate_8_channel_watermarks(conn):
+    """Telegram message IDs of posts and the last seen message ID per channel.
+
+    The unique (channel_id, message_id) index lets the startup backfill and
+    live ingestion insert the same message without creating a second row.
+    Watermarks of existing channels are seeded from the message IDs at the
+    end of their stored post links.
+    """
+    if 'message_id' not in _columns(conn, 'posts'):
+        conn.execute('ALTER TABLE posts ADD COLUMN message_id INTEGER')
+    conn.execute('''
+        CREATE UNIQUE INDEX IF NOT EXISTS idx_posts_channel_message
+        ON posts (channel_id, message_id) WHERE message_id IS NOT NULL
+    ''')
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS channel_watermarks (
+            channel_id TEXT PRIMARY KEY,
+            last_message_id INTEGER NOT NULL
+        )
+    ''')
+    last_seen = {}
+    for channel_id, post_link in conn.execute('SELECT channel_id, post_link FROM posts WHERE post_link IS NOT NULL'):
+        tail = post_link.rstrip('/').rsplit('/', 1)[-1]
+        if channel_id and tail.isdigit():
+            last_seen[channel_id] = max(last_seen.get(channel_id, 0), int(tail))
+    conn.executemany('INSERT OR REPLACE INTO channel_watermarks (channel_id, last_message_id) VALUES (?, ?)', last_seen.items())
+
+
+def _migrate_9_monitored_channels(conn):
+    """Monitored channels as configured (`ref`) with their resolved Telegram identity.
+
+    peer_id is Telethon's marked ID (-100...) that events carry as chat_id;
+    channel_id is the bare ID stored on posts. Both are NULL until resolved.
+    """
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS monitored_channels (
+            ref TEXT PRIMARY KEY,
+            peer_id INTEGER,
+            channel_id TEXT,
+            title TEXT,
+            username TEXT,
+            resolved_at TEXT,
+            active INTEGER NOT NULL DEFAULT 1
+        )
+    ''')
+
+
+def _migrate_10_user_subscriptions(conn):
+    """Per-user channel subscriptions (by bare channel ID); users without rows get every channel."""
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS user_subscriptions (
+            user_id INTEGER NOT NULL,
+            channel_id TEXT NOT NULL,
+            PRIMARY KEY (user_id, channel_id)
+        ) WITHOUT ROWID
+    ''')
+
+
+def _migrate_11_digest_schedules(conn):
+    """Per-user automatic digest schedule and the end of the last delivered digest window.
+
+    digest_schedule is a scheduler.Schedule spec ('HH:MM Zone', 'every N', 'off');
+    NULL means the configured default schedule.
+    """
+    columns = _columns(conn, 'users')
+    if 'digest_schedule' not in columns:
+        conn.execute('ALTER TABLE users ADD COLUMN digest_schedule TEXT')
+    if 'last_digest_window_end' not in columns:
+        conn.execute('ALTER TABLE users ADD COLUMN last_digest_window_end TEXT')
+
+
+def _migrate_12_digest_jobs(conn):
+    """Job queue for out-of-process digest workers.
+
+    A job is leased by one worker until lease_expires_at (epoch seconds);
+    workers extend the lease while running, so a job whose lease expired
+    belongs to a crashed worker and can be claimed again. At most one queued
+    or running job exists per dedupe_key.
+    """
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS digest_jobs (
+            id INTEGER PRIMARY KEY,
+            kind TEXT NOT NULL,
+            dedupe_key TEXT,
+            payload TEXT NOT NULL,
+            status TEXT NOT NULL DEFAULT 'queued',
+            attempts INTEGER NOT NULL DEFAULT 0,
+            max_attempts INTEGER NOT NULL,
+            run_after REAL NOT NULL,
+            leased_by TEXT,
+            lease_expires_at REAL,
+            result TEXT,
+            error TEXT,
+            created_at REAL NOT NULL,
+            finished_at REAL
+        )
+    ''')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_digest_jobs_queued ON digest_jobs (run_after) WHERE status = \'queued\'')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_digest_jobs_leases ON digest_jobs (lease_expires_at) WHERE status = \'running\'')
+    conn.execute(
+        'CREATE UNIQUE INDEX IF NOT EXISTS idx_digest_jobs_active_key ON digest_jobs (dedupe_key) '
+        'WHERE status IN (\'queued\', \'running\')'
+    )
+
+
+def _migrate_13_prompt_texts(conn):
+    """Compacted prompt text of each post and its token count, computed at ingestion.
+
+    NULL for posts stored before this migration; they are compacted when summarized.
+    """
+    columns = _columns(conn, 'posts')
+    if 'prompt_text' not in columns:
+        conn.execute('ALTER TABLE posts ADD COLUMN prompt_text TEXT')
+    if 'prompt_tokens' not in columns:
+        conn.execute('ALTER TABLE posts ADD COLUMN prompt_tokens INTEGER')
+
+
+def _migrate_14_posts_fts(conn):
+    """FTS5 full-text index of post content for /search (Storage.search_posts).
+
+    An external-content table over posts: it stores only the index, the text
+    stays in posts. Triggers keep it in sync with every insert, delete (e.g.
+    retention moving a post to the archive) and content update, so no code
+    path can forget it. channel_id is indexed as a second column so a channel
+    filter is a posting-list intersection rather than a scan. Existing posts
+    are indexed here once.
+    """
+    conn.execute('''
+        CREATE VIRTUAL TABLE IF NOT EXISTS posts_fts USING fts5(
+            content, channel_id,
+            content='posts', content_rowid='id',
+            tokenize='unicode61 remove_diacritics 2'
+        )
+    ''')
+    conn.execute('''
+        CREATE TRIGGER IF NOT EXISTS posts_fts_insert AFTER INSERT ON posts BEGIN
+            INSERT INTO posts_fts (rowid, content, channel_id) VALUES (new.id, new.content, new.channel_id);
+        END
+    ''')
+    conn.execute('''
+        CREATE TRIGGER IF NOT EXISTS posts_fts_delete AFTER DELETE ON posts BEGIN
+            INSERT INTO posts_fts (posts_fts, rowid, content, channel_id) VALUES ('delete', old.id, old.content, old.channel_id);
+        END
+    ''')
+    conn.execute('''
+        CREATE TRIGGER IF NOT EXISTS posts_fts_update AFTER UPDATE OF content, channel_id ON posts BEGIN
+            INSERT INTO posts_fts (posts_fts, rowid, content, channel_id) VALUES ('delete', old.id, old.content, old.channel_id);
+            INSERT INTO posts_fts (rowid, content, channel_id) VALUES (new.id, new.content, new.channel_id);
+        END
+    ''')
+    conn.execute("INSERT INTO posts_fts (posts_fts) VALUES ('rebuild')")
+
+
+MIGRATIONS = [
+    (1, 'canonical users/posts schema', _migrate_1_canonical_schema),
+    (2, 'indexes for unsent and time-window post queries', _migrate_2_post_indexes),
+    (3, 'per-user notification mute', _migrate_3_notification_mute),
+    (4, 'digest cache', _migrate_4_digest_cache),
+    (5, 'micro-summaries for incremental pre-summarization', _migrate_5_micro_summaries),
+    (6, 'near-duplicate links', _migrate_6_duplicate_links),
+    (7, 'archive of old sent posts', _migrate_7_posts_archive),
+    (8, 'message IDs and per-channel watermarks', _migrate_8_channel_watermarks),
+    (9, 'monitored channel registry', _migrate_9_monitored_channels),
+    (10, 'per-user channel subscriptions', _migrate_10_user_subscriptions),
+    (11, 'per-user digest schedules', _migrate_11_digest_schedules),
+    (12, 'digest job queue', _migrate_12_digest_jobs),
+    (13, 'compacted prompt texts with token counts', _migrate_13_prompt_texts),
+    (14, 'full-text index of post content', _migrate_14_posts_fts),
+]
+
+SCHEMA_VERSION = MIGRATIONS[-1][0]
+
+
+def get_schema_version(conn) -> int:
+    return conn.execute('PRAGMA user_version').fetchone()[0]
+
+
+def apply_migrations(conn, target_version: int = SCHEMA_VERSION) -> int:
+    """Bring the database up to `target_version`. Returns the resulting version."""
+    current = get_schema_version(conn)
+    if current > SCHEMA_VERSION:
+        raise RuntimeError(f"Database schema version {current} is newer than this code supports ({SCHEMA_VERSION})")
+    for version, description, migrate in MIGRATIONS:
+        if version <= current or version > target_version:
+            continue
+        logger.info(f"Applying migration {version}: {description}")
+        conn.execute('BEGIN')
+        try:
+            migrate(conn)
+            conn.execute(f'PRAGMA user_version = {version}')
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            logger.error(f"Migration {version} failed, rolled back", exc_info=True)
+            raise
+        current = version
+    logger.info(f"Database schema at version {current}")
+    return current
@@ -0,0 +1,118 @@
+import asyncio
+import logging
+from datetime import datetime
+
+logger = logging.getLogger(__name__)
+
+# Telegram rejects messages longer than this
+MESSAGE_LIMIT = 4096
+
+
+def format_notification(posts: list, preview_length: int = 100) -> str:
+    """Build one combined notification for several new posts.
+
+    Args:
+        posts: Tuples of (channel_title, post_link, time_str, content)
+        preview_length: Max characters of post text shown per post
+    """
+    if len(posts) == 1:
+        channel_title, post_link, time_str, content = posts[0]
+        return f"📥 Новый пост из [{channel_title}]({post_link})\n⏰ Время: {time_str}\n📝 Текст: {content[:preview_length]}{'...' if len(content) > preview_length else ''}"
+
+    header = f"📥 Новые посты ({len(posts)}):\n\n"
+    message = header
+    for i, (channel_title, post_link, time_str, content) in enumerate(posts):
+        preview = content[:preview_length].replace('\n', ' ')
+        line = f"• {time_str} [{channel_title}]({post_link}): {preview}{'...' if len(content) > preview_length else ''}\n"
+        remaining = len(posts) - i
+        footer = f"…и ещё {remaining}"
+        if len(message) + len(line) + len(footer) > MESSAGE_LIMIT:
+            message += footer
+            break
+        message += line
+    return message.rstrip()
+
+
+class NotificationAggregator:
+    """Coalesces new-post notifications into one message per user per window.
+
+    The first post after a quiet period opens a window of `window_seconds`;
+    every post that arrives before it closes is added to the same message.
+    The window is flushed early once `max_posts` posts are pending; that
+    fan-out runs as a background task, so the handler adding the post does
+    not wait for it. Outbound traffic becomes one message per user per
+    window instead of one per post.
+    """
+
+    def __init__(self, client, deliverer, get_recipients, window_seconds: float = 60.0, max_posts: int = 20):
+        """
+        Args:
+            client: Bot client used to send notifications
+            deliverer: Deliverer used for the fan-out
+            get_recipients: Coroutine function returning user IDs that want notifications
+        """
+        self.client = client
+        self.deliverer = deliverer
+        self.get_recipients = get_recipients
+        self.window_seconds = window_seconds
+        self.max_posts = max_posts
+        self._pending = []
+        self._timer = None
+        self._sending = set()
+        self._lock = asyncio.Lock()
+
+    async def add(self, channel_title: str, post_link: str, timestamp: datetime, content: str):
+        """Add a post to the current notification window."""
+        self._pending.append((channel_title, post_link, timestamp.strftime("%H:%M"), content))
+        if len(self._pending) >= self.max_posts:
+            self._start_send()
+        elif self._timer is None or self._timer.done():
+            self._timer = asyncio.create_task(self._flush_later())
+
+    async def _flush_later(self):
+        try:
+            await asyncio.sleep(self.window_seconds)
+        except asyncio.CancelledError:
+            return
+        self._start_send()
+
+    def _start_send(self):
+        """Send the current window's posts in a tracked background task."""
+        task = asyncio.create_task(self._send(self._take()))
+        self._sending.add(task)
+        task.add_done_callback(self._sending.discard)
+
+    def _take(self) -> list:
+        """Close the current window: stop its timer and hand over its posts."""
+        if self._timer is not None and self._timer is not asyncio.current_task() and not self._timer.done():
+            self._timer.cancel()
+        self._timer = None
+        posts, self._pending = self._pending, []
+        return posts
+
+    async def flush(self):
+        """Send everything pending now."""
+        await self._send(self._take())
+
+    async def _send(self, posts: list):
+        if not posts:
+            return
+        async with self._lock:  # one fan-out at a time, in window order
+            try:
+                recipients = await self.get_recipients()
+                if not recipients:
+                    logger.debug(f"No users to notify about {len(posts)} new posts")
+                    return
+                notification = format_notification(posts)
+                await self.deliverer.send_many(
+                    self.client, recipients, notification,
+                    label=f"notification ({len(posts)} posts)", parse_mode='markdown',
+                )
+            except Exception as e:
+                logger.error(f"Error sending notification for {len(posts)} posts: {e}")
+
+    async def close(self):
+        """Finish fan-outs in progress, then flush pending notifications, on shutdown."""
+        while self._sending:
+            await asyncio.gather(*self._sending, return_exceptions=True)
+        await self.flush()
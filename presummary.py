@@ -0,0 +1,147 @@
+import asyncio
+import json
+import logging
+import time
+from datetime import datetime
+
+from summarizer import REFERENCE_RE
+
+logger = logging.getLogger(__name__)
+
+
+def renumber_references(text: str, link_map: dict, offset: int) -> str:
+    """Shift every [n] that is a key of link_map by `offset`, leaving other brackets alone."""
+    def shift(match):
+        number = int(match.group(1))
+        return f"[{number + offset}]" if number in link_map else match.group(0)
+    return REFERENCE_RE.sub(shift, text)
+
+
+class PreSummarizer:
+    """Summarizes posts in the background as they arrive, so digests are assembled, not generated.
+
+    Unsent posts are summarized into micro-summaries of up to `batch_posts`
+    posts, either as soon as that many are pending or once `interval_seconds`
+    have passed since the last run. Each micro-summary is stored with its own
+    link map, and its posts point to it through posts.presummary_id.
+
+    At digest time the micro-summaries that cover the requested posts are
+    renumbered into one global reference space and merged with a single
+    reduce call; only posts not yet covered are summarized on the spot.
+    """
+
+    def __init__(self, storage, summarizer, batch_posts: int = 50, interval_seconds: float = 3600.0,
+                 check_seconds: float = 60.0):
+        self.storage = storage
+        self.summarizer = summarizer
+        self.batch_posts = batch_posts
+        self.interval_seconds = interval_seconds
+        self.check_seconds = check_seconds
+        self._last_run = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    # --- background stage ---
+
+    async def run(self):
+        """Background task: periodically turn pending posts into micro-summaries."""
+        logger.info(f"Starting pre-summarization task (batch of {self.batch_posts} posts or every {self.interval_seconds / 60:.0f} min)")
+        while True:
+            try:
+                await asyncio.sleep(self.check_seconds)
+                pending = await self.storage.count_posts_pending_presummary()
+                due = time.monotonic() - self._last_run >= self.interval_seconds
+                if pending >= self.batch_posts or (due and pending > 0):
+                    await self.summarize_pending(flush_partial=due)
+            except asyncio.CancelledError:
+                logger.info("Pre-summarization task cancelled.")
+                break
+            except Exception as e:
+                logger.error(f"Error in pre-summarization task: {e}", exc_info=True)
+
+    async def summarize_pending(self, flush_partial: bool = True) -> int:
+        """Summarize pending posts in chunks of `batch_posts`.
+
+        Args:
+            flush_partial: Also summarize a final chunk smaller than `batch_posts`
+
+        Returns:
+            int: Number of micro-summaries created
+        """
+        created = 0
+        async with self._lock:
+            while True:
+                posts = await self.storage.get_posts_pending_presummary(self.batch_posts)
+                if not posts or (len(posts) < self.batch_posts and not flush_partial):
+                    break
+                await self._summarize_chunk(posts)
+                created += 1
+                if len(posts) < self.batch_posts:
+                    break
+            self._last_run = time.monotonic()
+        return created
+
+    async def _summarize_chunk(self, posts):
+        started = time.perf_counter()
+        # Posts that cannot be formatted are still marked so they are not retried forever
+        post_ids = [post[0] for post in posts]
+        duplicate_of = await self.storage.get_duplicate_of(post_ids)
+        prompt_texts = await self.storage.get_prompt_texts(post_ids)
+        entries, link_map = self.summarizer.prepare(posts, duplicate_of=duplicate_of, prompt_texts=prompt_texts)
+        if entries:
+            batches = self.summarizer.build_batches(entries)
+            partials = await self.summarizer.map_batches(batches)
+            summary = partials[0] if len(partials) == 1 else await self.summarizer.reduce(partials)
+        else:
+            summary = ''
+        timestamps = [post[2] for post in posts]
+        micro_id = await self.storage.save_micro_summary(
+            post_ids, min(timestamps), max(timestamps), summary, json.dumps(link_map), datetime.now().isoformat(),
+        )
+        logger.info(f"Created micro-summary {micro_id} for {len(posts)} posts in {time.perf_counter() - started:.1f}s")
+
+    # --- digest assembly ---
+
+    async def summarize(self, posts, duplicate_of: dict = None, on_text=None, prompt_texts: dict = None):
+        """Build a digest for `posts` from micro-summaries, summarizing only uncovered posts.
+
+        Returns (summary, link_map) like Summarizer.summarize, which it falls back to
+        when no micro-summary covers the requested posts. The final reduce is
+        streamed to `on_text(text_so_far, link_map)` if given.
+        """
+        if not posts:
+            return await self.summarizer.summarize(posts)
+
+        post_ids = [post[0] for post in posts]
+        coverage = await self.storage.get_presummary_coverage(post_ids)
+        covered_count = {}
+        for presummary_id in coverage.values():
+            covered_count[presummary_id] = covered_count.get(presummary_id, 0) + 1
+        micro_summaries = await self.storage.get_micro_summaries(list(covered_count))
+        # Only use micro-summaries whose posts are all part of this digest
+        usable = [m for m in micro_summaries if m[1] == covered_count.get(m[0]) and m[2]]
+        if not usable:
+            return await self.summarizer.summarize(
+                posts, duplicate_of=duplicate_of, on_text=on_text, prompt_texts=prompt_texts)
+
+        usable_ids = {m[0] for m in usable}
+        partials = []
+        link_map = {}
+        offset = 0
+        for micro_id, post_count, summary, link_map_json in usable:
+            micro_map = {int(num): link for num, link in json.loads(link_map_json).items()}
+            partials.append(renumber_references(summary, micro_map, offset))
+            link_map.update({num + offset: link for num, link in micro_map.items()})
+            offset += max(micro_map, default=0)
+
+        remainder = [post for post in posts if coverage.get(post[0]) not in usable_ids]
+        if remainder:
+            entries, remainder_map = self.summarizer.prepare(
+                remainder, start=offset + 1, duplicate_of=duplicate_of, prompt_texts=prompt_texts)
+            if entries:
+                partials.extend(await self.summarizer.map_batches(self.summarizer.build_batches(entries)))
+                link_map.update(remainder_map)
+
+        logger.info(f"[summarize_posts] Assembling digest from {len(usable)} micro-summaries and {len(remainder)} fresh posts")
+        stream = (lambda text: on_text(text, link_map)) if on_text else None
+        summary = await self.summarizer.reduce(partials, stream)
+        return summary, link_map
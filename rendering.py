@@ -0,0 +1,86 @@
+import re
+
+MESSAGE_LIMIT = 4096
+# [n] not already followed by a link target, so "[3](url)" is never linked twice
+LINKABLE_REFERENCE_RE = re.compile(r'\[(\d+)\](?!\()')
+PARAGRAPH_BREAK_RE = re.compile(r'\n\s*\n')
+WORD_RE = re.compile(r'\S+')
+BOLD = '**'
+
+
+def link_references(text: str, link_map: dict) -> str:
+    """Turn every [n] found in link_map into a Markdown link, in a single regex pass.
+
+    Unlike replacing each reference over the whole text in turn, this is linear
+    in the length of the text and never rewrites inside an inserted link.
+    """
+    if not link_map:
+        return text
+
+    def link(match):
+        url = link_map.get(int(match.group(1)))
+        return f"[{match.group(1)}]({url})" if url else match.group(0)
+    return LINKABLE_REFERENCE_RE.sub(link, text)
+
+
+def _units(text: str, limit: int):
+    """Yield (separator, piece) pairs no longer than `limit`.
+
+    Paragraphs (digest sections) are kept whole when they fit; longer ones are
+    broken into lines, and overlong lines into words. Words never contain
+    spaces, so a Markdown link is never cut; only a single word longer than
+    the limit is cut hard.
+    """
+    for p, paragraph in enumerate(PARAGRAPH_BREAK_RE.split(text.strip())):
+        separator = '\n\n' if p else ''
+        if len(paragraph) <= limit:
+            yield separator, paragraph
+            continue
+        for l, line in enumerate(paragraph.split('\n')):
+            separator = separator if l == 0 else '\n'
+            if len(line) <= limit:
+                yield separator, line
+                continue
+            for w, word in enumerate(WORD_RE.findall(line)):
+                separator = separator if w == 0 else ' '
+                while len(word) > limit:
+                    yield separator, word[:limit]
+                    separator, word = '', word[limit:]
+                yield separator, word
+
+
+def split_message(text: str, limit: int = MESSAGE_LIMIT) -> list:
+    """Split Markdown text into Telegram-sized messages, breaking between sections where possible.
+
+    Sections (blank-line separated paragraphs) are packed greedily; a section
+    is only broken up when it is bigger than a whole message. A bold span cut
+    by a message boundary is closed at the end of one message and reopened at
+    the start of the next, so both render correctly.
+    """
+    # Room for the bold markers that may be added on either side of a boundary
+    budget = max(limit - 2 * len(BOLD), 1)
+    messages = []
+    current = ''
+    for separator, piece in _units(text, budget):
+        if current and len(current) + len(separator) + len(piece) > budget:
+            messages.append(current)
+            current = piece
+        else:
+            current = f"{current}{separator}{piece}" if current else piece
+    if current or not messages:
+        messages.append(current)
+
+    reopen = False
+    for i, message in enumerate(messages):
+        if reopen:
+            message = BOLD + message
+        reopen = message.count(BOLD) % 2 == 1
+        if reopen and i < len(messages) - 1:
+            message += BOLD
+        messages[i] = message
+    return messages
+
+
+def render_digest(summary: str, link_map: dict, limit: int = MESSAGE_LIMIT) -> list:
+    """Link references and split a digest into the messages to send."""
+    return split_message(link_references(summary, link_map), limit)
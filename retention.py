@@ -0,0 +1,142 @@
+import asyncio
+import logging
+import time
+import zlib
+from datetime import datetime, timedelta, timezone
+
+try:
+    import zstandard
+except ImportError:  # Optional: archived content falls back to zlib
+    zstandard = None
+
+logger = logging.getLogger(__name__)
+
+
+class ContentCodec:
+    """Compresses archived post content with zstd when available, zlib otherwise.
+
+    Every archived row records its codec, so rows written with either codec
+    stay readable whichever one is installed later (except zstd rows without
+    the zstandard package).
+    """
+
+    def __init__(self, level: int = None):
+        if zstandard is not None:
+            self.name = 'zstd'
+            self._compressor = zstandard.ZstdCompressor(level=level or 10)
+            self._decompressor = zstandard.ZstdDecompressor()
+        else:
+            self.name = 'zlib'
+            self._level = level or 6
+
+    def compress(self, content: str):
+        """Returns (codec, blob)."""
+        data = content.encode()
+        if self.name == 'zstd':
+            return 'zstd', self._compressor.compress(data)
+        return 'zlib', zlib.compress(data, self._level)
+
+    def decompress(self, codec: str, blob: bytes) -> str:
+        if codec == 'zlib':
+            return zlib.decompress(blob).decode()
+        if codec == 'zstd':
+            if zstandard is None:
+                raise RuntimeError("Archived post is zstd-compressed but the zstandard package is not installed")
+            return zstandard.ZstdDecompressor().decompress(blob).decode()
+        raise ValueError(f"Unknown archive codec: {codec}")
+
+
+class Retention:
+    """Keeps the hot posts table bounded by archiving old sent posts.
+
+    Every `interval_seconds` sent posts older than `max_age_days` are moved
+    into posts_archive with compressed content, `chunk_size` posts per
+    transaction with a short pause between chunks, so the ingest writer is
+    never blocked for long. Micro-summaries left without posts are dropped,
+    and the pages freed by the move are handed back to the filesystem with
+    incremental VACUUM, `vacuum_pages` pages at a time. A database created
+    without incremental auto-vacuum is converted only with `convert_database`,
+    since that takes one full VACUUM that blocks all writes.
+    """
+
+    def __init__(self, storage, max_age_days: float = 7.0, chunk_size: int = 500,
+                 interval_seconds: float = 3600.0, vacuum_pages: int = 1000, pause_seconds: float = 0.05,
+                 convert_database: bool = False):
+        self.storage = storage
+        self.max_age_days = max_age_days
+        self.chunk_size = chunk_size
+        self.interval_seconds = interval_seconds
+        self.vacuum_pages = vacuum_pages
+        self.pause_seconds = pause_seconds
+        self.convert_database = convert_database
+        self.codec = ContentCodec()
+
+    async def run(self):
+        """Background task: run a retention pass every `interval_seconds`."""
+        logger.info(f"Starting retention task (archive sent posts older than {self.max_age_days} days, codec {self.codec.name})")
+        try:
+            if self.convert_database:
+                if await self.storage.enable_incremental_vacuum():
+                    logger.info("Database converted to incremental auto-vacuum")
+            elif not await self.storage.incremental_vacuum_enabled():
+                logger.warning("Database is not in incremental auto-vacuum mode: archived posts free pages for reuse "
+                               "but the file does not shrink. Set RETENTION_CONVERT_DATABASE=true once to convert it "
+                               "(a full VACUUM that blocks writes while it runs).")
+        except Exception as e:
+            logger.error(f"Could not check incremental vacuum: {e}", exc_info=True)
+        while True:
+            try:
+                await self.run_once()
+                await asyncio.sleep(self.interval_seconds)
+            except asyncio.CancelledError:
+                logger.info("Retention task cancelled.")
+                break
+            except Exception as e:
+                logger.error(f"Error in retention task: {e}", exc_info=True)
+                await asyncio.sleep(60)
+
+    def cutoff(self) -> datetime:
+        """Posts published before this (aware, UTC) are archived once sent."""
+        return datetime.now(timezone.utc) - timedelta(days=self.max_age_days)
+
+    async def run_once(self) -> dict:
+        """Archive everything that is due, then vacuum. Returns a report."""
+        started = time.perf_counter()
+        # Post timestamps are stored as aware UTC ISO strings and compared as text
+        cutoff = self.cutoff().isoformat()
+        archived = 0
+        while True:
+            moved = await self.storage.archive_sent_posts(
+                cutoff, self.chunk_size, self.codec.compress, datetime.now(timezone.utc).isoformat(),
+            )
+            archived += moved
+            if moved < self.chunk_size:
+                break
+            await asyncio.sleep(self.pause_seconds)
+        orphans = await self.storage.delete_orphan_micro_summaries(cutoff)
+
+        free_pages = await self.storage.incremental_vacuum(self.vacuum_pages)
+        while free_pages > 0:
+            await asyncio.sleep(self.pause_seconds)
+            remaining = await self.storage.incremental_vacuum(self.vacuum_pages)
+            if remaining >= free_pages:
+                break
+            free_pages = remaining
+
+        report = await self.storage.get_retention_stats()
+        report.update(archived_now=archived, micro_summaries_dropped=orphans,
+                      elapsed_seconds=time.perf_counter() - started)
+        if archived or orphans:
+            logger.info(
+                f"Retention: archived {archived} posts, dropped {orphans} micro-summaries in {report['elapsed_seconds']:.2f}s "
+                f"(hot posts: {report['posts']}, archived: {report['archived']}, db size: {report['size_bytes'] / 1e6:.1f} MB)"
+            )
+        return report
+
+    async def get_archived_posts(self, timestamp_from: str, timestamp_to: str) -> list:
+        """Archived posts in the window as (id, channel_title, timestamp, content, post_link)."""
+        rows = await self.storage.get_archived_posts(timestamp_from, timestamp_to)
+        return [
+            (post_id, channel_title, timestamp, self.codec.decompress(codec, blob), post_link)
+            for post_id, channel_title, timestamp, codec, blob, post_link in rows
+        ]
@@ -0,0 +1,225 @@
+import asyncio
+import heapq
+import logging
+import random
+import re
+import time
+from datetime import datetime, timedelta, timezone
+from typing import NamedTuple
+
+logger = logging.getLogger(__name__)
+
+DAILY_RE = re.compile(r'^(\d{1,2}):(\d{2})(?:\s+(\S+))?$')
+INTERVAL_RE = re.compile(r'^every\s+(\d+)$')
+
+
+class UnknownTimeZoneError(ValueError):
+    pass
+
+
+def get_timezone(name: str):
+    """The pytz timezone `name`; pytz is imported on first use, not at startup."""
+    import pytz
+    try:
+        return pytz.timezone(name)
+    except pytz.UnknownTimeZoneError:
+        raise UnknownTimeZoneError(name) from None
+
+
+class Schedule(NamedTuple):
+    """When a user's automatic digest fires.
+
+    Either `daily` at `time` (HH:MM) in `tz`, or every `interval_minutes`
+    aligned to the Unix epoch, so all users on the same interval share fire
+    times and therefore digest windows.
+    """
+    kind: str
+    time: str = None
+    tz: str = None
+    interval_minutes: int = None
+
+    @classmethod
+    def daily(cls, time_str: str, tz: str, check_tz: bool = True):
+        if check_tz:
+            get_timezone(tz)  # raises UnknownTimeZoneError early
+        hour, minute = map(int, time_str.split(':'))
+        if not (0 <= hour <= 23 and 0 <= minute <= 59):
+            raise ValueError(f"Invalid time: {time_str}")
+        return cls('daily', time=f"{hour:02d}:{minute:02d}", tz=tz)
+
+    @classmethod
+    def interval(cls, minutes: int):
+        if minutes <= 0:
+            raise ValueError("Interval must be positive")
+        return cls('interval', interval_minutes=int(minutes))
+
+    @classmethod
+    def parse(cls, spec: str, default_tz: str = 'UTC'):
+        """Parse 'HH:MM [Timezone]', 'every N' (minutes) or 'off'."""
+        spec = spec.strip()
+        if spec.lower() == 'off':
+            return cls('off')
+        match = INTERVAL_RE.match(spec.lower())
+        if match:
+            return cls.interval(int(match.group(1)))
+        match = DAILY_RE.match(spec)
+        if match:
+            return cls.daily(f"{match.group(1)}:{match.group(2)}", match.group(3) or default_tz)
+        raise ValueError(f"Unrecognized schedule: {spec!r}")
+
+    def __str__(self):
+        if self.kind == 'daily':
+            return f"{self.time} {self.tz}"
+        if self.kind == 'interval':
+            return f"every {self.interval_minutes}"
+        return 'off'
+
+    def next_fire(self, after: datetime) -> datetime:
+        """First fire time strictly after `after` (aware datetime), in UTC; None if off."""
+        if self.kind == 'interval':
+            period = self.interval_minutes * 60
+            return datetime.fromtimestamp((int(after.timestamp()) // period + 1) * period, timezone.utc)
+        if self.kind == 'daily':
+            tz = get_timezone(self.tz)
+            hour, minute = map(int, self.time.split(':'))
+            local_day = after.astimezone(tz).date()
+            for days in range(0, 3):
+                naive = datetime.combine(local_day + timedelta(days=days), datetime.min.time()).replace(hour=hour, minute=minute)
+                fire = tz.localize(naive).astimezone(timezone.utc)
+                if fire > after:
+                    return fire
+        return None
+
+    def previous_fire(self, fire: datetime) -> datetime:
+        """The fire time before `fire`, i.e. the start of the window ending at `fire`."""
+        if self.kind == 'interval':
+            return fire - timedelta(minutes=self.interval_minutes)
+        tz = get_timezone(self.tz)
+        local = fire.astimezone(tz).replace(tzinfo=None) - timedelta(days=1)
+        return tz.localize(local).astimezone(timezone.utc)
+
+
+class DigestScheduler:
+    """Priority queue of per-user digest fire times.
+
+    Each user has one live heap entry keyed by its dispatch time: the
+    nominal fire time plus a fixed per-user jitter in [0, jitter_seconds),
+    so thousands of users sharing a schedule are spread over the jitter
+    window instead of firing in one burst. Entries that become due within
+    `batch_seconds` of each other are handed to `dispatch` together.
+
+    A digest covers the window between the previous and the current nominal
+    fire time (or since the user's last delivered window), so users on the
+    same schedule get identical post sets and share generation through the
+    digest cache, however their dispatch is spread.
+
+    `dispatch(due)` receives a list of (user_id, window_start, window_end)
+    and returns the user IDs whose window is done; the others keep their
+    window start and catch up at their next fire. Batches are dispatched as
+    separate tasks, so a slow delivery never delays later fire times; a user
+    whose previous digest is still in flight skips a fire and gets the longer
+    window next time.
+    """
+
+    def __init__(self, dispatch, default_schedule: Schedule, jitter_seconds: float = 120.0, batch_seconds: float = 1.0):
+        self.dispatch = dispatch
+        self.default_schedule = default_schedule
+        self.jitter_seconds = jitter_seconds
+        self.batch_seconds = batch_seconds
+        self._heap = []  # (dispatch_ts, fire_ts, version, user_id)
+        self._schedules = {}  # user_id -> Schedule
+        self._window_start = {}  # user_id -> aware datetime of the last delivered window end
+        self._versions = {}
+        self._in_flight = set()
+        self._tasks = set()
+        self._changed = asyncio.Event()
+
+    def __len__(self):
+        return len(self._schedules)
+
+    def _jitter(self, user_id) -> float:
+        return random.Random(user_id).random() * self.jitter_seconds if self.jitter_seconds else 0.0
+
+    def schedule_for(self, user_id) -> Schedule:
+        return self._schedules.get(user_id, self.default_schedule)
+
+    def set(self, user_id, schedule: Schedule = None, last_window_end: datetime = None):
+        """Add or replace a user's schedule (None means the default schedule)."""
+        effective = schedule or self.default_schedule
+        self._schedules[user_id] = effective
+        if last_window_end is not None:
+            self._window_start[user_id] = last_window_end
+        version = self._versions.get(user_id, 0) + 1
+        self._versions[user_id] = version
+        fire = effective.next_fire(datetime.now(timezone.utc))
+        if fire is not None:
+            heapq.heappush(self._heap, (fire.timestamp() + self._jitter(user_id), fire.timestamp(), version, user_id))
+        self._changed.set()
+
+    def remove(self, user_id):
+        self._schedules.pop(user_id, None)
+        self._versions[user_id] = self._versions.get(user_id, 0) + 1
+
+    def next_fire_for(self, user_id):
+        """Nominal next fire time (UTC) of a user's digest, or None."""
+        return self.schedule_for(user_id).next_fire(datetime.now(timezone.utc))
+
+    def _pop_due(self, now_ts: float) -> list:
+        due = []
+        while self._heap and self._heap[0][0] <= now_ts + self.batch_seconds:
+            _, fire_ts, version, user_id = heapq.heappop(self._heap)
+            if self._versions.get(user_id) != version or user_id not in self._schedules:
+                continue  # superseded by a newer schedule
+            due.append((user_id, fire_ts))
+        return due
+
+    async def _dispatch(self, batch: list):
+        try:
+            done = set(await self.dispatch(batch))
+        except Exception as e:
+            logger.error(f"Digest dispatch failed for {len(batch)} users: {e}", exc_info=True)
+            done = set()
+        finally:
+            self._in_flight.difference_update(user_id for user_id, _, _ in batch)
+        for user_id, _, window_end in batch:
+            if user_id in done:
+                self._window_start[user_id] = window_end
+
+    async def run(self):
+        """Background task: dispatch due users and requeue them at their next fire time."""
+        logger.info(f"Starting digest scheduler ({len(self)} users, default schedule {self.default_schedule}, jitter {self.jitter_seconds:.0f}s)")
+        while True:
+            try:
+                now_ts = time.time()
+                if not self._heap or self._heap[0][0] > now_ts + self.batch_seconds:
+                    timeout = self._heap[0][0] - now_ts if self._heap else None
+                    self._changed.clear()
+                    try:
+                        await asyncio.wait_for(self._changed.wait(), timeout)
+                    except asyncio.TimeoutError:
+                        pass
+                    continue
+                batch = []
+                for user_id, fire_ts in self._pop_due(now_ts):
+                    window_end = datetime.fromtimestamp(fire_ts, timezone.utc)
+                    if user_id in self._in_flight:
+                        logger.warning(f"Digest for user {user_id} still in flight, skipping the {window_end.isoformat()} fire")
+                    else:
+                        window_start = self._window_start.get(user_id) or self.schedule_for(user_id).previous_fire(window_end)
+                        batch.append((user_id, window_start, window_end))
+                    fire = self.schedule_for(user_id).next_fire(window_end)
+                    if fire is not None:
+                        heapq.heappush(self._heap, (fire.timestamp() + self._jitter(user_id), fire.timestamp(), self._versions[user_id], user_id))
+                if batch:
+                    self._in_flight.update(user_id for user_id, _, _ in batch)
+                    task = asyncio.create_task(self._dispatch(batch))
+                    self._tasks.add(task)
+                    task.add_done_callback(self._tasks.discard)
+            except asyncio.CancelledError:
+                logger.info("Digest scheduler cancelled.")
+                for task in list(self._tasks):
+                    task.cancel()
+                break
+            except Exception as e:
+                logger.error(f"Error in digest scheduler: {e}", exc_info=True)
+                await asyncio.sleep(5)
@@ -0,0 +1,114 @@
+"""Full-text search over stored posts (the posts_fts FTS5 index, see migrations.py).
+
+Helpers for /search and for digest code calling Storage.search_posts:
+turning free text into an FTS5 MATCH expression, parsing the command's
+optional channel and time arguments, and cutting a highlighted snippet
+out of a matching post.
+"""
+import re
+from datetime import datetime, timedelta, timezone
+
+# Words as FTS5's unicode61 tokenizer splits them (underscores separate words)
+WORD_RE = re.compile(r'[^\W_]+')
+# "7d", "24h", "2w" (or 7д, 24ч, 2н); an ISO date "2024-05-01" is accepted too
+SINCE_RE = re.compile(r'^(\d+)\s*([hdwчдн])$', re.IGNORECASE)
+SINCE_UNITS = {'h': 'hours', 'ч': 'hours', 'd': 'days', 'д': 'days', 'w': 'weeks', 'н': 'weeks'}
+# Words this long match as prefixes of their stem, so "ставка" also finds "ставку", "ставки"
+PREFIX_MIN_LENGTH = 4
+# Common Russian inflection endings, stripped while at least PREFIX_MIN_LENGTH letters remain
+ENDING_RE = re.compile(r'(?<=\w{%d})(?:ами|ями|ого|его|ому|ему|ов|ев|ей|ам|ям|ах|ях|ом|ем|ой|ий|ый|ая|яя|ое|ее|ые|ие|ую|юю|[аяоеёуюыиьй])$' % PREFIX_MIN_LENGTH)
+# Characters Telegram's Markdown would take as formatting
+MARKDOWN_RE = re.compile(r'[*_`\[\]]')
+
+
+def query_terms(text: str) -> list:
+    """Lowercased words of a search query, in order, without repeats."""
+    return list(dict.fromkeys(word.lower() for word in WORD_RE.findall(text)))
+
+
+def stem_term(term: str) -> tuple:
+    """(stem, matched as a prefix): long words match by the prefix of their stem, short ones exactly."""
+    if len(term) < PREFIX_MIN_LENGTH:
+        return term, False
+    return ENDING_RE.sub('', term), True
+
+
+def match_expression(text: str, channel_ids=None) -> str:
+    """FTS5 MATCH expression finding posts that contain every word of `text`.
+
+    Words are quoted, so FTS5 operators and syntax in user input are taken
+    literally. With `channel_ids` (bare channel IDs) only those channels match.
+    Returns '' when `text` has no words.
+    """
+    terms = query_terms(text)
+    if not terms:
+        return ''
+    words = ' '.join(f'"{stem}"*' if prefix else f'"{stem}"' for stem, prefix in map(stem_term, terms))
+    expression = f'content : ({words})'
+    if channel_ids:
+        expression += ' AND channel_id : (' + ' OR '.join(f'"{channel_id}"' for channel_id in channel_ids) + ')'
+    return expression
+
+
+def parse_since(arg: str, now: datetime = None, tz=None):
+    """'7d' / '24h' / '2w' (or 7д, 24ч, 2н) before `now`, or an ISO date; None if `arg` is neither.
+
+    The result is aware UTC, like the stored post timestamps it is compared
+    with. An ISO date means its midnight in `tz` (a pytz timezone; UTC if None).
+    """
+    match = SINCE_RE.match(arg)
+    if match:
+        now = now or datetime.now(timezone.utc)
+        return now - timedelta(**{SINCE_UNITS[match.group(2).lower()]: int(match.group(1))})
+    try:
+        midnight = datetime.strptime(arg, '%Y-%m-%d')
+    except ValueError:
+        return None
+    midnight = tz.localize(midnight) if tz is not None else midnight.replace(tzinfo=timezone.utc)
+    return midnight.astimezone(timezone.utc)
+
+
+def is_channel_arg(arg: str) -> bool:
+    """@username or a numeric channel ID; list numbers from /channels are left to the query."""
+    return arg.startswith('@') or (arg.lstrip('-').isdigit() and len(arg.lstrip('-')) >= 5)
+
+
+def parse_search_args(args: list, now: datetime = None, tz=None):
+    """Split /search arguments into (query words, channel argument, since).
+
+    The channel (@username or channel ID) and the time limit are optional
+    trailing arguments, in either order; everything before them is the query.
+    Dates are read in `tz` (see parse_since).
+    """
+    args = list(args)
+    channel_arg = since = None
+    while args and (channel_arg is None or since is None):
+        if since is None and (parsed := parse_since(args[-1], now, tz)) is not None:
+            since = parsed
+        elif channel_arg is None and is_channel_arg(args[-1]):
+            channel_arg = args[-1]
+        else:
+            break
+        args.pop()
+    return ' '.join(args), channel_arg, since
+
+
+def snippet(content: str, terms: list, width: int = 160) -> str:
+    """About `width` characters of `content` around the first query term, terms in bold."""
+    text = MARKDOWN_RE.sub('', ' '.join(content.split()))
+    if not terms:
+        return text[:width] + ('…' if len(text) > width else '')
+    pattern = re.compile('|'.join(
+        rf'\b{re.escape(stem)}\w*' if prefix else rf'\b{re.escape(stem)}\b' for stem, prefix in map(stem_term, terms)
+    ), re.IGNORECASE)
+    first = pattern.search(text)
+    start = max(0, (first.start() if first else 0) - width // 3)
+    if start:
+        space = text.find(' ', start)
+        start = space + 1 if 0 <= space < start + 20 else start
+    end = min(len(text), start + width)
+    if end < len(text):
+        space = text.rfind(' ', start, end)
+        end = space if space > start + width // 2 else end
+    piece = pattern.sub(lambda m: f"**{m.group(0)}**", text[start:end])
+    return ('…' if start else '') + piece + ('…' if end < len(text) else '')
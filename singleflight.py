@@ -0,0 +1,47 @@
+import asyncio
+import copy
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+class SingleFlight:
+    """Coalesces concurrent calls for the same key into one shared task.
+
+    The first caller for a key starts `fn()` as a task; callers arriving while
+    it runs wait on the same task instead of starting their own. Each caller
+    gets its own deep copy of the result, so one requester mutating it cannot
+    affect another. An exception is raised to every waiter. Cancelling one
+    waiter does not cancel the shared task or the other waiters.
+    """
+
+    def __init__(self):
+        self._inflight = {}
+        self.started = 0
+        self.coalesced = 0
+
+    async def do(self, key, fn):
+        """Run `fn()` (a coroutine function) once per key at a time and return its result."""
+        task = self._inflight.get(key)
+        if task is None:
+            self.started += 1
+            task = asyncio.create_task(fn())
+            self._inflight[key] = task
+            task.add_done_callback(lambda t, key=key: self._forget(key, t))
+        else:
+            self.coalesced += 1
+            logger.info(f"Joining in-flight request for {str(key)[:12]} ({self.coalesced} coalesced so far)")
+        result = await asyncio.shield(task)
+        return copy.deepcopy(result)
+
+    def _forget(self, key, task):
+        if self._inflight.get(key) is task:
+            del self._inflight[key]
+        if not task.cancelled() and task.exception() is not None:
+            # Retrieved by the waiters; reading it here avoids "exception never retrieved"
+            # warnings when every waiter was cancelled first.
+            logger.debug(f"In-flight request for {str(key)[:12]} failed: {task.exception()}")
+
+    @property
+    def in_flight(self) -> int:
+        return len(self._inflight)
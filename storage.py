@@ -0,0 +1,826 @@
+import asyncio
+import json
+import logging
+import sqlite3
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from metrics import DB_ERRORS, DB_SECONDS
+from migrations import apply_migrations, init_new_database
+
+logger = logging.getLogger(__name__)
+
+# SQL is kept in module-level constants so every call passes the exact same
+# string to sqlite3, which then reuses the prepared statement from the
+# connection's statement cache instead of re-parsing it.
+SQL_REGISTER_USER = 'INSERT OR IGNORE INTO users (user_id, username, first_seen) VALUES (?, ?, ?)'
+SQL_SELECT_USER_IDS = 'SELECT user_id FROM users'
+SQL_COUNT_USERS = 'SELECT COUNT(*) FROM users'
+SQL_SELECT_NOTIFY_USER_IDS = 'SELECT user_id FROM users WHERE notify_muted_until IS NULL OR notify_muted_until < ?'
+SQL_SET_NOTIFY_MUTED_UNTIL = 'UPDATE users SET notify_muted_until = ? WHERE user_id = ?'
+SQL_SELECT_DIGEST_SCHEDULES = 'SELECT user_id, digest_schedule, last_digest_window_end FROM users'
+SQL_SET_DIGEST_SCHEDULE = 'UPDATE users SET digest_schedule = ? WHERE user_id = ?'
+SQL_SET_LAST_DIGEST_WINDOW_END = 'UPDATE users SET last_digest_window_end = ? WHERE user_id = ?'
+# OR IGNORE: a message seen both live and by the startup backfill is stored once
+SQL_INSERT_POST = '''
+    INSERT OR IGNORE INTO posts (
+        channel_id, channel_title, timestamp, content, post_link, duplicate_of, message_id, prompt_text, prompt_tokens, sent
+    )
+    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, FALSE)
+'''
+SQL_ADVANCE_WATERMARK = '''
+    INSERT INTO channel_watermarks (channel_id, last_message_id) VALUES (?, ?)
+    ON CONFLICT (channel_id) DO UPDATE SET last_message_id = MAX(last_message_id, excluded.last_message_id)
+'''
+SQL_SELECT_WATERMARKS = 'SELECT channel_id, last_message_id FROM channel_watermarks'
+SQL_SELECT_UNSENT = '''
+    SELECT id, channel_title, timestamp, content, post_link
+    FROM posts
+    WHERE sent = FALSE
+    ORDER BY timestamp ASC
+'''
+SQL_SELECT_SINCE = '''
+    SELECT id, channel_title, timestamp, content, post_link
+    FROM posts
+    WHERE timestamp > ?
+    ORDER BY timestamp ASC
+'''
+SQL_MARK_SENT = 'UPDATE posts SET sent = TRUE WHERE id = ?'
+SQL_COUNT_UNSENT = 'SELECT COUNT(*) FROM posts WHERE sent = FALSE'
+SQL_EARLIEST_UNSENT = 'SELECT MIN(timestamp) FROM posts WHERE sent = FALSE'
+SQL_UNSENT_BY_CHANNEL_SINCE = '''
+    SELECT channel_title, COUNT(*) as post_count
+    FROM posts
+    WHERE timestamp > ? AND sent = FALSE
+    GROUP BY channel_title
+'''
+SQL_GET_CACHED_DIGEST = 'SELECT summary, link_map FROM digest_cache WHERE cache_key = ? AND created_at >= ?'
+SQL_TOUCH_CACHED_DIGEST = 'UPDATE digest_cache SET last_used_at = ? WHERE cache_key = ?'
+SQL_PUT_CACHED_DIGEST = 'INSERT OR REPLACE INTO digest_cache (cache_key, summary, link_map, created_at, last_used_at) VALUES (?, ?, ?, ?, ?)'
+SQL_EXPIRE_CACHED_DIGESTS = 'DELETE FROM digest_cache WHERE created_at < ?'
+SQL_TRIM_CACHED_DIGESTS = '''
+    DELETE FROM digest_cache WHERE cache_key IN (
+        SELECT cache_key FROM digest_cache ORDER BY last_used_at DESC LIMIT -1 OFFSET ?
+    )
+'''
+SQL_SELECT_PENDING_PRESUMMARY = '''
+    SELECT id, channel_title, timestamp, content, post_link
+    FROM posts
+    WHERE presummary_id IS NULL AND sent = FALSE
+    ORDER BY id ASC
+    LIMIT ?
+'''
+SQL_COUNT_PENDING_PRESUMMARY = 'SELECT COUNT(*) FROM posts WHERE presummary_id IS NULL AND sent = FALSE'
+SQL_INSERT_MICRO_SUMMARY = '''
+    INSERT INTO micro_summaries (period_start, period_end, post_count, summary, link_map, created_at)
+    VALUES (?, ?, ?, ?, ?, ?)
+'''
+SQL_SET_PRESUMMARY_ID = 'UPDATE posts SET presummary_id = ? WHERE id = ?'
+# json_each keeps a single prepared statement for any number of IDs
+SQL_SELECT_PRESUMMARY_COVERAGE = '''
+    SELECT id, presummary_id FROM posts
+    WHERE id IN (SELECT value FROM json_each(?)) AND presummary_id > 0
+'''
+SQL_SELECT_MICRO_SUMMARIES = '''
+    SELECT id, post_count, summary, link_map FROM micro_summaries
+    WHERE id IN (SELECT value FROM json_each(?))
+    ORDER BY id ASC
+'''
+SQL_SELECT_DUPLICATE_OF = '''
+    SELECT id, duplicate_of FROM posts
+    WHERE id IN (SELECT value FROM json_each(?)) AND duplicate_of IS NOT NULL
+'''
+SQL_SELECT_DEDUP_WINDOW = '''
+    SELECT content, post_link, timestamp FROM posts
+    WHERE timestamp > ? AND duplicate_of IS NULL
+    ORDER BY timestamp ASC
+'''
+SQL_SELECT_EXPIRED_POSTS = '''
+    SELECT id, channel_id, channel_title, timestamp, content, post_link, duplicate_of
+    FROM posts
+    WHERE timestamp < ? AND sent = TRUE
+    ORDER BY timestamp ASC
+    LIMIT ?
+'''
+SQL_INSERT_ARCHIVED_POST = '''
+    INSERT OR REPLACE INTO posts_archive (id, channel_id, channel_title, timestamp, post_link, duplicate_of, codec, content, archived_at)
+    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+'''
+SQL_DELETE_POST = 'DELETE FROM posts WHERE id = ?'
+SQL_DELETE_ORPHAN_MICRO_SUMMARIES = '''
+    DELETE FROM micro_summaries
+    WHERE period_end < ? AND NOT EXISTS (SELECT 1 FROM posts WHERE posts.presummary_id = micro_summaries.id)
+'''
+SQL_SELECT_ARCHIVED_SINCE = '''
+    SELECT id, channel_title, timestamp, codec, content, post_link
+    FROM posts_archive
+    WHERE timestamp > ? AND timestamp <= ?
+    ORDER BY timestamp ASC
+'''
+SQL_COUNT_POSTS = 'SELECT COUNT(*) FROM posts'
+SQL_COUNT_ARCHIVED = 'SELECT COUNT(*) FROM posts_archive'
+SQL_SEED_CHANNEL = 'INSERT OR IGNORE INTO monitored_channels (ref) VALUES (?)'
+SQL_ACTIVATE_CHANNEL = '''
+    INSERT INTO monitored_channels (ref, active) VALUES (?, 1)
+    ON CONFLICT (ref) DO UPDATE SET active = 1
+'''
+SQL_DEACTIVATE_CHANNELS = 'UPDATE monitored_channels SET active = 0 WHERE ref NOT IN (SELECT value FROM json_each(?))'
+SQL_SELECT_ACTIVE_CHANNELS = '''
+    SELECT ref, peer_id, channel_id, title, username FROM monitored_channels WHERE active = 1 ORDER BY ref
+'''
+SQL_SAVE_CHANNEL_RESOLUTION = '''
+    UPDATE monitored_channels SET peer_id = ?, channel_id = ?, title = ?, username = ?, resolved_at = ? WHERE ref = ?
+'''
+SQL_SELECT_SINCE_FOR_CHANNELS = '''
+    SELECT id, channel_title, timestamp, content, post_link
+    FROM posts
+    WHERE timestamp > ? AND channel_id IN (SELECT value FROM json_each(?))
+    ORDER BY timestamp ASC
+'''
+SQL_SELECT_WINDOW = '''
+    SELECT id, channel_title, timestamp, content, post_link
+    FROM posts
+    WHERE timestamp > ? AND timestamp <= ?
+    ORDER BY timestamp ASC
+'''
+SQL_SELECT_WINDOW_FOR_CHANNELS = '''
+    SELECT id, channel_title, timestamp, content, post_link
+    FROM posts
+    WHERE timestamp > ? AND timestamp <= ? AND channel_id IN (SELECT value FROM json_each(?))
+    ORDER BY timestamp ASC
+'''
+# Unsent posts no digest will pick up (channels outside every subscription), a chunk at a time
+SQL_MARK_UNSUBSCRIBED_SENT = '''
+    UPDATE posts SET sent = TRUE
+    WHERE id IN (
+        SELECT id FROM posts
+        WHERE sent = FALSE AND timestamp <= ? AND channel_id NOT IN (SELECT value FROM json_each(?))
+        LIMIT ?
+    )
+'''
+SQL_SELECT_SUBSCRIPTIONS = 'SELECT user_id, channel_id FROM user_subscriptions'
+SQL_SELECT_USER_SUBSCRIPTIONS = 'SELECT channel_id FROM user_subscriptions WHERE user_id = ?'
+SQL_DELETE_USER_SUBSCRIPTIONS = 'DELETE FROM user_subscriptions WHERE user_id = ?'
+SQL_INSERT_SUBSCRIPTION = 'INSERT OR IGNORE INTO user_subscriptions (user_id, channel_id) VALUES (?, ?)'
+SQL_SELECT_POSTS_BY_IDS = '''
+    SELECT id, channel_title, timestamp, content, post_link
+    FROM posts
+    WHERE id IN (SELECT value FROM json_each(?))
+    ORDER BY timestamp ASC
+'''
+SQL_SELECT_PROMPT_TEXTS = '''
+    SELECT id, prompt_text, prompt_tokens
+    FROM posts
+    WHERE id IN (SELECT value FROM json_each(?)) AND prompt_text IS NOT NULL
+'''
+# Full-text search (posts_fts, migration 14): the newest `candidates` matches are ranked by BM25 on
+# the content column, so a common word costs a bounded scan rather than ranking every match
+SQL_SEARCH_POSTS = '''
+    SELECT p.id, p.channel_title, p.timestamp, p.content, p.post_link
+    FROM (
+        SELECT posts_fts.rowid AS id, bm25(posts_fts, 1.0, 0.0) AS score
+        FROM posts_fts JOIN posts ON posts.id = posts_fts.rowid
+        WHERE posts_fts MATCH ? AND posts_fts.rowid >= ? AND posts.timestamp >= ?
+            AND (? OR posts.duplicate_of IS NULL)
+        ORDER BY posts_fts.rowid DESC
+        LIMIT ?
+    ) AS candidates
+    JOIN posts p ON p.id = candidates.id
+    ORDER BY candidates.score
+    LIMIT ?
+'''
+# The lowest post ID at or after a timestamp, looked at over at most ? rows of idx_posts_timestamp
+SQL_SEARCH_ID_BOUND = 'SELECT COUNT(*), MIN(id) FROM (SELECT id FROM posts WHERE timestamp >= ? LIMIT ?)'
+SQL_INSERT_JOB = '''
+    INSERT OR IGNORE INTO digest_jobs (kind, dedupe_key, payload, max_attempts, run_after, created_at)
+    VALUES (?, ?, ?, ?, ?, ?)
+'''
+SQL_SELECT_ACTIVE_JOB = "SELECT id FROM digest_jobs WHERE dedupe_key = ? AND status IN ('queued', 'running')"
+SQL_FAIL_EXPIRED_JOBS = '''
+    UPDATE digest_jobs
+    SET status = 'failed', error = 'lease expired after the last attempt', leased_by = NULL, finished_at = ?
+    WHERE status = 'running' AND lease_expires_at < ? AND attempts >= max_attempts
+'''
+SQL_CLAIM_JOBS = '''
+    UPDATE digest_jobs
+    SET status = 'running', leased_by = ?, lease_expires_at = ?, attempts = attempts + 1
+    WHERE id IN (
+        SELECT id FROM digest_jobs WHERE status = 'queued' AND run_after <= ?
+        UNION ALL
+        SELECT id FROM digest_jobs WHERE status = 'running' AND lease_expires_at < ?
+        LIMIT ?
+    )
+    RETURNING id, kind, payload, attempts, max_attempts
+'''
+SQL_EXTEND_JOB_LEASE = "UPDATE digest_jobs SET lease_expires_at = ? WHERE id = ? AND leased_by = ? AND status = 'running'"
+SQL_COMPLETE_JOB = '''
+    UPDATE digest_jobs
+    SET status = 'done', result = ?, error = NULL, leased_by = NULL, lease_expires_at = NULL, finished_at = ?
+    WHERE id = ? AND leased_by = ? AND status = 'running'
+'''
+SQL_FAIL_JOB = '''
+    UPDATE digest_jobs
+    SET status = CASE WHEN attempts < max_attempts THEN 'queued' ELSE 'failed' END,
+        finished_at = CASE WHEN attempts < max_attempts THEN NULL ELSE ? END,
+        run_after = ?, error = ?, leased_by = NULL, lease_expires_at = NULL
+    WHERE id = ? AND leased_by = ? AND status = 'running'
+'''
+SQL_SELECT_JOB = 'SELECT status, result, error FROM digest_jobs WHERE id = ?'
+SQL_DELETE_FINISHED_JOBS = "DELETE FROM digest_jobs WHERE status IN ('done', 'failed') AND finished_at < ?"
+SQL_COUNT_JOBS_BY_STATUS = 'SELECT status, COUNT(*) FROM digest_jobs GROUP BY status'
+
+
+class Storage:
+    """Async facade over a long-lived SQLite database in WAL mode.
+
+    All SQL runs off the event loop: writes go through a single writer thread
+    that owns the write connection, reads go through a separate reader thread
+    with its own connection. WAL lets the reader see committed data without
+    waiting for an in-progress write transaction, so a burst of inserts does
+    not stall /status or /digest.
+
+    Every call is timed into the tgdigest_db_seconds histogram, labelled with
+    the Storage method name and the connection ('read' or 'write').
+    """
+
+    def __init__(self, db_path: str, cached_statements: int = 256, busy_timeout_ms: int = 5000):
+        self.db_path = db_path
+        self.cached_statements = cached_statements
+        self.busy_timeout_ms = busy_timeout_ms
+        self._writer = None
+        self._reader = None
+        self._write_conn = None
+        self._read_conn = None
+        self._op_metrics = {}
+
+    # --- lifecycle ---
+
+    async def open(self):
+        """Start the I/O threads, open both connections and migrate the schema."""
+        if self._writer is not None:
+            return
+        self._writer = ThreadPoolExecutor(max_workers=1, thread_name_prefix='storage-writer')
+        self._reader = ThreadPoolExecutor(max_workers=1, thread_name_prefix='storage-reader')
+        await self._write(self._open_writer)
+        await self._read(self._open_reader)
+        logger.info(f"Storage opened at {self.db_path} (WAL mode)")
+
+    async def close(self):
+        """Close both connections and stop the I/O threads."""
+        if self._writer is None:
+            return
+        await self._read(self._close_reader)
+        await self._write(self._close_writer)
+        self._reader.shutdown(wait=True)
+        self._writer.shutdown(wait=True)
+        self._reader = None
+        self._writer = None
+        logger.info("Storage closed")
+
+    def _connect(self):
+        conn = sqlite3.connect(self.db_path, cached_statements=self.cached_statements)
+        conn.execute(f'PRAGMA busy_timeout = {int(self.busy_timeout_ms)}')
+        return conn
+
+    def _open_writer(self):
+        conn = self._connect()
+        init_new_database(conn)
+        conn.execute('PRAGMA journal_mode = WAL')
+        # NORMAL is durable across application crashes in WAL mode and avoids
+        # an fsync per commit.
+        conn.execute('PRAGMA synchronous = NORMAL')
+        apply_migrations(conn)
+        self._write_conn = conn
+
+    def _open_reader(self):
+        conn = self._connect()
+        conn.execute('PRAGMA query_only = ON')
+        self._read_conn = conn
+
+    def _close_writer(self):
+        if self._write_conn is not None:
+            self._write_conn.close()
+            self._write_conn = None
+
+    def _close_reader(self):
+        if self._read_conn is not None:
+            self._read_conn.close()
+            self._read_conn = None
+
+    async def _write(self, fn, *args):
+        return await self._run(self._writer, 'write', fn, args)
+
+    async def _read(self, fn, *args):
+        return await self._run(self._reader, 'read', fn, args)
+
+    async def _run(self, executor, conn: str, fn, args):
+        key = (fn.__code__, conn)
+        op_metrics = self._op_metrics.get(key)
+        if op_metrics is None:
+            # 'Storage.save_posts.<locals>.op' -> 'save_posts'
+            parts = fn.__qualname__.split('.')
+            op = parts[1] if len(parts) > 1 else parts[0]
+            op_metrics = self._op_metrics[key] = (DB_SECONDS.labels(op, conn), DB_ERRORS.labels(op, conn))
+        seconds, errors = op_metrics
+        started = time.perf_counter()
+        try:
+            return await asyncio.get_running_loop().run_in_executor(executor, fn, *args)
+        except Exception:
+            errors.inc()
+            raise
+        finally:
+            seconds.observe(time.perf_counter() - started)
+
+    # --- users ---
+
+    async def register_user(self, user_id: int, username: str, first_seen: str) -> bool:
+        """Insert the user if missing. Returns True if a new row was created."""
+        def op():
+            with self._write_conn:
+                cursor = self._write_conn.execute(SQL_REGISTER_USER, (user_id, username, first_seen))
+            return cursor.rowcount > 0
+        return await self._write(op)
+
+    async def get_user_ids(self) -> list:
+        def op():
+            return [row[0] for row in self._read_conn.execute(SQL_SELECT_USER_IDS)]
+        return await self._read(op)
+
+    async def get_notification_user_ids(self, now: str) -> list:
+        """IDs of users whose notifications are not muted at `now` (ISO timestamp)."""
+        def op():
+            return [row[0] for row in self._read_conn.execute(SQL_SELECT_NOTIFY_USER_IDS, (now,))]
+        return await self._read(op)
+
+    async def set_notifications_muted_until(self, user_id: int, muted_until: str = None) -> bool:
+        """Mute notifications until `muted_until` (ISO timestamp), or unmute with None.
+
+        Returns:
+            bool: False if the user is not registered
+        """
+        def op():
+            with self._write_conn:
+                cursor = self._write_conn.execute(SQL_SET_NOTIFY_MUTED_UNTIL, (muted_until, user_id))
+            return cursor.rowcount > 0
+        return await self._write(op)
+
+    async def get_digest_schedules(self) -> list:
+        """Rows of (user_id, digest_schedule, last_digest_window_end) for every user."""
+        def op():
+            return self._read_conn.execute(SQL_SELECT_DIGEST_SCHEDULES).fetchall()
+        return await self._read(op)
+
+    async def set_digest_schedule(self, user_id: int, schedule: str = None) -> bool:
+        """Set the user's schedule spec, or reset it to the default with None.
+
+        Returns:
+            bool: False if the user is not registered
+        """
+        def op():
+            with self._write_conn:
+                cursor = self._write_conn.execute(SQL_SET_DIGEST_SCHEDULE, (schedule, user_id))
+            return cursor.rowcount > 0
+        return await self._write(op)
+
+    async def set_last_digest_window_end(self, user_ids: list, window_end: str):
+        def op():
+            with self._write_conn:
+                self._write_conn.executemany(SQL_SET_LAST_DIGEST_WINDOW_END, [(window_end, user_id) for user_id in user_ids])
+        await self._write(op)
+
+    # --- subscriptions ---
+
+    async def get_subscriptions(self) -> dict:
+        """Map user ID -> set of subscribed channel IDs, for users with explicit subscriptions."""
+        def op():
+            subscriptions = {}
+            for user_id, channel_id in self._read_conn.execute(SQL_SELECT_SUBSCRIPTIONS):
+                subscriptions.setdefault(user_id, set()).add(channel_id)
+            return subscriptions
+        return await self._read(op)
+
+    async def get_user_subscriptions(self, user_id: int) -> set:
+        """Channel IDs the user subscribed to; empty means all channels."""
+        def op():
+            return {row[0] for row in self._read_conn.execute(SQL_SELECT_USER_SUBSCRIPTIONS, (user_id,))}
+        return await self._read(op)
+
+    async def set_user_subscriptions(self, user_id: int, channel_ids):
+        """Replace the user's subscriptions; an empty collection resets them to all channels."""
+        def op():
+            with self._write_conn:
+                self._write_conn.execute(SQL_DELETE_USER_SUBSCRIPTIONS, (user_id,))
+                self._write_conn.executemany(SQL_INSERT_SUBSCRIPTION, [(user_id, channel_id) for channel_id in channel_ids])
+        await self._write(op)
+
+    # --- posts ---
+
+    async def save_post(self, channel_id: str, channel_title: str, timestamp: str, content: str, post_link: str,
+                        duplicate_of: str = None, message_id: int = None, prompt_text: str = None,
+                        prompt_tokens: int = None):
+        await self.save_posts([
+            (channel_id, channel_title, timestamp, content, post_link, duplicate_of, message_id, prompt_text, prompt_tokens)
+        ])
+
+    async def save_posts(self, rows: list):
+        """Insert many posts in one transaction (one commit for the whole batch).
+
+        Channel watermarks advance in the same transaction, so a watermark never
+        points past a post that was not stored.
+
+        Args:
+            rows: Tuples of (channel_id, channel_title, timestamp, content, post_link, duplicate_of, message_id,
+                prompt_text, prompt_tokens)
+        """
+        watermarks = [(row[0], row[6]) for row in rows if row[6] is not None]
+
+        def op():
+            with self._write_conn:
+                self._write_conn.executemany(SQL_INSERT_POST, rows)
+                self._write_conn.executemany(SQL_ADVANCE_WATERMARK, watermarks)
+        await self._write(op)
+
+    async def get_channel_watermarks(self) -> dict:
+        """Map channel ID -> last stored Telegram message ID."""
+        def op():
+            return dict(self._read_conn.execute(SQL_SELECT_WATERMARKS))
+        return await self._read(op)
+
+    async def get_duplicate_of(self, post_ids: list) -> dict:
+        """Map post ID -> canonical post link for the given posts that are near-duplicates."""
+        def op():
+            return dict(self._read_conn.execute(SQL_SELECT_DUPLICATE_OF, (json.dumps(post_ids),)))
+        return await self._read(op)
+
+    async def get_canonical_posts_since(self, timestamp_threshold: str) -> list:
+        """Rows of (content, post_link, timestamp) for non-duplicate posts, to warm the dedup index."""
+        def op():
+            return self._read_conn.execute(SQL_SELECT_DEDUP_WINDOW, (timestamp_threshold,)).fetchall()
+        return await self._read(op)
+
+    async def get_unsent_posts(self) -> list:
+        def op():
+            return self._read_conn.execute(SQL_SELECT_UNSENT).fetchall()
+        return await self._read(op)
+
+    async def get_posts_since(self, timestamp_threshold: str) -> list:
+        def op():
+            return self._read_conn.execute(SQL_SELECT_SINCE, (timestamp_threshold,)).fetchall()
+        return await self._read(op)
+
+    async def get_posts_since_for_channels(self, timestamp_threshold: str, channel_ids: list) -> list:
+        def op():
+            return self._read_conn.execute(SQL_SELECT_SINCE_FOR_CHANNELS, (timestamp_threshold, json.dumps(channel_ids))).fetchall()
+        return await self._read(op)
+
+    async def get_posts_in_window(self, timestamp_from: str, timestamp_to: str, channel_ids: list = None) -> list:
+        """Posts with timestamp_from < timestamp <= timestamp_to, optionally only from `channel_ids`."""
+        def op():
+            if channel_ids is None:
+                return self._read_conn.execute(SQL_SELECT_WINDOW, (timestamp_from, timestamp_to)).fetchall()
+            return self._read_conn.execute(
+                SQL_SELECT_WINDOW_FOR_CHANNELS, (timestamp_from, timestamp_to, json.dumps(channel_ids))
+            ).fetchall()
+        return await self._read(op)
+
+    async def get_prompt_texts(self, post_ids: list) -> dict:
+        """Map post ID -> (compacted prompt text, token count) for the given posts that have one."""
+        def op():
+            rows = self._read_conn.execute(SQL_SELECT_PROMPT_TEXTS, (json.dumps(post_ids),))
+            return {post_id: (text, tokens) for post_id, text, tokens in rows}
+        return await self._read(op)
+
+    async def get_posts_by_ids(self, post_ids: list) -> list:
+        def op():
+            return self._read_conn.execute(SQL_SELECT_POSTS_BY_IDS, (json.dumps(post_ids),)).fetchall()
+        return await self._read(op)
+
+    async def search_posts(self, match: str, since: str = None, limit: int = 10, candidates: int = 1000,
+                           canonical_only: bool = False, bound_rows: int = 50000) -> list:
+        """Posts matching an FTS5 `match` expression (see search.match_expression), best first.
+
+        Only the newest `candidates` matches (at or after `since`) are ranked.
+        When at most `bound_rows` posts are newer than `since`, their lowest ID
+        also bounds the index scan, so a narrow time window stays cheap for a
+        word that is common in older posts. With `canonical_only` near-duplicates
+        are left out in favour of their canonical post.
+
+        Returns:
+            list: Tuples of (id, channel_title, timestamp, content, post_link)
+        """
+        def op():
+            conn = self._read_conn
+            min_id = 0
+            if since:
+                count, lowest = conn.execute(SQL_SEARCH_ID_BOUND, (since, bound_rows + 1)).fetchone()
+                if count <= bound_rows:
+                    min_id = lowest if lowest is not None else -1
+            if min_id < 0:
+                return []
+            return conn.execute(
+                SQL_SEARCH_POSTS, (match, min_id, since or '', not canonical_only, candidates, limit)
+            ).fetchall()
+        return await self._read(op)
+
+    async def mark_posts_as_sent(self, post_ids: list):
+        # executemany with a fixed statement instead of a variable-length IN (...)
+        # so the same prepared statement is reused regardless of batch size.
+        def op():
+            with self._write_conn:
+                self._write_conn.executemany(SQL_MARK_SENT, [(post_id,) for post_id in post_ids])
+        await self._write(op)
+
+    async def mark_unsubscribed_posts_sent(self, channel_ids, until: str, limit: int = 1000) -> int:
+        """Mark up to `limit` unsent posts published up to `until` outside `channel_ids` as sent.
+
+        Returns:
+            int: Number of posts marked (less than `limit` once none are left)
+        """
+        def op():
+            with self._write_conn:
+                return self._write_conn.execute(
+                    SQL_MARK_UNSUBSCRIBED_SENT, (until, json.dumps(sorted(channel_ids)), limit)
+                ).rowcount
+        return await self._write(op)
+
+    async def count_unsent_posts(self):
+        """Return (count, earliest_timestamp) for unsent posts."""
+        def op():
+            count = self._read_conn.execute(SQL_COUNT_UNSENT).fetchone()[0]
+            earliest_timestamp = self._read_conn.execute(SQL_EARLIEST_UNSENT).fetchone()[0]
+            return count, earliest_timestamp
+        return await self._read(op)
+
+    async def get_status_stats(self, timestamp_threshold: str) -> dict:
+        """Collect everything /status shows in a single round trip to the reader thread."""
+        def op():
+            conn = self._read_conn
+            return {
+                'by_channel': conn.execute(SQL_UNSENT_BY_CHANNEL_SINCE, (timestamp_threshold,)).fetchall(),
+                'earliest_unsent': conn.execute(SQL_EARLIEST_UNSENT).fetchone()[0],
+                'total_unsent': conn.execute(SQL_COUNT_UNSENT).fetchone()[0],
+                'registered_users': conn.execute(SQL_COUNT_USERS).fetchone()[0],
+            }
+        return await self._read(op)
+
+    # --- digest cache ---
+
+    async def get_cached_digest(self, cache_key: str, created_after: float, now: float):
+        """Return (summary, link_map_json) if a fresh entry exists, refreshing its LRU timestamp."""
+        def read():
+            return self._read_conn.execute(SQL_GET_CACHED_DIGEST, (cache_key, created_after)).fetchone()
+        row = await self._read(read)
+        if row is not None:
+            def touch():
+                with self._write_conn:
+                    self._write_conn.execute(SQL_TOUCH_CACHED_DIGEST, (now, cache_key))
+            await self._write(touch)
+        return row
+
+    async def put_cached_digest(self, cache_key: str, summary: str, link_map_json: str, now: float,
+                                expired_before: float, max_entries: int):
+        """Store a digest and evict expired and least recently used entries in the same transaction."""
+        def op():
+            with self._write_conn:
+                self._write_conn.execute(SQL_PUT_CACHED_DIGEST, (cache_key, summary, link_map_json, now, now))
+                self._write_conn.execute(SQL_EXPIRE_CACHED_DIGESTS, (expired_before,))
+                self._write_conn.execute(SQL_TRIM_CACHED_DIGESTS, (max_entries,))
+        await self._write(op)
+
+    # --- micro-summaries ---
+
+    async def count_posts_pending_presummary(self) -> int:
+        def op():
+            return self._read_conn.execute(SQL_COUNT_PENDING_PRESUMMARY).fetchone()[0]
+        return await self._read(op)
+
+    async def get_posts_pending_presummary(self, limit: int) -> list:
+        def op():
+            return self._read_conn.execute(SQL_SELECT_PENDING_PRESUMMARY, (limit,)).fetchall()
+        return await self._read(op)
+
+    async def save_micro_summary(self, post_ids: list, period_start: str, period_end: str,
+                                 summary: str, link_map_json: str, created_at: str) -> int:
+        """Store a micro-summary and point its posts at it in one transaction. Returns its ID."""
+        def op():
+            with self._write_conn:
+                cursor = self._write_conn.execute(
+                    SQL_INSERT_MICRO_SUMMARY,
+                    (period_start, period_end, len(post_ids), summary, link_map_json, created_at),
+                )
+                micro_id = cursor.lastrowid
+                self._write_conn.executemany(SQL_SET_PRESUMMARY_ID, [(micro_id, post_id) for post_id in post_ids])
+            return micro_id
+        return await self._write(op)
+
+    async def get_presummary_coverage(self, post_ids: list) -> dict:
+        """Map post ID -> micro-summary ID for the given posts that are covered by one."""
+        def op():
+            return dict(self._read_conn.execute(SQL_SELECT_PRESUMMARY_COVERAGE, (json.dumps(post_ids),)))
+        return await self._read(op)
+
+    async def get_micro_summaries(self, micro_ids: list) -> list:
+        """Rows of (id, post_count, summary, link_map_json), oldest first."""
+        def op():
+            return self._read_conn.execute(SQL_SELECT_MICRO_SUMMARIES, (json.dumps(micro_ids),)).fetchall()
+        return await self._read(op)
+
+    # --- monitored channels ---
+
+    async def seed_channels(self, refs: list):
+        """Add configured channel references that are not known yet (existing rows keep their state)."""
+        def op():
+            with self._write_conn:
+                self._write_conn.executemany(SQL_SEED_CHANNEL, [(ref,) for ref in refs])
+        await self._write(op)
+
+    async def set_active_channels(self, refs: list):
+        """Make exactly `refs` the active channel list, keeping resolutions of known refs."""
+        def op():
+            with self._write_conn:
+                self._write_conn.executemany(SQL_ACTIVATE_CHANNEL, [(ref,) for ref in refs])
+                self._write_conn.execute(SQL_DEACTIVATE_CHANNELS, (json.dumps(refs),))
+        await self._write(op)
+
+    async def get_active_channels(self) -> list:
+        """Rows of (ref, peer_id, channel_id, title, username); IDs are NULL if unresolved."""
+        def op():
+            return self._read_conn.execute(SQL_SELECT_ACTIVE_CHANNELS).fetchall()
+        return await self._read(op)
+
+    async def save_channel_resolutions(self, rows: list):
+        """Persist resolved channels.
+
+        Args:
+            rows: Tuples of (peer_id, channel_id, title, username, resolved_at, ref)
+        """
+        def op():
+            with self._write_conn:
+                self._write_conn.executemany(SQL_SAVE_CHANNEL_RESOLUTION, rows)
+        await self._write(op)
+
+    # --- retention ---
+
+    async def archive_sent_posts(self, older_than: str, limit: int, compress, archived_at: str) -> int:
+        """Move up to `limit` sent posts older than `older_than` into posts_archive.
+
+        The chunk is copied and deleted in one short transaction, so a crash
+        never loses or duplicates a post and other writers wait at most one chunk.
+
+        Args:
+            compress: Callable turning post content into (codec, blob)
+
+        Returns:
+            int: Number of posts moved
+        """
+        def op():
+            conn = self._write_conn
+            with conn:
+                rows = conn.execute(SQL_SELECT_EXPIRED_POSTS, (older_than, limit)).fetchall()
+                archived = []
+                for post_id, channel_id, channel_title, timestamp, content, post_link, duplicate_of in rows:
+                    codec, blob = compress(content)
+                    archived.append((post_id, channel_id, channel_title, timestamp, post_link, duplicate_of, codec, blob, archived_at))
+                conn.executemany(SQL_INSERT_ARCHIVED_POST, archived)
+                conn.executemany(SQL_DELETE_POST, [(row[0],) for row in rows])
+            return len(rows)
+        return await self._write(op)
+
+    async def delete_orphan_micro_summaries(self, older_than: str) -> int:
+        """Drop micro-summaries whose posts have all been archived."""
+        def op():
+            with self._write_conn:
+                return self._write_conn.execute(SQL_DELETE_ORPHAN_MICRO_SUMMARIES, (older_than,)).rowcount
+        return await self._write(op)
+
+    async def get_archived_posts(self, timestamp_from: str, timestamp_to: str) -> list:
+        """Rows of (id, channel_title, timestamp, codec, content_blob, post_link) archived in the window."""
+        def op():
+            return self._read_conn.execute(SQL_SELECT_ARCHIVED_SINCE, (timestamp_from, timestamp_to)).fetchall()
+        return await self._read(op)
+
+    async def get_retention_stats(self) -> dict:
+        """Row counts of the hot and archive tables and the database's page usage."""
+        def op():
+            conn = self._read_conn
+            page_size = conn.execute('PRAGMA page_size').fetchone()[0]
+            return {
+                'posts': conn.execute(SQL_COUNT_POSTS).fetchone()[0],
+                'archived': conn.execute(SQL_COUNT_ARCHIVED).fetchone()[0],
+                'size_bytes': conn.execute('PRAGMA page_count').fetchone()[0] * page_size,
+                'free_bytes': conn.execute('PRAGMA freelist_count').fetchone()[0] * page_size,
+            }
+        return await self._read(op)
+
+    async def incremental_vacuum_enabled(self) -> bool:
+        """Whether the database is in auto_vacuum=INCREMENTAL mode (new databases are)."""
+        def op():
+            return self._read_conn.execute('PRAGMA auto_vacuum').fetchone()[0] == 2
+        return await self._read(op)
+
+    async def enable_incremental_vacuum(self) -> bool:
+        """Switch the database to auto_vacuum=INCREMENTAL.
+
+        An existing database only changes mode after a full VACUUM, which is
+        run here. That rewrites the whole file and blocks every write until it
+        is done, so it is only run on request (RETENTION_CONVERT_DATABASE);
+        afterwards free pages are returned with incremental_vacuum().
+
+        Returns:
+            bool: True if the database was converted now
+        """
+        def op():
+            conn = self._write_conn
+            if conn.execute('PRAGMA auto_vacuum').fetchone()[0] == 2:
+                return False
+            conn.execute('PRAGMA auto_vacuum = INCREMENTAL')
+            conn.execute('VACUUM')
+            return True
+        return await self._write(op)
+
+    async def incremental_vacuum(self, pages: int) -> int:
+        """Release up to `pages` free pages to the filesystem. Returns the free pages left."""
+        def op():
+            conn = self._write_conn
+            conn.execute(f'PRAGMA incremental_vacuum({int(pages)})').fetchall()
+            return conn.execute('PRAGMA freelist_count').fetchone()[0]
+        return await self._write(op)
+
+    # --- digest jobs ---
+
+    async def enqueue_job(self, kind: str, payload: str, dedupe_key: str = None, max_attempts: int = 3,
+                          now: float = None) -> int:
+        """Queue a job; with a dedupe_key already queued or running, return that job instead.
+
+        Returns:
+            int: Job ID
+        """
+        now = time.time() if now is None else now
+
+        def op():
+            with self._write_conn:
+                cursor = self._write_conn.execute(SQL_INSERT_JOB, (kind, dedupe_key, payload, max_attempts, now, now))
+                if cursor.rowcount > 0:
+                    return cursor.lastrowid
+                return self._write_conn.execute(SQL_SELECT_ACTIVE_JOB, (dedupe_key,)).fetchone()[0]
+        return await self._write(op)
+
+    async def claim_jobs(self, worker_id: str, limit: int, lease_seconds: float, now: float = None) -> list:
+        """Lease up to `limit` runnable jobs: queued ones that are due, and running ones whose lease expired.
+
+        Jobs whose lease expired on their last attempt are failed instead.
+        The claim is a single UPDATE, so concurrent workers (in other
+        processes) never lease the same job.
+
+        Returns:
+            list: Rows of (id, kind, payload, attempts, max_attempts)
+        """
+        now = time.time() if now is None else now
+
+        def op():
+            with self._write_conn:
+                self._write_conn.execute(SQL_FAIL_EXPIRED_JOBS, (now, now))
+                return self._write_conn.execute(SQL_CLAIM_JOBS, (worker_id, now + lease_seconds, now, now, limit)).fetchall()
+        return await self._write(op)
+
+    async def extend_job_lease(self, job_id: int, worker_id: str, lease_expires_at: float) -> bool:
+        """Heartbeat. Returns False if the worker no longer holds the job (lease lost)."""
+        def op():
+            with self._write_conn:
+                cursor = self._write_conn.execute(SQL_EXTEND_JOB_LEASE, (lease_expires_at, job_id, worker_id))
+            return cursor.rowcount > 0
+        return await self._write(op)
+
+    async def complete_job(self, job_id: int, worker_id: str, result: str) -> bool:
+        def op():
+            with self._write_conn:
+                cursor = self._write_conn.execute(SQL_COMPLETE_JOB, (result, time.time(), job_id, worker_id))
+            return cursor.rowcount > 0
+        return await self._write(op)
+
+    async def fail_job(self, job_id: int, worker_id: str, error: str, retry_at: float) -> bool:
+        """Requeue the job at `retry_at`, or mark it failed if it has no attempts left."""
+        def op():
+            with self._write_conn:
+                cursor = self._write_conn.execute(SQL_FAIL_JOB, (time.time(), retry_at, error, job_id, worker_id))
+            return cursor.rowcount > 0
+        return await self._write(op)
+
+    async def get_job(self, job_id: int):
+        """(status, result, error) of a job, or None."""
+        def op():
+            return self._read_conn.execute(SQL_SELECT_JOB, (job_id,)).fetchone()
+        return await self._read(op)
+
+    async def delete_finished_jobs(self, finished_before: float) -> int:
+        def op():
+            with self._write_conn:
+                cursor = self._write_conn.execute(SQL_DELETE_FINISHED_JOBS, (finished_before,))
+            return cursor.rowcount
+        return await self._write(op)
+
+    async def get_job_counts(self) -> dict:
+        """Number of jobs per status."""
+        def op():
+            return dict(self._read_conn.execute(SQL_COUNT_JOBS_BY_STATUS))
+        return await self._read(op)
@@ -0,0 +1,165 @@
+import asyncio
+import logging
+import re
+import time
+
+import telethon.errors
+
+from metrics import SEND_SECONDS, SENDS
+from rendering import MESSAGE_LIMIT, link_references, split_message
+
+logger = logging.getLogger(__name__)
+
+CURSOR = ' ▌'
+# A reference still being typed at the end of the stream, e.g. "[1" or "["
+PARTIAL_REFERENCE_RE = re.compile(r'\[\d*$')
+
+
+class StreamingMessage:
+    """Shows a digest while it is generated by progressively editing Telegram messages.
+
+    `update()` only records the latest text; a background task applies it with
+    at most one edit or send per `edit_interval` seconds, so bursts of stream
+    chunks collapse into a single edit and the chat stays within Telegram's
+    per-chat limits. References are linked on every render; a reference still
+    being typed at the end of the stream is held back until it is complete.
+    Text beyond the 4096-char limit continues in follow-up messages split on
+    section boundaries (see rendering.split_message), and earlier messages are
+    only edited again if their part actually changed.
+    """
+
+    def __init__(self, client, chat_id, message, edit_interval: float = 1.5, limit: int = MESSAGE_LIMIT,
+                 max_flood_wait: float = 60.0, **send_kwargs):
+        self.client = client
+        self.chat_id = chat_id
+        self.edit_interval = edit_interval
+        self.limit = limit
+        self.max_flood_wait = max_flood_wait
+        self.send_kwargs = send_kwargs
+        self._messages = [message]
+        self._shown = [getattr(message, 'message', None)]
+        self._text = ''
+        self._link_map = {}
+        self._final = False
+        self._changed = asyncio.Event()
+        self._next_call = 0.0
+        self._task = None
+        self.edits = 0
+
+    @property
+    def messages(self) -> list:
+        return list(self._messages)
+
+    def start(self):
+        """Start the background editor task."""
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    def update(self, text: str, link_map: dict = None):
+        """Record the text generated so far. Cheap; safe to call for every stream chunk."""
+        self._text = text
+        if link_map is not None:
+            self._link_map = link_map
+        self._changed.set()
+
+    async def finish(self, text: str, link_map: dict = None) -> list:
+        """Render the complete text and wait until every message shows it.
+
+        Returns:
+            list: The messages the text ended up in
+        """
+        self.update(text, link_map)
+        self._final = True
+        self.start()
+        await self._task
+        return self.messages
+
+    async def cancel(self):
+        """Stop editing without rendering anything further."""
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+
+    def render(self, final: bool = False) -> list:
+        """Message texts for the current state of the stream."""
+        text = self._text
+        if not final:
+            text = PARTIAL_REFERENCE_RE.sub('', text)
+        text = link_references(text.strip(), self._link_map)
+        if not final:
+            text += CURSOR
+        return split_message(text, self.limit)
+
+    async def _run(self):
+        while True:
+            await self._changed.wait()
+            self._changed.clear()
+            delay = self._next_call - time.monotonic()
+            if delay > 0:
+                # Updates arriving meanwhile are folded into this render
+                await asyncio.sleep(delay)
+            final = self._final
+            try:
+                await self._render(final)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                if final:
+                    raise
+                logger.warning(f"Progressive edit for chat {self.chat_id} failed, will retry on next update: {e}")
+            if final:
+                return
+
+    async def _render(self, final: bool):
+        chunks = self.render(final)
+        for index, chunk in enumerate(chunks):
+            if index < len(self._shown) and self._shown[index] == chunk:
+                continue
+            await self._apply(index, chunk)
+        if final and len(self._messages) > len(chunks):
+            # The text shrank (e.g. trailing whitespace); drop follow-ups that are no longer needed
+            for message in self._messages[len(chunks):]:
+                try:
+                    await message.delete()
+                except Exception as e:
+                    logger.warning(f"Could not delete surplus streamed message in chat {self.chat_id}: {e}")
+            del self._messages[len(chunks):]
+            del self._shown[len(chunks):]
+
+    async def _apply(self, index: int, chunk: str):
+        while True:
+            delay = self._next_call - time.monotonic()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            self._next_call = time.monotonic() + self.edit_interval
+            op = 'edit' if index < len(self._messages) else 'send'
+            started = time.perf_counter()
+            try:
+                if index < len(self._messages):
+                    try:
+                        await self._messages[index].edit(chunk, **self.send_kwargs)
+                    except telethon.errors.MessageNotModifiedError:
+                        pass
+                    except telethon.errors.MessageIdInvalidError:
+                        # The message was deleted meanwhile; continue in a new one
+                        self._messages[index] = await self.client.send_message(self.chat_id, chunk, **self.send_kwargs)
+                    self._shown[index] = chunk
+                else:
+                    self._messages.append(await self.client.send_message(self.chat_id, chunk, **self.send_kwargs))
+                    self._shown.append(chunk)
+                self.edits += 1
+                SEND_SECONDS.labels(op).observe(time.perf_counter() - started)
+                SENDS.labels(op, 'ok').inc()
+                return
+            except telethon.errors.FloodWaitError as e:
+                SENDS.labels(op, 'flood_wait').inc()
+                if e.seconds > self.max_flood_wait:
+                    raise
+                logger.warning(f"FloodWait while streaming to chat {self.chat_id}: waiting {e.seconds}s")
+                self._next_call = time.monotonic() + e.seconds
+            except Exception:
+                SENDS.labels(op, 'error').inc()
+                raise
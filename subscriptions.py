@@ -0,0 +1,58 @@
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+def numbered_channels(channels) -> list:
+    """Monitored channels in the stable order /channels numbers them in (by title)."""
+    return sorted(channels, key=lambda channel: ((channel.title or '').lower(), channel.id))
+
+
+def parse_channel_args(args, channels):
+    """Match /subscribe and /unsubscribe arguments against the numbered channel list.
+
+    Arguments are numbers from /channels, @usernames, numeric channel IDs or "all".
+
+    Returns:
+        tuple: (set of matched channel IDs, list of arguments that matched nothing)
+    """
+    ordered = numbered_channels(channels)
+    by_username = {channel.username.lower(): channel for channel in ordered if channel.username}
+    by_id = {str(channel.id): channel for channel in ordered}
+    matched = set()
+    unknown = []
+    for arg in args:
+        arg = arg.strip().rstrip(',')
+        if not arg:
+            continue
+        if arg.lower() in ('all', 'все'):
+            matched.update(by_id)
+            continue
+        channel = by_username.get(arg.lstrip('@').lower()) or by_id.get(arg.removeprefix('-100'))
+        if channel is None and arg.isdigit() and 1 <= int(arg) <= len(ordered):
+            channel = ordered[int(arg) - 1]
+        if channel is None:
+            unknown.append(arg)
+        else:
+            matched.add(str(channel.id))
+    return matched, unknown
+
+
+def group_by_channel_set(user_ids, subscriptions: dict, channel_ids) -> dict:
+    """Group users whose digests would be identical.
+
+    Users without subscriptions get every monitored channel; subscriptions to
+    channels no longer monitored are ignored. Users left with no channel are
+    not included.
+
+    Returns:
+        dict: frozenset of channel IDs -> list of user IDs
+    """
+    monitored = frozenset(channel_ids)
+    groups = {}
+    for user_id in user_ids:
+        chosen = subscriptions.get(user_id)
+        key = monitored & frozenset(chosen) if chosen else monitored
+        if key:
+            groups.setdefault(key, []).append(user_id)
+    return groups
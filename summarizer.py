@@ -0,0 +1,354 @@
+import asyncio
+import logging
+import re
+import threading
+import time
+from datetime import datetime
+
+from compaction import PromptCompactor
+from metrics import OPENAI_ERRORS, OPENAI_SECONDS, OPENAI_TOKENS
+
+logger = logging.getLogger(__name__)
+
+REFERENCE_RE = re.compile(r'\[(\d+)\]')
+
+
+class LazyClient:
+    """Stands in for the client returned by `factory()`, built on first use.
+
+    Importing the OpenAI SDK takes about a second, so the bot starts without
+    it; call get() from a worker thread (loop.run_in_executor) to build the
+    client in the background before the first digest needs it.
+    """
+
+    def __init__(self, factory):
+        self._factory = factory
+        self._client = None
+        self._lock = threading.Lock()
+
+    def get(self):
+        if self._client is None:
+            with self._lock:
+                if self._client is None:
+                    self._client = self._factory()
+        return self._client
+
+    def __getattr__(self, name):
+        return getattr(self.get(), name)
+
+
+class Summarizer:
+    """Token-budgeted map-reduce summarization of posts.
+
+    Stages, each usable on its own:
+      1. prepare()        - number posts globally as [1]..[n] and build the link map
+      2. build_batches()  - pack numbered posts into batches of at most `batch_tokens`
+      3. map_batches()    - summarize batches concurrently (at most `max_concurrency` calls)
+      4. reduce()         - merge partial digests, keeping the global [n] references
+
+    A backlog that fits in one batch is summarized with a single call, exactly
+    as before. With a `grouper` (e.g. clustering.group_posts) posts are ordered
+    by topic before numbering and each topic starts with a header line, so the
+    model sees related posts from different channels together and batches of a
+    large backlog stay topically coherent. `client` is any object with an OpenAI-compatible async
+    `chat.completions.create`, so the stages can be run against a local fake
+    endpoint by pointing the OpenAI client's base_url at it.
+
+    Posts enter the prompt in their compacted form (see compaction.py) without
+    their links, which only live in the link map. Entries carry their token
+    count, taken from the count stored at ingestion, so batches are packed
+    from those counts without tokenizing the posts again.
+    """
+
+    def __init__(self, client, model: str, prompt: str, reduce_prompt: str,
+                 batch_tokens: int = 12000, max_concurrency: int = 4, max_tokens: int = 3000,
+                 temperature: float = 0.7, grouper=None, compactor: PromptCompactor = None):
+        self.client = client
+        self.model = model
+        self.prompt = prompt
+        self.reduce_prompt = reduce_prompt
+        self.batch_tokens = batch_tokens
+        self.max_concurrency = max_concurrency
+        self.max_tokens = max_tokens
+        self.temperature = temperature
+        self.grouper = grouper
+        self.compactor = compactor or PromptCompactor(model)
+
+    # --- stage 1 ---
+
+    def prepare(self, posts, start: int = 1, duplicate_of: dict = None, prompt_texts: dict = None):
+        """Format posts for the prompt, numbering them from `start`.
+
+        Near-duplicates (post ID -> canonical post link in `duplicate_of`) are
+        not repeated: the first post of each duplicate group carries the text,
+        the others only add their reference number and channel to it.
+
+        `prompt_texts` maps post IDs to the (compacted text, token count) stored
+        at ingestion; other posts are compacted here.
+
+        Returns:
+            tuple: (entries, link_map) where entries is a list of (number, text, tokens)
+            and link_map maps the same numbers to post links
+        """
+        duplicate_of = duplicate_of or {}
+        prompt_texts = prompt_texts or {}
+        count = self.compactor.count
+        entries = []
+        link_map = {}
+        group_entry = {}  # canonical link -> index in entries
+        for i, post in enumerate(posts):
+            try:
+                if len(post) != 5:
+                    logger.warning(f"Skipping post in summarize_posts due to invalid format (expected 5): {post}")
+                    continue
+
+                post_id, channel_title, timestamp, content, post_link = post
+
+                try:
+                    time_str = datetime.fromisoformat(timestamp).strftime('%H:%M')
+                except ValueError:
+                    logger.warning(f"Skipping post with invalid timestamp: {timestamp}")
+                    continue
+
+                number = start + i
+                link_map[number] = post_link
+                group = duplicate_of.get(post_id) or post_link
+                if group in group_entry:
+                    index = group_entry[group]
+                    entry_number, text, tokens = entries[index]
+                    separator = ", " if "\n   Also reported by:" in text else "\n   Also reported by: "
+                    addition = f"{separator}[{number}] [{channel_title}]"
+                    entries[index] = (entry_number, text + addition, tokens + count(addition))
+                    continue
+                group_entry[group] = len(entries)
+                stored = prompt_texts.get(post_id)
+                prompt_text, prompt_tokens = stored if stored is not None else self.compactor.compact(content)
+                prefix = f"[{number}] [{time_str}] [{channel_title}] "
+                entries.append((number, prefix + prompt_text, count(prefix) + prompt_tokens))
+            except Exception as e:
+                logger.error(f"Error formatting post for summary: {e}")
+                continue
+        return entries, link_map
+
+    async def group(self, posts):
+        """Order posts by topic with `grouper`.
+
+        Returns:
+            tuple: (posts in topic order, {post ID: topic header} for the first post of each topic)
+        """
+        if self.grouper is None or len(posts) < 2:
+            return posts, {}
+        try:
+            groups = await asyncio.to_thread(self.grouper, posts)
+        except Exception as e:
+            logger.error(f"[summarize_posts] Topic grouping failed, keeping original order: {e}")
+            return posts, {}
+        ordered = []
+        headers = {}
+        for i, (terms, topic_posts) in enumerate(groups, start=1):
+            headers[topic_posts[0][0]] = f"### Topic group {i}: {', '.join(terms) if terms else 'misc'}"
+            ordered.extend(topic_posts)
+        return ordered, headers
+
+    def add_group_headers(self, entries, posts, headers, start: int = 1):
+        """Prefix the entry of each topic's first post with its header line."""
+        if not headers:
+            return entries
+        header_by_number = {start + i: headers[post[0]] + "\n" for i, post in enumerate(posts) if post[0] in headers}
+        return [
+            (number, header_by_number[number] + text, self.compactor.count(header_by_number[number]) + tokens)
+            if number in header_by_number else (number, text, tokens)
+            for number, text, tokens in entries
+        ]
+
+    # --- stage 2 ---
+
+    def posts_budget(self, prompt: str = None) -> int:
+        """Tokens available for post text in one call after the system prompt."""
+        return max(1, self.batch_tokens - self.compactor.count(prompt or self.prompt))
+
+    def build_batches(self, entries):
+        """Split numbered entries into consecutive batches that each fit the token budget.
+
+        Packing adds up the entries' token counts plus the blank line that joins
+        them, so a batch is filled up to the budget. A single entry bigger than
+        the whole budget is truncated to fit.
+        """
+        budget = self.posts_budget()
+        separator_tokens = self.compactor.count("\n\n")
+        batches = []
+        current = []
+        current_tokens = 0
+        for number, text, tokens in entries:
+            if tokens > budget:
+                text = self.compactor.truncate(text, budget)
+                tokens = self.compactor.count(text)
+                logger.warning(f"[summarize_posts] Post [{number}] exceeds the batch budget, truncated")
+            if current and current_tokens + separator_tokens + tokens > budget:
+                batches.append(current)
+                current = []
+                current_tokens = 0
+            current_tokens += tokens + (separator_tokens if current else 0)
+            current.append((number, text, tokens))
+        if current:
+            batches.append(current)
+        return batches
+
+    # --- stages 3 and 4 ---
+
+    async def _complete(self, system_prompt: str, user_text: str, on_text=None) -> str:
+        """One chat completion. With `on_text`, the response is streamed and
+        `on_text(text_so_far)` is called after every received chunk.
+
+        Duration, errors and token usage are recorded in the tgdigest_openai_* metrics.
+        """
+        stream = 'true' if on_text is not None else 'false'
+        started = time.perf_counter()
+        try:
+            text, usage = await self._request(system_prompt, user_text, on_text)
+        except Exception:
+            OPENAI_ERRORS.labels(self.model, stream).inc()
+            raise
+        finally:
+            OPENAI_SECONDS.labels(self.model, stream).observe(time.perf_counter() - started)
+        if usage is not None:
+            prompt_tokens, completion_tokens = usage.prompt_tokens, usage.completion_tokens
+        else:
+            # Streams report no usage unless asked to; estimate like the batch budgeting does
+            prompt_tokens = self.compactor.count(system_prompt) + self.compactor.count(user_text)
+            completion_tokens = self.compactor.count(text)
+        OPENAI_TOKENS.labels(self.model, 'prompt').inc(prompt_tokens or 0)
+        OPENAI_TOKENS.labels(self.model, 'completion').inc(completion_tokens or 0)
+        return text
+
+    async def _request(self, system_prompt: str, user_text: str, on_text=None):
+        """Returns (text, usage or None)."""
+        kwargs = dict(
+            model=self.model,
+            messages=[
+                {"role": "system", "content": system_prompt},
+                {"role": "user", "content": user_text}
+            ],
+            temperature=self.temperature,
+            max_tokens=self.max_tokens
+        )
+        if on_text is None:
+            response = await self.client.chat.completions.create(**kwargs)
+            return (response.choices[0].message.content or '').strip(), getattr(response, 'usage', None)
+        text = ''
+        usage = None
+        stream = await self.client.chat.completions.create(stream=True, **kwargs)
+        async for chunk in stream:
+            usage = getattr(chunk, 'usage', None) or usage
+            delta = chunk.choices[0].delta.content if chunk.choices else None
+            if delta:
+                text += delta
+                on_text(text)
+        return text.strip(), usage
+
+    async def _bounded(self, semaphore, system_prompt: str, user_text: str, on_text=None) -> str:
+        async with semaphore:
+            return await self._complete(system_prompt, user_text, on_text)
+
+    async def summarize_batch(self, batch, on_text=None) -> str:
+        """Summarize one batch of numbered entries with the regular digest prompt."""
+        return await self._complete(self.prompt, "\n\n".join(text for _, text, _ in batch), on_text)
+
+    async def map_batches(self, batches):
+        """Summarize each batch with the regular digest prompt, at most `max_concurrency` at a time."""
+        semaphore = asyncio.Semaphore(self.max_concurrency)
+
+        async def bounded(batch):
+            async with semaphore:
+                return await self.summarize_batch(batch)
+
+        return list(await asyncio.gather(*(bounded(batch) for batch in batches)))
+
+    async def reduce(self, partials, on_text=None):
+        """Merge partial digests into one.
+
+        Partials that together exceed the budget are merged in groups first,
+        and the group results merged again, until one digest remains. Only the
+        final merge is streamed to `on_text`.
+        """
+        semaphore = asyncio.Semaphore(self.max_concurrency)
+        budget = self.posts_budget(self.reduce_prompt)
+        level = 0
+        while len(partials) > 1:
+            level += 1
+            groups = []
+            current = []
+            current_tokens = 0
+            for partial in partials:
+                tokens = self.compactor.count(partial)
+                if current and current_tokens + tokens > budget:
+                    groups.append(current)
+                    current = []
+                    current_tokens = 0
+                current.append(partial)
+                current_tokens += tokens
+            groups.append(current)
+            if len(groups) == len(partials):
+                # Every partial fills the budget alone; merge pairwise so the loop always shrinks
+                groups = [partials[i:i + 2] for i in range(0, len(partials), 2)]
+            logger.info(f"[summarize_posts] Reduce level {level}: {len(partials)} partial digests in {len(groups)} groups")
+            final_text = on_text if len(groups) == 1 else None
+            tasks = [
+                self._bounded(semaphore, self.reduce_prompt, self._join_partials(group), final_text)
+                if len(group) > 1 else self._passthrough(group[0])
+                for group in groups
+            ]
+            partials = list(await asyncio.gather(*tasks))
+        return partials[0]
+
+    @staticmethod
+    async def _passthrough(partial: str) -> str:
+        return partial
+
+    @staticmethod
+    def _join_partials(partials) -> str:
+        return "\n\n".join(f"--- Partial digest {i+1} ---\n{partial}" for i, partial in enumerate(partials))
+
+    # --- pipeline ---
+
+    async def summarize(self, posts, duplicate_of: dict = None, on_text=None, prompt_texts: dict = None):
+        """Run the whole pipeline. Returns (summary, link_map) or (None, None).
+
+        With `on_text`, the call that produces the final digest (the only map
+        call, or the last reduce) is streamed and `on_text(text_so_far, link_map)`
+        is called as it grows.
+        """
+        if not posts:
+            logger.info("[summarize_posts] No posts received, returning None, None.")
+            return None, None
+
+        posts, headers = await self.group(posts)
+        entries, link_map = self.prepare(posts, duplicate_of=duplicate_of, prompt_texts=prompt_texts)
+        entries = self.add_group_headers(entries, posts, headers)
+        if not entries:
+            logger.warning("[summarize_posts] No valid posts to format for prompt, returning None, None.")
+            return None, None
+
+        batches = self.build_batches(entries)
+        logger.info(
+            f"[summarize_posts] Calling OpenAI API with {len(entries)} formatted posts "
+            f"({sum(tokens for _, _, tokens in entries)} tokens) in {len(batches)} batch(es)."
+        )
+        stream = (lambda text: on_text(text, link_map)) if on_text else None
+        if len(batches) == 1:
+            summary = await self.summarize_batch(batches[0], stream)
+        else:
+            summary = await self.reduce(await self.map_batches(batches), stream)
+
+        unknown_refs = {int(n) for n in REFERENCE_RE.findall(summary)} - set(link_map)
+        if unknown_refs:
+            logger.warning(f"[summarize_posts] Summary references unknown posts: {sorted(unknown_refs)}")
+
+        logger.info(f"[summarize_posts] OpenAI response received. Summary length: {len(summary) if summary else 0}")
+        logger.info(f"[summarize_posts] Summary snippet: {summary[:200] if summary else 'N/A'} ...")
+        logger.debug(f"[summarize_posts] Link map generated: {link_map}")
+
+        if summary.endswith('...') or summary.endswith('…'):
+            logger.warning("Summary appears to be truncated. Consider increasing max_tokens.")
+
+        return summary, link_map
@@ -0,0 +1,100 @@
+"""Digest worker entry point: runs digest jobs queued by the bot (DIGEST_WORKERS_ENABLED).
+
+    python worker.py [--processes N] [--concurrency M]
+
+Every process leases jobs from the shared database independently; jobs of a
+process that dies are reclaimed by the others once their lease expires.
+"""
+import argparse
+import asyncio
+import logging
+import multiprocessing
+import signal
+
+from config import settings
+from jobs import JobWorker
+from main import storage, presummarizer, generate_digest, load_tokenizer
+
+logger = logging.getLogger(__name__)
+
+
+async def run_digest_job(payload: dict) -> dict:
+    """Generate (or fetch from the digest cache) the digest of the job's posts."""
+    posts = await storage.get_posts_by_ids(payload['post_ids'])
+    if not posts:
+        raise ValueError("None of the job's posts exist any more")
+    summary, link_map = await generate_digest(posts, payload['cache_key'])
+    if not summary:
+        raise RuntimeError("Summarizer returned no digest")
+    return {'summary': summary, 'link_map': link_map}
+
+
+async def run_worker(index: int, concurrency: int):
+    await storage.open()
+    # Batches are packed from token counts stored at ingestion: count with the same tokenizer
+    await load_tokenizer()
+    worker = JobWorker(
+        storage, {'digest': run_digest_job},
+        concurrency=concurrency,
+        lease_seconds=settings.job_lease_seconds,
+        heartbeat_seconds=settings.job_heartbeat_seconds,
+    )
+    tasks = [asyncio.create_task(worker.run())]
+    if settings.presummary_enabled and index == 0:
+        # One process pre-summarizes, so micro-summaries are not generated twice
+        tasks.append(asyncio.create_task(presummarizer.run()))
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGTERM, signal.SIGINT):
+        loop.add_signal_handler(sig, lambda: [task.cancel() for task in tasks])
+    try:
+        await asyncio.gather(*tasks)
+    except asyncio.CancelledError:
+        pass
+    finally:
+        logger.info(f"Worker {worker.worker_id} stopped ({worker.completed} completed, {worker.failed} failed)")
+        await storage.close()
+
+
+def worker_process(index: int, concurrency: int):
+    asyncio.run(run_worker(index, concurrency))
+
+
+async def migrate():
+    # Migrate once before starting the processes, so they never race on a pending migration
+    await storage.open()
+    await storage.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--processes', type=int, default=settings.digest_worker_processes)
+    parser.add_argument('--concurrency', type=int, default=settings.digest_worker_concurrency, help='jobs per process')
+    args = parser.parse_args()
+
+    asyncio.run(migrate())
+    if args.processes <= 1:
+        worker_process(0, args.concurrency)
+        return
+
+    context = multiprocessing.get_context('spawn')
+    processes = [
+        context.Process(target=worker_process, args=(index, args.concurrency), name=f'digest-worker-{index}')
+        for index in range(args.processes)
+    ]
+    for process in processes:
+        process.start()
+    logger.info(f"Started {len(processes)} digest worker processes")
+
+    def stop(signum, frame):
+        for process in processes:
+            if process.is_alive():
+                process.terminate()
+
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+    for process in processes:
+        process.join()
+
+
+if __name__ == '__main__':
+    main()